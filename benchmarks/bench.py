@@ -0,0 +1,169 @@
+""" benchmark suite for the analytics entry points
+
+run from the root of the app directory:
+    python -m benchmarks.bench --habits 200 --days 730
+"""
+
+import tracker.analytics as analytics
+from tracker.db import DB
+from benchmarks.generate import generate
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tracker.py")
+
+_LAST_MONTH_END = date.today().replace(day=1) - timedelta(days=1)
+
+BENCHMARKS = {
+    "habits": lambda db: analytics.habits(db),
+    "past_progress": lambda db: analytics.past_progress(db, 1, True),
+    "past_streaks": lambda db: analytics.past_streaks(db, 1),
+    "max_streak": lambda db: analytics.max_streak(db),
+    "max_break": lambda db: analytics.max_break(db),
+    "completion_rate": lambda db: analytics.completion_rate(db),
+    "completion_rate_last_month": lambda db: analytics.completion_rate(db, _LAST_MONTH_END.replace(day=1), _LAST_MONTH_END),
+}
+
+
+def _measure(func, db : DB, repeat : int) -> dict:
+    """ returns latency statistics (ms) and peak memory (KiB) of a single benchmark """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(db)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # separate run, as tracing allocations slows down execution
+    tracemalloc.start()
+    func(db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"min_ms": round(min(timings), 3), "median_ms": round(statistics.median(timings), 3),
+            "max_ms": round(max(timings), 3), "peak_kib": round(peak / 1024, 1)}
+
+
+# name -> command line arguments of a single request, started in a new process
+STARTUP = {
+    "cold_start_progress": ["progress", "habit 1"],
+}
+
+
+def _measure_startup(argv : list, folder : str, repeat : int) -> dict:
+    """ returns latency statistics (ms) of running the app for a single request against the database in folder """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, APP] + argv, cwd=folder, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"min_ms": round(min(timings), 3), "median_ms": round(statistics.median(timings), 3), "max_ms": round(max(timings), 3)}
+
+
+def run(config : dict, repeat : int = 5, only = None) -> dict:
+    """ generates a database for the given configuration and measures all benchmarks
+    Args:
+        config: keyword arguments for 'generate'
+        repeat: number of timed runs per benchmark
+        only: optional list of benchmark names to run
+    """
+
+    results = {"config": config, "benchmarks": {}}
+
+    with tempfile.TemporaryDirectory() as folder:
+        # default file name of the app, to measure its startup as well
+        with DB(os.path.join(folder, "habits.db")) as db:
+            db.assure_database()
+
+            start = time.perf_counter()
+            results["progress_rows"] = generate(db, **config)
+            results["generate_s"] = round(time.perf_counter() - start, 3)
+
+            for name, func in BENCHMARKS.items():
+                if only and name not in only:
+                    continue
+
+                results["benchmarks"][name] = _measure(func, db, repeat)
+
+        for name, argv in STARTUP.items():
+            if only and name not in only:
+                continue
+
+            results["benchmarks"][name] = _measure_startup(argv, folder, repeat)
+
+    return results
+
+
+def compare(results : dict, baseline : dict, tolerance : float) -> list:
+    """ returns regressions compared to a baseline with the same configuration
+    Args:
+        results: results of 'run'
+        baseline: previous results of 'run'
+        tolerance: allowed relative slowdown of the median latency, e.g., 0.5 for 50 %
+    """
+
+    if baseline.get("config") != results["config"]:
+        return []
+
+    regressions = []
+
+    for name, result in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before and result["median_ms"] > before["median_ms"] * (1 + tolerance):
+            regressions.append({"benchmark": name, "baseline_ms": before["median_ms"], "median_ms": result["median_ms"]})
+
+    return regressions
+
+
+def _parse_periods(input : str) -> tuple:
+    return tuple(int(p) for p in input.split(","))
+
+
+def main(argv = None) -> int:
+
+    parser = argparse.ArgumentParser(description="benchmark the analytics entry points against a synthetic database")
+    parser.add_argument("--habits", help="number of habits", type=int, default=100)
+    parser.add_argument("--periods", help="comma separated period lengths to distribute the habits over", type=_parse_periods, default=(1, 7, 14, 30))
+    parser.add_argument("--days", help="days of history per habit", type=int, default=365)
+    parser.add_argument("--success_rate", help="percentage of completed periods", type=int, default=70)
+    parser.add_argument("--seed", help="seed for the random generator", type=int, default=0)
+    parser.add_argument("--repeat", help="timed runs per benchmark", type=int, default=5)
+    parser.add_argument("--only", help="comma separated names of benchmarks to run", type=lambda i: i.split(","))
+    parser.add_argument("--baseline", help="baseline file to compare with", default=BASELINE)
+    parser.add_argument("--tolerance", help="allowed relative slowdown before reporting a regression", type=float, default=0.5)
+    parser.add_argument("--save", help="store the results as new baseline", action='store_true')
+
+    args = parser.parse_args(argv)
+
+    config = {"habits": args.habits, "periods": list(args.periods), "days": args.days, "success_rate": args.success_rate, "seed": args.seed}
+
+    results = run(config, args.repeat, args.only)
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            results["regressions"] = compare(results, json.load(f), args.tolerance)
+
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in results.items() if k != "regressions"}, f, indent=2)
+
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+from tracker.db import DB
+from tracker.habit import Habit
+
+import random
+from datetime import date, datetime, timedelta
+
+
+def _progress(habits : list, days : int, success_rate : int, rng : random.Random):
+    """ progress generator, yielding one check-off per completed period
+    Args:
+        habits: list of (habit id, period length)
+        days: number of days of history
+        success_rate: percentage of completed periods (0-100)
+    """
+
+    first_day = datetime.combine(date.today(), datetime.min.time()) - timedelta(days=days)
+
+    for habit_id, period in habits:
+        for start in range(0, days, period):
+            if rng.randrange(100) < success_rate:
+                day = start + rng.randrange(min(period, days - start))
+                yield habit_id, first_day + timedelta(days=day, minutes=rng.randrange(1, 24 * 60)), 1
+
+
+def generate(db : DB, habits : int = 100, periods = (1, 7, 14, 30), days : int = 365, success_rate : int = 70, seed : int = 0) -> int:
+    """ fills a database with synthetic habits and progress
+    Args:
+        db: empty database
+        habits: number of habits
+        periods: period lengths to distribute the habits over
+        days: number of days of history per habit
+        success_rate: percentage of completed periods (0-100)
+        seed: seed for the random generator
+    Returns:
+        number of progress rows
+    """
+
+    rng = random.Random(seed)
+
+    created = []
+    for i in range(habits):
+        period = periods[i % len(periods)]
+        habit = Habit("habit {0}".format(i + 1), "synthetic task", period)
+        created.append((db.save_habit(habit), period))
+
+    return db.import_progress(_progress(created, days, success_rate, rng))
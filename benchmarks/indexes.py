@@ -0,0 +1,118 @@
+""" compares query plans and latency of the statements backed by the progress and habit indexes,
+with the current schema ('after') and with the single (habit_id, progress_date) index of schema version 2 ('before')
+
+run from the root of the app directory:
+    python -m benchmarks.indexes --habits 200 --days 730
+"""
+
+from tracker.db import DB, _periods_query
+from benchmarks.generate import generate
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+# name -> (statement, parameters per habit), where {running} is replaced by the index hint of the current schema
+CASES = {
+    "running_timer": ('''SELECT progress_date FROM progress {running} WHERE habit_id = :habit_id AND amount = 0''', lambda id, period: {"habit_id": id}),
+    "first_progress": ('''SELECT MIN(progress_date) FROM progress WHERE habit_id = :habit_id''', lambda id, period: {"habit_id": id}),
+    "period_sums": (_periods_query(habit_filter=True), lambda id, period: {"habit_id": id}),
+    "habits_by_period": ('''SELECT * FROM habit WHERE period = :period ORDER BY name''', lambda id, period: {"period": period}),
+    "habit_by_name": ('''SELECT id FROM habit WHERE name = :name''', lambda id, period: {"name": "habit {0}".format(id)}),
+}
+
+_NEW_INDEXES = ("INDEX_habit_period_name", "INDEX_progress_habit_date_amount", "INDEX_progress_running")
+
+
+def _measure(cmd, sql : str, parameters : list, repeat : int) -> dict:
+    """ returns the query plan and latency statistics (ms) of executing a statement once for every habit """
+
+    plan = [row[-1] for row in cmd.execute("EXPLAIN QUERY PLAN " + sql, parameters[0]).fetchall()]
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for params in parameters:
+            cmd.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"plan": sorted(set(plan)), "median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3)}
+
+
+def _measure_all(cmd, running : str, habits : list, repeat : int, only) -> dict:
+    return {name: _measure(cmd, sql.format(running=running), [params(*habit) for habit in habits], repeat)
+            for name, (sql, params) in CASES.items() if not only or name in only}
+
+
+def run(config : dict, repeat : int = 5, only = None) -> dict:
+    """ generates a database for the given configuration and measures all cases before and after the index migration
+    Args:
+        config: keyword arguments for 'generate'
+        repeat: number of timed runs per case
+        only: optional list of case names to run
+    """
+
+    results = {"config": config, "cases": {}}
+
+    with tempfile.TemporaryDirectory() as folder:
+        with DB(os.path.join(folder, "benchmark.db")) as db:
+            db.assure_database()
+
+            results["progress_rows"] = generate(db, **config)
+
+            with db._connect() as conn:
+                with closing(conn.cursor()) as cmd:
+
+                    # every habit has a running timer among its regular progress
+                    cmd.execute('''INSERT INTO progress (habit_id, progress_date, amount) SELECT id, CAST(strftime('%s', 'now', 'localtime') AS INTEGER), 0 FROM habit''')
+                    conn.commit()
+
+                    habits = cmd.execute('''SELECT id, period FROM habit ORDER BY id''').fetchall()
+
+                    after = _measure_all(cmd, "INDEXED BY INDEX_progress_running", habits, repeat, only)
+
+                    for index in _NEW_INDEXES:
+                        cmd.execute('''DROP INDEX {0}'''.format(index))
+                    cmd.execute('''CREATE INDEX INDEX_progress_habit_date ON progress(habit_id, progress_date)''')
+                    conn.commit()
+
+                    before = _measure_all(cmd, "", habits, repeat, only)
+
+    for name in after:
+        results["cases"][name] = {"before": before[name], "after": after[name],
+                                  "speedup": round(before[name]["median_ms"] / after[name]["median_ms"], 2) if after[name]["median_ms"] else None}
+
+    return results
+
+
+def _parse_periods(input : str) -> tuple:
+    return tuple(int(p) for p in input.split(","))
+
+
+def main(argv = None) -> int:
+
+    parser = argparse.ArgumentParser(description="compare query plans and latency before and after the index migration")
+    parser.add_argument("--habits", help="number of habits", type=int, default=100)
+    parser.add_argument("--periods", help="comma separated period lengths to distribute the habits over", type=_parse_periods, default=(1, 7, 14, 30))
+    parser.add_argument("--days", help="days of history per habit", type=int, default=365)
+    parser.add_argument("--success_rate", help="percentage of completed periods", type=int, default=70)
+    parser.add_argument("--seed", help="seed for the random generator", type=int, default=0)
+    parser.add_argument("--repeat", help="timed runs per case", type=int, default=5)
+    parser.add_argument("--only", help="comma separated names of cases to run", type=lambda i: i.split(","))
+
+    args = parser.parse_args(argv)
+
+    config = {"habits": args.habits, "periods": list(args.periods), "days": args.days, "success_rate": args.success_rate, "seed": args.seed}
+
+    print(json.dumps(run(config, args.repeat, args.only), indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
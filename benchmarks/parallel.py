@@ -0,0 +1,113 @@
+""" compares the latency of analyses over all habits computed sequentially ('sequential')
+and in a pool of processes with their own read-only connections (one result per number of workers)
+
+run from the root of the app directory (the speedup depends on the number of available cpus):
+    python -m benchmarks.parallel --habits 400 --days 730 --workers 2,4
+"""
+
+import tracker.analytics as analytics
+from tracker.db import DB
+from benchmarks.generate import generate
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+_LAST_MONTH_END = date.today().replace(day=1) - timedelta(days=1)
+
+CASES = {
+    "max_streak": lambda db: analytics.max_streak(db),
+    "max_break": lambda db: analytics.max_break(db),
+    "completion_rate": lambda db: analytics.completion_rate(db),
+    "completion_rate_last_month": lambda db: analytics.completion_rate(db, _LAST_MONTH_END.replace(day=1), _LAST_MONTH_END),
+}
+
+
+def _measure(func, db : DB, repeat : int) -> dict:
+    """ returns latency statistics (ms) of a single case """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(db)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3)}
+
+
+def _measure_all(db : DB, repeat : int, only) -> dict:
+    return {name: _measure(func, db, repeat) for name, func in CASES.items() if not only or name in only}
+
+
+def run(config : dict, workers : list, repeat : int = 5, only = None) -> dict:
+    """ generates a database for the given configuration and measures all cases sequentially and in parallel
+    Args:
+        config: keyword arguments for 'generate'
+        workers: numbers of worker processes to compare
+        repeat: number of timed runs per case
+        only: optional list of case names to run
+    """
+
+    results = {"config": config, "cpus": os.cpu_count(), "cases": {}}
+
+    with tempfile.TemporaryDirectory() as folder:
+        with DB(os.path.join(folder, "benchmark.db")) as db:
+            db.assure_database()
+
+            results["progress_rows"] = generate(db, **config)
+
+            sequential = _measure_all(db, repeat, only)
+
+            parallel = {}
+            for count in workers:
+                analytics.enable_parallel(count)
+                try:
+                    # start the processes before measuring
+                    analytics.max_streak(db)
+
+                    parallel[count] = _measure_all(db, repeat, only)
+                finally:
+                    analytics.disable_parallel()
+
+    for name in sequential:
+        results["cases"][name] = {"sequential": sequential[name]}
+
+        for count in workers:
+            results["cases"][name]["workers_{0}".format(count)] = dict(parallel[count][name],
+                speedup=round(sequential[name]["median_ms"] / parallel[count][name]["median_ms"], 2) if parallel[count][name]["median_ms"] else None)
+
+    return results
+
+
+def _parse_numbers(input : str) -> tuple:
+    return tuple(int(p) for p in input.split(","))
+
+
+def main(argv = None) -> int:
+
+    parser = argparse.ArgumentParser(description="compare the latency of analyses computed sequentially and in a pool of processes")
+    parser.add_argument("--habits", help="number of habits", type=int, default=400)
+    parser.add_argument("--periods", help="comma separated period lengths to distribute the habits over", type=_parse_numbers, default=(1, 7, 14, 30))
+    parser.add_argument("--days", help="days of history per habit", type=int, default=365)
+    parser.add_argument("--success_rate", help="percentage of completed periods", type=int, default=70)
+    parser.add_argument("--seed", help="seed for the random generator", type=int, default=0)
+    parser.add_argument("--workers", help="comma separated numbers of worker processes to compare", type=_parse_numbers, default=(2, 4))
+    parser.add_argument("--repeat", help="timed runs per case", type=int, default=5)
+    parser.add_argument("--only", help="comma separated names of cases to run", type=lambda i: i.split(","))
+
+    args = parser.parse_args(argv)
+
+    config = {"habits": args.habits, "periods": list(args.periods), "days": args.days, "success_rate": args.success_rate, "seed": args.seed}
+
+    print(json.dumps(run(config, list(args.workers), args.repeat, args.only), indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
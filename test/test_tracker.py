@@ -1,12 +1,24 @@
 from tracker.db import DB
-from tracker.habit import Habit
+from tracker.habit import Habit, HabitState
 from tracker.progress import Progress
 from tracker.enums import TaskStatus
+from tracker.profiler import QueryProfiler
+from tracker.snapshot import Snapshot, write_snapshot
+from tracker.asyncdb import AsyncDB
 import tracker.request as request
 import tracker.analytics as analytics
+import tracker.server as server
 
-from contextlib import nullcontext
+from array import array
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
 import argparse
+import asyncio
+import json
+import sqlite3
+import subprocess
+import sys
 import pytest
 import os
 import datetime
@@ -23,6 +35,7 @@ def setup_and_teardown(db):
     """ create , test, and then delete database """
     db.assure_database()
     yield
+    db.close()
     os.remove(db._connection)
     
 
@@ -40,6 +53,8 @@ def setup_and_teardown(db):
         (True, argparse.Namespace(action="progress", habit="morning stretching", start=False, end=False, amount=1, date=None), "progress added"),
         (True, argparse.Namespace(action="reset", habit=4), "progress reset"),
         (True, argparse.Namespace(action="delete", habit=5), "habit deleted"),
+        (True, argparse.Namespace(action="import_progress", file="missing.csv", format=None, chunk_size="100", json=False), "[Errno 2] No such file or"),
+        (True, argparse.Namespace(action="rebuild", verify=True), "period summary rebuilt - 0 deviating periods"),
         (True, argparse.Namespace(action="list", period=None), "ID created name task period goal progress streak"),
         (True, argparse.Namespace(action="list", period=7), "ID created name task period goal progress streak"),
         (True, argparse.Namespace(action="list", period=120), "no results"),
@@ -53,6 +68,7 @@ def setup_and_teardown(db):
         (True, argparse.Namespace(action="analyze", analysis="max_streak", period=7, habit=None), "habit max streak from to"),
         (True, argparse.Namespace(action="analyze", analysis="max_streak", period=None, habit=1), "habit max streak from to"),
         (True, argparse.Namespace(action="analyze", analysis="max_streak", period=28, habit=None), "no results"),
+        (True, argparse.Namespace(action="analyze", analysis="max_streak", period=None, habit=None, snapshot="missing.snapshot"), "snapshot file not found"),
         (True, argparse.Namespace(action="analyze", analysis="max_break", period=None, habit=None), "habit max break from to"),
         (True, argparse.Namespace(action="analyze", analysis="max_break", period=1, habit=None), "habit max break from to"),
         (True, argparse.Namespace(action="analyze", analysis="max_break", period=None, habit=2), "habit max break from to"),
@@ -61,6 +77,9 @@ def setup_and_teardown(db):
         (True, argparse.Namespace(action="analyze", analysis="completion_rate", current_week=False, last_week=True), "habit completed out of rate"),
         (True, argparse.Namespace(action="analyze", analysis="completion_rate", current_month=True, last_month=False), "habit completed out of rate"),
         (True, argparse.Namespace(action="analyze", analysis="completion_rate", current_month=False, last_month=True), "habit completed out of rate"),
+        (True, argparse.Namespace(action="analyze", analysis="top_completion_rate", limit="2", lowest=True, current_month=False, last_month=True), "habit completed out of rate"),
+        (True, argparse.Namespace(action="analyze", analysis="top_current_streak", limit="3", period=None), "habit current streak"),
+        (True, argparse.Namespace(action="analyze", analysis="top_max_break", limit="3", period=120), "no results"),
     ],
 )
 def test_request_handler(db:DB, with_samples, args, expected_output, capfd):
@@ -79,6 +98,150 @@ def test_request_handler(db:DB, with_samples, args, expected_output, capfd):
         for i,o in enumerate(expected):
             assert output[i] == o     
 
+
+@pytest.mark.parametrize(
+    ("path", "params", "expected_argv"),
+    [
+        ("/list", [], ["list"]),
+        ("/analyze/max_streak", [("period", "week"), ("json", "")], ["analyze", "max_streak", "--period", "week", "--json"]),
+        ("/progress/morning%20stretching", [("amount", 3), ("start", False)], ["progress", "morning stretching", "--amount", "3"]),
+    ],
+)
+def test_server_arguments(path, params, expected_argv):
+    """ test translation of http requests into command line arguments """
+    assert server._to_argv(path, params) == expected_argv # <- tested method
+
+
+@pytest.mark.parametrize(
+    ("path", "params", "message"),
+    [
+        ("/analyze/max_streak", [("snapshot", "/tmp/periods.snapshot")], "only available on the command line"),
+        ("/analyze/past_progress/1", [("archive", "/etc/passwd")], "only available on the command line"),
+        ("/analyze/past_progress/1", [("arch", "/etc/passwd")], "only available on the command line"),
+        ("/analyze/max_streak/-S/%2Ftmp%2Fperiods.snapshot", [], "options have to be given as query parameters"),
+        ("/analyze/max_streak", [("period", "week"), ("snapshot=/tmp/periods.snapshot", "")], "invalid parameter"),
+        ("/list", [("help", "")], "help is not available over http"),
+        ("/list", [("he", "true")], "help is not available over http"),
+        ("/list/--help", [], "options have to be given as query parameters"),
+    ],
+)
+def test_server_arguments_rejected(path, params, message):
+    """ test that http requests cannot name files or ask for help """
+    with pytest.raises(ValueError, match=message):
+        server._to_argv(path, params) # <- tested method
+
+
+@pytest.mark.parametrize(
+    ("ex", "expected_status"),
+    [
+        (Exception("no habit found with name 'x'"), 400),
+        (ValueError("invalid date"), 400),
+        (sqlite3.IntegrityError("UNIQUE constraint failed: habit.name"), 400),
+        (sqlite3.OperationalError("database is locked"), 500),
+    ],
+)
+def test_server_error_status(ex, expected_status):
+    """ test that errors caused by the client are reported as bad requests """
+    assert server._error_status(ex) == expected_status # <- tested method
+
+
+def test_server(db:DB, caplog):
+    """ test json responses of the server over a keep-alive connection """
+    db.insert_samples()
+
+    def parse_request(argv):
+        if argv[0] == "delete":
+            return argparse.Namespace(action=argv[0], habit=argv[1])
+        if argv[0] != "list":
+            raise ValueError("invalid choice")
+        return argparse.Namespace(action=argv[0], period=None)
+
+    async def get(reader, writer, path, method = "GET", headers = ""):
+        writer.write("{0} {1} HTTP/1.1\r\nHost: localhost:8080\r\n{2}\r\n".format(method, path, headers).encode())
+        status = (await reader.readline()).split()[1]
+        headers = {}
+        while (line := await reader.readline()) != b"\r\n":
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        return int(status), json.loads(await reader.readexactly(int(headers["content-length"])))
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            srv = await server.start_server(db, parse_request, 0, executor) # <- tested method
+            async with srv:
+                reader, writer = await asyncio.open_connection(server.HOST, srv.sockets[0].getsockname()[1])
+
+                status, result = await get(reader, writer, "/list")
+                assert status == 200
+                assert len(result["result"]) == 5
+
+                status, result = await get(reader, writer, "/analyze/max_streak")
+                assert status == 400
+                assert result["error"] == "invalid choice"
+
+                status, result = await get(reader, writer, "/export/habits.csv")
+                assert status == 404
+
+                status, result = await get(reader, writer, "/delete/5")
+                assert status == 405
+
+                status, result = await get(reader, writer, "/delete/nonexisting", "POST")
+                assert status == 400
+                assert result["error"] == "no habit found with name 'nonexisting'"
+
+                status, result = await get(reader, writer, "/delete/5", "POST", "Origin: http://evil.example\r\n")
+                assert status == 403
+
+                reader, writer = await asyncio.open_connection(server.HOST, srv.sockets[0].getsockname()[1])
+
+                status, result = await get(reader, writer, "/analyze/max_streak?snapshot=habits.db")
+                assert status == 400
+                assert "only available on the command line" in result["error"]
+
+                status, result = await get(reader, writer, "/analyze/past_progress/1?archive=/etc/passwd")
+                assert status == 400
+
+                status, result = await get(reader, writer, "/list?help")
+                assert status == 400
+                assert result["error"] == "help is not available over http"
+
+                # left waiting for the next request on shutdown
+                assert len(list(db.get_habits())) == 5
+
+    asyncio.run(run())
+
+    assert "CancelledError" not in caplog.text
+
+
+@pytest.mark.parametrize(
+    ("transaction", "lines", "expected_results", "expected_errors", "expected_progress", "expected_success"),
+    [
+        (False, ["progress study", "", "# comment", "progress nonexisting", "progress study"], 3, 1, 2, False),
+        (False, ["progress study", "progress --help", "progress study"], 3, 1, 2, False),
+        (True, ["progress study", "progress study"], 2, 0, 2, True),
+        (True, ["progress study", "progress nonexisting", "progress study"], 3, 2, 0, False),
+        (True, ["progress study", "progress -h"], 3, 2, 0, False),
+    ],
+)
+def test_batch(db:DB, capfd, transaction, lines, expected_results, expected_errors, expected_progress, expected_success):
+    """ test executing multiple requests with and without a single transaction """
+    habit = Habit("study", "task", 1, 10)
+    db.save_habit(habit)
+
+    parse_request = lambda argv: argparse.Namespace(action=argv[0], habit=argv[1], amount=1, start=False, end=False, date=None)
+
+    success = request.handle_batch(db, lines, parse_request, transaction) # <- tested method
+    out, err = capfd.readouterr()
+
+    assert success == expected_success
+
+    results = list(map(json.loads, out.splitlines()))
+
+    assert len(results) == expected_results
+    assert len([r for r in results if "error" in r]) == expected_errors
+    assert all(("error" in r) != ("result" in r) for r in results)
+    assert db.get_habit("study", True).current_progress() == "{0} of 10".format(expected_progress)
+
 #endregion
 
 #region test db methods
@@ -277,6 +440,10 @@ def test_delete_habit(db:DB):
 
     assert count == 4
 
+    progress = db._create_connection().execute('''SELECT COUNT(*) FROM progress WHERE habit_id = 4''').fetchone()[0]
+
+    assert progress == 0
+
     db.delete_habit("sports") # <- tested method
 
     count = len(list(db.get_habits()))
@@ -287,6 +454,576 @@ def test_delete_habit(db:DB):
     existing = db.get_habit(2)
     existing = db.get_habit(5)
 
+
+def test_period_summary(db:DB):
+    """ test that the summarized periods stay in line with the period view after every write """
+    db.insert_samples()
+
+    assert db.verify_period_summary() == 0 # <- tested method
+
+    db.add_progress(Progress(1, 1, datetime.date.today() - datetime.timedelta(days=400)))
+    db.add_progress(Progress("sports", 30))
+    db.start_progress("sports")
+    db.end_progress("sports")
+    db.reset_progress(4)
+    db.save_habit(Habit("new habit", "task", 14))
+
+    habit = db.get_habit(2)
+    habit.days = 30
+    db.save_habit(habit)
+
+    db.delete_habit(5)
+
+    assert db.verify_period_summary() == 0 # <- tested method
+
+    with DB(db._connection, period_summary=False) as view:
+        assert list(db.get_periods()) == list(view.get_periods())
+
+    db.rebuild_period_summary() # <- tested method
+
+    assert db.verify_period_summary() == 0 # <- tested method
+
+
+@pytest.mark.parametrize("bucket", [1, 7, 30])
+def test_rollups(db:DB, bucket):
+    """ test that the daily, weekly and monthly rollups sum the progress rows and are detected and repaired when deviating """
+    db.insert_samples()
+    db.add_progress(Progress("sports", 30, datetime.date.today() - datetime.timedelta(days=3)))
+
+    conn = db._create_connection()
+
+    total = conn.execute('''SELECT SUM(amount) FROM progress WHERE habit_id = 3''').fetchone()[0]
+    assert conn.execute('''SELECT SUM(amount) FROM progress_rollup WHERE habit_id = 3 AND bucket = ?''', [bucket]).fetchone()[0] == total
+
+    conn.execute('''UPDATE progress_rollup SET amount = amount + 1 WHERE bucket = ?''', [bucket])
+    conn.commit()
+
+    assert db.verify_period_summary() > 0 # <- tested method
+
+    db.rebuild_period_summary() # <- tested method
+
+    assert db.verify_period_summary() == 0 # <- tested method
+
+
+def test_schema_migration(db:DB):
+    """ test migrating a database with periods aligned per period length """
+    db.insert_samples()
+
+    conn = db._create_connection()
+    conn.execute('''DROP TABLE period_summary_state''')
+    conn.execute('''CREATE TABLE period_summary_state(period INTEGER PRIMARY KEY, valid_until TEXT NOT NULL)''')
+    conn.execute('''PRAGMA user_version = 0''')
+    conn.commit()
+
+    db.assure_database() # <- tested method
+
+    assert conn.execute('''PRAGMA user_version''').fetchone()[0] > 0
+    assert "habit_id" in map(lambda c: c[1], conn.execute('''PRAGMA table_info(period_summary_state)''').fetchall())
+    assert conn.execute('''SELECT COUNT(*) FROM period_summary_state''').fetchone()[0] == 5 # rebuilt during migration
+    assert db.verify_period_summary() == 0
+
+
+def test_date_migration(db:DB):
+    """ test converting text dates of schema version 4 to integers """
+    db.insert_samples()
+
+    habit = db.get_habit(1)
+    progress = db.export_rows("progress")[1]
+    expected = (habit._creation_date, list(progress), analytics.completion_rate(db))
+
+    conn = db._create_connection()
+    conn.execute('''UPDATE habit SET creation_date = datetime(creation_date, 'unixepoch')''')
+    conn.execute('''UPDATE progress SET progress_date = datetime(progress_date, 'unixepoch')''')
+    conn.execute('''PRAGMA user_version = 4''')
+    conn.commit()
+
+    db.assure_database() # <- tested method
+
+    assert conn.execute('''SELECT COUNT(*) FROM progress WHERE typeof(progress_date) <> 'integer' ''').fetchone()[0] == 0
+    assert conn.execute('''SELECT COUNT(*) FROM habit WHERE typeof(creation_date) <> 'integer' ''').fetchone()[0] == 0
+    assert conn.execute('''PRAGMA foreign_key_check''').fetchall() == []
+    assert (db.get_habit(1)._creation_date, list(db.export_rows("progress")[1]), analytics.completion_rate(db)) == expected
+    assert db.verify_period_summary() == 0
+
+
+def test_baseline_migration(tmp_path):
+    """ test migrating a database of the first version, where deleting habits left their progress behind """
+    file = tmp_path / "baseline.db"
+
+    conn = sqlite3.connect(file)
+    conn.execute('''CREATE TABLE habit(id INTEGER PRIMARY KEY, creation_date TEXT NOT NULL DEFAULT(datetime('now', 'localtime')), name TEXT UNIQUE NOT NULL,
+                                       task TEXT NOT NULL, period INTEGER NOT NULL DEFAULT(1), goal INTEGER NOT NULL DEFAULT(1), unit TEXT NOT NULL DEFAULT(''))''')
+    conn.execute('''CREATE TABLE progress(id INTEGER PRIMARY KEY, habit_id INTEGER NOT NULL, progress_date TEXT NOT NULL DEFAULT(datetime('now', 'localtime')),
+                                          amount INTEGER NOT NULL DEFAULT(1), FOREIGN KEY(habit_id) REFERENCES habit(id) ON DELETE CASCADE)''')
+    conn.execute('''CREATE INDEX INDEX_progress_habit_date ON progress(habit_id, progress_date)''')
+    conn.execute('''INSERT INTO habit (id, name, task) VALUES (1, 'kept', 'task'), (2, 'deleted', 'task')''')
+    conn.execute('''INSERT INTO progress (habit_id) VALUES (1), (2), (2)''')
+    conn.execute('''DELETE FROM habit WHERE id = 2''') # foreign keys were not enforced
+    conn.commit()
+    conn.close()
+
+    with DB(file) as baseline:
+        baseline.assure_database() # <- tested method
+
+        conn = baseline._create_connection()
+        assert conn.execute('''SELECT habit_id FROM progress''').fetchall() == [(1,)]
+        assert conn.execute('''PRAGMA foreign_key_check''').fetchall() == []
+        assert baseline.verify_period_summary() == 0
+
+
+def test_schema_up_to_date(db:DB):
+    """ test that a current database is not touched """
+    statements = []
+
+    conn = db._create_connection()
+    conn.set_trace_callback(statements.append)
+
+    db.assure_database() # <- tested method
+
+    conn.set_trace_callback(None)
+
+    assert statements == ["PRAGMA user_version"]
+
+
+@pytest.mark.parametrize(
+    ("version", "migration", "context"),
+    [
+        (2, "DROP TABLE missing_table", pytest.raises(Exception, match="no such table")),
+        (99, None, pytest.raises(Exception, match="newer than the supported version")),
+    ],
+)
+def test_schema_migration_failing(db:DB, monkeypatch, version, migration, context):
+    """ test that failing migrations leave the database unchanged """
+    db.insert_samples()
+
+    conn = db._create_connection()
+    conn.execute('''PRAGMA user_version = {0}'''.format(version))
+    conn.commit()
+
+    if migration:
+        monkeypatch.setattr("tracker.db._MIGRATIONS", [(3, ["DROP INDEX INDEX_progress_running", migration], False)])
+
+    with context:
+        db.assure_database() # <- tested method
+
+    assert conn.execute('''PRAGMA user_version''').fetchone()[0] == version
+    assert conn.execute('''SELECT 1 FROM sqlite_master WHERE name = 'INDEX_progress_running' ''').fetchone() is not None
+
+
+def test_index_migration(db:DB):
+    """ test replacing the progress index of schema version 2 """
+    db.insert_samples()
+
+    conn = db._create_connection()
+    conn.execute('''DROP INDEX INDEX_progress_habit_date_amount''')
+    conn.execute('''CREATE INDEX INDEX_progress_habit_date ON progress(habit_id, progress_date)''')
+    conn.execute('''PRAGMA user_version = 2''')
+    conn.commit()
+
+    db.assure_database() # <- tested method
+
+    indexes = [row[0] for row in conn.execute('''SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ('habit', 'progress')''')]
+
+    assert "INDEX_progress_habit_date" not in indexes
+    assert {"INDEX_progress_habit_date_amount", "INDEX_progress_running", "INDEX_habit_period_name"}.issubset(indexes)
+
+    plan = " ".join(row[-1] for row in conn.execute('''EXPLAIN QUERY PLAN SELECT SUM(amount) FROM progress WHERE habit_id = 1 AND progress_date >= ?''', ['2024-01-01']))
+    assert "COVERING INDEX INDEX_progress_habit_date_amount" in plan
+
+    plan = " ".join(row[-1] for row in conn.execute('''EXPLAIN QUERY PLAN SELECT * FROM habit WHERE period = 7 ORDER BY name'''))
+    assert "INDEX_habit_period_name" in plan
+
+    db.start_progress(4)
+    assert db.end_progress(4) == 0
+
+@pytest.mark.parametrize("period", [1, 5, 7, 30])
+def test_periods_per_habit(db:DB, period):
+    """ test that periods start with the first progress of each habit """
+    db.save_habit(Habit("old habit", "task", period))
+    _insert_progress(db, 1, period, (1, 0, 0, 0, 1))
+
+    db.save_habit(Habit("new habit", "task", period))
+
+    assert len(list(db.get_periods(habit=1))) > 5
+    assert len(list(db.get_periods(habit=2))) == 1 # <- tested method
+    assert db.verify_period_summary() == 0
+
+
+def test_period_batches(db:DB):
+    """ test that columnar periods per habit equal the period rows """
+    db.insert_samples()
+
+    periods = list(db.get_periods())
+    batches = list(db.get_period_batches()) # <- tested method
+
+    assert [b.habit_id for b in batches] == sorted(set(p[2] for p in periods))
+    assert sum(map(len, batches)) == len(periods)
+
+    for batch in batches:
+        rows = [p for p in periods if p[2] == batch.habit_id]
+
+        assert batch.habit_name == rows[0][3]
+        assert list(batch.progress) == [p[7] for p in rows]
+        assert [batch.start_date(i).isoformat() for i in range(len(batch))] == [p[5] for p in rows]
+        assert [batch.end_date(i).isoformat() for i in range(len(batch))] == [p[6] for p in rows]
+        assert list(batch.completed()) == [int(p[7] >= p[4]) for p in rows]
+
+    assert not hasattr(batches[0], "__dict__")
+
+
+@pytest.mark.parametrize(
+    ("period_summary", "start", "end"),
+    [
+        (True, 7, 1),
+        (False, 7, 1),
+        (False, 31, 0),
+        (False, 45, 3),
+        (False, 200, 0),
+        (False, 0, 0),
+    ],
+)
+def test_periods_between(db:DB, period_summary, start, end):
+    """ test that periods and progress computed for a timeframe equal the filtered full computation """
+    db.insert_samples()
+    db.save_habit(Habit("custom", "task", 5))
+    _insert_progress(db, 6, 5, (1, 0, 1, 1, 0, 1))
+
+    start_date = datetime.date.today() - datetime.timedelta(days=start)
+    end_date = datetime.date.today() - datetime.timedelta(days=end)
+
+    in_timeframe = lambda p: p[5] >= start_date.isoformat() and p[6] <= end_date.isoformat()
+
+    with DB(db._connection, period_summary=period_summary) as source:
+        expected = list(filter(in_timeframe, source.get_periods()))
+        expected.sort(key=lambda p: (p[2], p[5]), reverse=True)
+        expected.sort(key=lambda p: p[2])
+
+        assert list(source.get_periods_between(start_date, end_date)) == expected # <- tested method
+
+        for habit in range(1, 7):
+            expected = list(filter(lambda p: p[1] >= start_date.isoformat() and p[2] <= end_date.isoformat(), source.get_progress(habit)))
+
+            assert list(source.get_progress(habit, start_date, end_date)) == expected # <- tested method
+
+
+@pytest.mark.parametrize(
+    ("file_name", "content", "expected_count", "context"),
+    [
+        ("progress.csv", "habit,date,amount\nmorning stretching,2024-01-01,1\n2,2024-01-02 10:00:00,\nsports,2024-01-03T18:30:00,45\n", 3, nullcontext()),
+        ("progress.jsonl", '{"habit": "study", "date": "2024-01-01", "amount": 20}\n\n{"habit": 1, "date": "2024-01-02"}\n', 2, nullcontext()),
+        ("progress.csv", "habit,date\nsports,2024-01-01\nsports,2024-01-02\nnonexisting,2024-01-03\n", 2, pytest.raises(Exception, match="no habit found with name")),
+        ("progress.jsonl", '{"habit": "sports"}\n', 0, pytest.raises(Exception, match="invalid progress in line 1")),
+        ("progress.csv", "habit,date,amount\nsports,2024-01-01,30\nsports,2024-01-02,30\nsports,2024-01-03,0\n", 2, pytest.raises(Exception, match="amount has to be positive in line 3")),
+    ],
+)
+def test_import_progress(db:DB, tmp_path, file_name, content, expected_count, context):
+    """ test bulk import of progress from csv and json lines files """
+    db.insert_samples()
+
+    file = tmp_path / file_name
+    file.write_text(content, encoding="utf-8")
+
+    count_before = db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0]
+
+    with context:
+        count = db.import_progress(request._read_progress(file), chunk_size=2) # <- tested method
+        assert count == expected_count
+
+    count_after = db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0]
+
+    assert count_after - count_before == expected_count
+    assert db.verify_period_summary() == 0
+
+
+def test_import_progress_without_amount(db:DB):
+    """ test that imported progress never becomes a running timer """
+    db.insert_samples()
+
+    with pytest.raises(Exception, match="amount has to be positive in row 2"):
+        db.import_progress([("sports", datetime.date.today(), 30), ("sports", datetime.date.today(), 0)]) # <- tested method
+
+    db.start_progress("sports")
+
+
+def test_import_progress_failed_chunk(db:DB):
+    """ test that a chunk failing in the middle is not partly imported """
+    db.insert_samples()
+
+    count_before = db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0]
+
+    today = datetime.date.today()
+    rows = [("sports", today, 10)] * 4 + [("sports", today, Decimal(10))] + [("sports", today, 10)]
+
+    with pytest.raises(sqlite3.Error):
+        db.import_progress(rows, chunk_size=3) # <- tested method
+
+    count_after = db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0]
+
+    assert count_after - count_before == 3
+    assert db.verify_period_summary() == 0
+
+
+@pytest.mark.parametrize(
+    ("table", "file_format"),
+    [
+        ("habit", "csv"),
+        ("progress", "jsonl"),
+        ("period", "csv"),
+        (None, "sqlite"),
+    ],
+)
+def test_export(db:DB, tmp_path, table, file_format):
+    """ test streaming export to csv, json lines and sqlite files """
+    db.insert_samples()
+
+    file = tmp_path / "export.{0}".format(file_format)
+
+    if file_format == "sqlite":
+        count = db.export_database(file) # <- tested method
+
+        with DB(file) as copy:
+            assert len(list(copy.get_habits())) == 5
+            assert list(copy.get_periods()) == list(db.get_periods())
+
+        with pytest.raises(Exception, match="file already exists"):
+            db.export_database(file) # <- tested method
+    else:
+        columns, rows = db.export_rows(table) # <- tested method
+        expected = list(rows)
+
+        count = request._write_rows(*db.export_rows(table), file, file_format) # <- tested method
+
+        assert count == len(expected)
+
+        if file_format == "csv":
+            assert len(file.read_text(encoding="utf-8").splitlines()) == count + 1
+        else:
+            assert list(request._read_progress(file)) == list(map(lambda p: (p[1], datetime.datetime.fromisoformat(p[2]), p[3]), expected))
+
+def test_export_in_transaction(db:DB, tmp_path, monkeypatch):
+    """ test that an export within a transaction of the source database still commits the copied rows """
+    db.insert_samples()
+
+    # the summary of the copy is rebuilt with a commit of its own, which would hide missing commits
+    monkeypatch.setattr(DB, "rebuild_period_summary", lambda self: None)
+
+    with db.transaction():
+        count = db.export_database(tmp_path / "export.sqlite") # <- tested method
+
+    with DB(tmp_path / "export.sqlite") as copy:
+        assert len(list(copy.get_habits())) == 5
+
+    with closing(sqlite3.connect(tmp_path / "export.sqlite")) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM progress").fetchone()[0] == count - 5
+
+
+@pytest.mark.parametrize("with_archive", [False, True])
+def test_archive_progress(db:DB, tmp_path, with_archive):
+    """ test folding progress of past periods, keeping period sums and the progress rows in an archive database """
+    db.insert_samples()
+    for days in range(60):
+        db.add_progress(Progress("sports", 10, datetime.date.today() - datetime.timedelta(days=days)))
+
+    archive = tmp_path / "archive.db" if with_archive else None
+
+    periods = list(db.get_periods())
+    progress = analytics.past_progress(db, "sports", False)
+    count = db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0]
+
+    folded, rows = db.archive_progress(datetime.date.today() - datetime.timedelta(days=30), archive) # <- tested method
+
+    assert 0 < rows < folded
+    assert db._create_connection().execute('''SELECT COUNT(*) FROM progress''').fetchone()[0] == count - folded + rows
+    assert list(db.get_periods()) == periods
+    assert db.verify_period_summary() == 0
+
+    if with_archive:
+        assert analytics.past_progress(db, "sports", False, archive=archive) == progress
+    else:
+        with pytest.raises(Exception, match="archive file not found"):
+            list(db.get_progress("sports", archive=tmp_path / "archive.db"))
+
+    assert db.archive_progress(datetime.date.today() - datetime.timedelta(days=30), archive)[0] == 0 # <- tested method
+
+
+@pytest.mark.parametrize(
+    ("analysis", "args"),
+    [
+        (analytics.max_streak, ()),
+        (analytics.max_streak, (7,)),
+        (analytics.max_break, (None, "sports")),
+        (analytics.past_streaks, (1,)),
+        (analytics.current_streak, ("2",)),
+        (analytics.completion_rate, ()),
+        (analytics.completion_rate, (datetime.date.today() - datetime.timedelta(days=20), datetime.date.today())),
+    ],
+)
+def test_snapshot(db:DB, tmp_path, analysis, args):
+    """ test analyzing a columnar snapshot file instead of the database """
+    db.insert_samples()
+
+    file = tmp_path / "habits.snapshot"
+
+    count = write_snapshot(db, file) # <- tested method
+
+    assert count == len(list(db.get_periods()))
+
+    with Snapshot(file) as snapshot: # <- tested method
+        assert snapshot.get_data_version() == db.get_data_version()
+        assert analysis(snapshot, *args) == analysis(db, *args)
+
+
+def test_snapshot_invalid(tmp_path):
+    """ test rejecting missing and foreign files """
+    file = tmp_path / "habits.snapshot"
+
+    with pytest.raises(Exception, match="snapshot file not found"):
+        Snapshot(file).open() # <- tested method
+
+    file.write_bytes(b"SQLite format 3" + bytes(100))
+
+    with pytest.raises(Exception, match="invalid snapshot file"):
+        Snapshot(file).open() # <- tested method
+
+
+@pytest.mark.parametrize(
+    ("analysis", "args"),
+    [
+        (analytics.max_streak, ()),
+        (analytics.max_streak, (7,)),
+        (analytics.max_break, ()),
+        (analytics.max_break, (1,)),
+        (analytics.completion_rate, ()),
+        (analytics.completion_rate, (datetime.date.today() - datetime.timedelta(days=20), datetime.date.today())),
+        (analytics.top_completion_rates, (2, True)),
+        (analytics.top_max_breaks, (2,)),
+    ],
+)
+def test_parallel_analyses(db:DB, analysis, args):
+    """ test computing analyses over ranges of habits in worker processes """
+    db.insert_samples()
+
+    expected = analysis(db, *args)
+
+    analytics.enable_parallel(2) # <- tested method
+    try:
+        assert analysis(db, *args) == expected
+    finally:
+        analytics.disable_parallel()
+
+
+def test_read_only(db:DB):
+    """ test that read-only connections compute outdated periods instead of rolling the summary forward """
+    db.insert_samples()
+
+    expected = list(db.get_periods())
+
+    db._create_connection().execute('''UPDATE period_summary_state SET valid_until = '2000-01-01' ''')
+    db._create_connection().commit()
+
+    with DB(db._connection, read_only=True) as reader:
+        assert list(reader.get_periods()) == expected # <- tested method
+
+        with pytest.raises(Exception, match="readonly"):
+            reader.reset_progress(1)
+
+
+def test_profiler(db:DB, caplog):
+    """ test collecting statistics and logging slow statements """
+    db.insert_samples()
+
+    db.set_profiler(QueryProfiler(threshold_ms=0)) # <- tested method
+
+    analytics.max_streak(db)
+    analytics.max_streak(db)
+
+    summary = db.profiler.summary() # <- tested method
+    periods = [s for s in summary if s[0].startswith("SELECT habit_id, goal, start_date, end_date, progress FROM period_summary")]
+
+    assert len(periods) == 1
+    assert periods[0][1] == 2
+    assert periods[0][4] == 2 * len(list(db.get_periods()))
+    assert "slow query" in caplog.text
+    assert "SCAN" in caplog.text or "SEARCH" in caplog.text
+
+
+def test_profiler_connection(db:DB):
+    """ test that statements executed on the connection itself are profiled """
+    db.set_profiler(QueryProfiler(threshold_ms=1000)) # <- tested method
+
+    db.insert_samples()
+
+    statements = {s[0]: s for s in db.profiler.summary()} # <- tested method
+
+    assert statements["PRAGMA foreign_keys = ON"][1] == 1
+    assert statements["PRAGMA synchronous = NORMAL"][1] == 1
+
+
+def test_numpy_import():
+    """ test that starting the app does not import numpy """
+    res = subprocess.run([sys.executable, "-c", "import tracker.analytics, sys; print('numpy' in sys.modules)"], capture_output=True, text=True, check=True)
+
+    assert res.stdout.strip() == "False"
+
+
+def test_run_lengths_numpy(monkeypatch):
+    """ test that numpy computes the same runs as plain python """
+    pytest.importorskip("numpy")
+
+    flags = array('B', (1 if i % 7 < 4 or i % 13 == 0 else 0 for i in range(2 * analytics._NUMPY_MIN_PERIODS)))
+
+    runs = analytics._run_lengths(flags) # <- tested method
+
+    monkeypatch.setattr(analytics, "_NUMPY_MIN_PERIODS", len(flags) + 1)
+
+    assert runs == analytics._run_lengths(flags)
+
+
+def test_async_db(db:DB):
+    """ test async methods and iterators running in dedicated database threads """
+    db.insert_samples()
+
+    expected = list(db.get_periods())
+
+    async def run():
+        async with AsyncDB(db, threads=2, chunk_size=7) as adb:
+            assert (await adb.get_habit(1)).name == "morning stretching" # <- tested method
+
+            assert [p async for p in adb.get_periods()] == expected # <- tested method
+
+            # stop early, while another request runs in between
+            async with adb.get_periods() as periods: # <- tested method
+                first = await periods.__anext__()
+                version = await adb.get_data_version()
+            assert first == expected[0]
+
+            await adb.add_progress(Progress(2)) # <- tested method
+            assert await adb.get_data_version() == version + 1
+
+            assert await adb.run(analytics.max_streak, 7) == analytics.max_streak(db, 7) # <- tested method
+
+    asyncio.run(run())
+
+
+def test_async_db_cancel(db:DB):
+    """ test interrupting a running query on cancellation """
+
+    slow = lambda db: db._create_connection().execute('''WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c''').fetchone()
+
+    async def run():
+        async with AsyncDB(db, threads=1) as adb:
+            task = asyncio.ensure_future(adb.run(slow))
+            await asyncio.sleep(0.1)
+
+            task.cancel() # <- tested method
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            # the thread is available again
+            assert await adb.is_empty()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
 #endregion
 
 #region test analytics methods
@@ -322,9 +1059,13 @@ def test_list_habits(db:DB, period, expected_count):
     """ test getting the extended list of habits, with and without period filter """
     db.insert_samples()
 
-    count = len(analytics.habits(db, period)) # <- tested method
+    result = analytics.habits(db, period) # <- tested method
 
-    assert count == expected_count
+    assert len(result) == expected_count
+
+    for habit in result:
+        assert habit[6] == analytics.current_progress(db, habit[0])
+        assert habit[7] == analytics.current_streak(db, habit[0])
 
 
 @pytest.mark.parametrize(
@@ -369,6 +1110,30 @@ def test_current_progress(db:DB, period, past_progress, current_progress, count_
     assert count_after == count
 
 
+@pytest.mark.parametrize("periods_back", [1, 2, 5])
+def test_habit_state(db:DB, periods_back):
+    """ test rolling the stored current period and streaks forward instead of reading past periods """
+    db.insert_samples()
+
+    for habit_id in range(1, 6):
+        habit = db.get_habit(habit_id)
+        periods = list(db.get_periods(habit=habit_id))[::-1]
+        expected = HabitState.from_periods(((p[5], p[6], p[7]) for p in periods), habit.goal)
+
+        # state as stored some periods ago
+        with closing(db._create_connection().cursor()) as cmd:
+            db._save_state(cmd, habit_id, HabitState.from_periods(((p[5], p[6], p[7]) for p in periods[:max(1, len(periods) - periods_back)]), habit.goal))
+        db._create_connection().commit()
+
+        habit = db.get_habit(habit_id, True) # <- tested method
+
+        assert habit.current_period() == "{0} to {1}".format(expected.period_start, expected.period_end)
+        assert habit._state.progress == expected.progress
+        assert habit._state.current_streak(habit.goal) == expected.current_streak(habit.goal)
+        assert habit.longest_streak() == max(expected.best_streak, expected.current_streak(habit.goal)[0])
+        assert habit.longest_streak() == (analytics.max_streak(db, habit=habit_id)[0] or (None, 0))[1]
+
+
 @pytest.mark.parametrize(
     ("period", "goal", "amount", "status"),
     [
@@ -428,6 +1193,19 @@ def test_past_streaks(db:DB, period, past_progress, expected_streak, expected_br
     assert count_streak == expected_streak
     assert count_break == expected_break
 
+
+def test_long_streak(db:DB):
+    """ test streaks exceeding the default recursion limit """
+    habit = Habit("habit", "task")
+    db.save_habit(habit)
+
+    days = 1500
+    db._insert_random_progress(1, 1, 1, 100, datetime.datetime.combine(datetime.date.today(), datetime.time()) - datetime.timedelta(days=days), days)
+
+    assert analytics.current_streak(db, 1) == days # <- tested method
+    assert analytics.past_streaks(db, 1)[0][:2] == ("streak", days) # <- tested method
+    assert analytics.max_streak(db, habit=1)[0][1] == days # <- tested method
+
     
 @pytest.mark.parametrize(
     ("period", "past_progress_1", "past_progress_2", "expected_streak_period", "expected_break_period", "expected_streak_1", "expected_break_1", "expected_streak_2", "expected_break_2"),
@@ -501,4 +1279,73 @@ def test_completion_rate(db:DB, period, past_progress, expected_completed, expec
     assert result[1] == expected_completed
     assert result[2] == expected_total
 
+
+@pytest.mark.parametrize(
+    ("ranking", "expected"),
+    [
+        (lambda db: analytics.top_completion_rates(db, 3),
+         lambda db: sorted(analytics.completion_rate(db), key=lambda c: c[1] / c[2], reverse=True)[:3]),
+        (lambda db: analytics.top_completion_rates(db, 2, True, datetime.date.today() - datetime.timedelta(days=20), datetime.date.today()),
+         lambda db: sorted(analytics.completion_rate(db, datetime.date.today() - datetime.timedelta(days=20), datetime.date.today()), key=lambda c: c[1] / c[2])[:2]),
+        (lambda db: analytics.top_current_streaks(db, 2), # habits with equal streaks are ranked by id
+         lambda db: [(h[2], h[7]) for h in sorted((h for h in analytics.habits(db) if h[7] > 0), key=lambda h: (-h[7], h[0]))[:2]]),
+        (lambda db: analytics.top_max_breaks(db, 3, 1),
+         lambda db: sorted(filter(None, (analytics.max_break(db, habit=h[0])[0] for h in analytics.habits(db, 1))), key=lambda sb: sb[1], reverse=True)[:3]),
+    ],
+)
+def test_top_rankings(db:DB, ranking, expected):
+    """ test that rankings equal the first entries of the fully sorted analyses """
+    db.insert_samples()
+
+    assert ranking(db) == expected(db) # <- tested method
+
+
+@pytest.mark.parametrize(
+    "write",
+    [
+        lambda db: db.save_habit(Habit("new", "task")),
+        lambda db: db.save_habit(db.get_habit(1)),
+        lambda db: db.add_progress(Progress(2)),
+        lambda db: db.import_progress([(2, datetime.date.today(), 1)]),
+        lambda db: db.start_progress(3),
+        lambda db: db.reset_progress(2),
+        lambda db: db.delete_habit(2),
+    ],
+)
+def test_data_version(db:DB, write):
+    """ test that every change of habits or progress increases the data version """
+    db.insert_samples()
+
+    version = db.get_data_version()
+
+    write(db)
+
+    assert db.get_data_version() > version # <- tested method
+
+
+def test_result_cache(db:DB):
+    """ test serving analyses from the cache until the data changes """
+    db.insert_samples()
+
+    cache = analytics.enable_cache(max_entries=3) # <- tested method
+    try:
+        result = analytics.max_streak(db, 7)
+
+        assert analytics.max_streak(db, 7) is result
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        db.add_progress(Progress(2))
+
+        assert analytics.max_streak(db, 7) is not result
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        analytics.max_break(db, 7)
+        analytics.completion_rate(db)
+        analytics.habits(db)
+
+        assert len(cache) == 3
+        assert analytics.habits(db) == analytics.habits.__wrapped__(db)
+    finally:
+        analytics.disable_cache()
+
 #endregion
\ No newline at end of file
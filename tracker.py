@@ -1,11 +1,12 @@
 import tracker.analytics as analytics
 import tracker.request as request
 from tracker.db import DB
+from tracker.profiler import QueryProfiler
 from tracker.habit import Habit
-from tracker.progress import Progress
 from tracker.enums import Action, Analysis, Parameter
 
 import argparse
+import sys
 from datetime import date
 from enum import Enum
 
@@ -16,9 +17,38 @@ def _add_parser(parser, enum : Enum, parents=[]):
      """ add parser created from enum, where description equals help """
      return parser.add_parser(enum.name, description=enum.value, help=enum.value, parents=parents)
 
-def _create_parser(db_is_empty : bool):
-    """ parses single command line request """
-    main_parser = argparse.ArgumentParser(description="Habit progress tracker - run without arguments to enter interactive mode")
+class _RequestParser(argparse.ArgumentParser):
+    """ parser for requests that must not terminate the process, e.g., when serving """
+
+    def error(self, message):
+        raise ValueError(message)
+
+def _find_action(argv : list) -> str:
+    """ returns the action of a command line request without parsing it
+        (or None, if the request asks for help or has no action)
+    """
+
+    actions = Action.__members__
+
+    for arg in argv:
+        if arg in ("-h", "--help"):
+            return None
+        if arg in actions:
+            return arg
+
+    return None
+
+def _create_parser(db_is_empty : bool, parser_class = argparse.ArgumentParser, action : str = None):
+    """ parses single command line request
+    Args:
+        db_is_empty: only offer actions available for an empty database
+        parser_class: class of the main parser
+        action: only construct the subparser of this action, e.g., from '_find_action'
+    """
+    main_parser = parser_class(description="Habit progress tracker - run without arguments to enter interactive mode")
+    main_parser.add_argument("--profile", help=Parameter.profile.value, action='store_true')
+    main_parser.add_argument("--slow_ms", help=Parameter.slow_ms.value, type=float, default=100.0)
+    main_parser.add_argument("--parallel", help=Parameter.parallel.value, type=int, default=0)
 
     json_parser = argparse.ArgumentParser(add_help=False)
     output_group = json_parser.add_argument_group("output flag")
@@ -34,6 +64,12 @@ def _create_parser(db_is_empty : bool):
     period_filter_parser = argparse.ArgumentParser(add_help=False)
     period_filter_parser.add_argument("-p", "--period", help=Parameter.period_filter.value, type=_parse_period)
 
+    snapshot_parser = argparse.ArgumentParser(add_help=False)
+    snapshot_parser.add_argument("-S", "--snapshot", help=Parameter.snapshot.value)
+
+    limit_parser = argparse.ArgumentParser(add_help=False)
+    limit_parser.add_argument("-l", "--limit", help=Parameter.limit.value, type=_parse_amount, default="10")
+
     timeframe_parser = argparse.ArgumentParser(add_help=False)
     timeframe_parser.add_argument("-w", "--current_week", help=Parameter.current_week.value, action='store_true')
     timeframe_parser.add_argument("-m", "--current_month", help=Parameter.current_month.value, action='store_true')
@@ -45,49 +81,115 @@ def _create_parser(db_is_empty : bool):
     actions = main_parser.add_subparsers(title="action", dest="action")
     actions.required = False    
 
-    create_parser = _add_parser(actions, Action.create, [json_parser])
-    create_parser.add_argument("name", help=Parameter.name.value, type=_parse_name)
-    create_parser.add_argument("task", help=Parameter.task.value, type=_parse_name)
-    create_parser.add_argument("-p","--period", help=Parameter.period.value, type=_parse_period, default=1)
-    create_parser.add_argument("-g","--goal", help=Parameter.goal.value, type=_parse_amount, default=1)
-    create_parser.add_argument("-u","--unit", help=Parameter.unit.value, type=_parse_name, default="")
+    def add(enum : Enum, parents=[]):
+        """ add parser for action, unless another action was requested """
+        if action is None or action == enum.name:
+            return _add_parser(actions, enum, parents)
+
+    create_parser = add(Action.create, [json_parser])
+    if create_parser:
+        create_parser.add_argument("name", help=Parameter.name.value, type=_parse_name)
+        create_parser.add_argument("task", help=Parameter.task.value, type=_parse_name)
+        create_parser.add_argument("-p","--period", help=Parameter.period.value, type=_parse_period, default=1)
+        create_parser.add_argument("-g","--goal", help=Parameter.goal.value, type=_parse_amount, default=1)
+        create_parser.add_argument("-u","--unit", help=Parameter.unit.value, type=_parse_name, default="")
 
     if db_is_empty:
         # only allow samples to be inserted when empty
-        _add_parser(actions, Action.insert_samples)
+        add(Action.insert_samples)
     else:
         # only allow rest of actions after creating at least one habit
-        update_parser = _add_parser(actions, Action.update, [json_parser, habit_parser])
-        update_parser.add_argument("-n", "--name", help=Parameter.new_name.value, type=_parse_name)
-        update_parser.add_argument("-t", "--task", help=Parameter.new_task.value, type=_parse_name)
-        update_parser.add_argument("-p","--period", help=Parameter.new_period.value, type=_parse_period)
-        update_parser.add_argument("-g","--goal", help=Parameter.goal.value, type=_parse_amount)
-        update_parser.add_argument("-u","--unit", help=Parameter.unit.value, type=_parse_name)
+        update_parser = add(Action.update, [json_parser, habit_parser])
+        if update_parser:
+            update_parser.add_argument("-n", "--name", help=Parameter.new_name.value, type=_parse_name)
+            update_parser.add_argument("-t", "--task", help=Parameter.new_task.value, type=_parse_name)
+            update_parser.add_argument("-p","--period", help=Parameter.new_period.value, type=_parse_period)
+            update_parser.add_argument("-g","--goal", help=Parameter.goal.value, type=_parse_amount)
+            update_parser.add_argument("-u","--unit", help=Parameter.unit.value, type=_parse_name)
       
-        progress_parser = _add_parser(actions, Action.progress, [json_parser, habit_parser])
-        progress_parser.add_argument("-a", "--amount", help=Parameter.amount.value, type=_parse_amount, default=1)
-        progress_parser.add_argument("-d", "--date", help=Parameter.past_date.value, type=_parse_date)
-        progress_parser.add_argument("-s", "--start", help=Parameter.start_progress.value, action='store_true')
-        progress_parser.add_argument("-e", "--end", help=Parameter.end_progress.value, action='store_true')       
-
-        _add_parser(actions, Action.reset, [json_parser, habit_parser])
-        _add_parser(actions, Action.delete, [json_parser, habit_parser])
-        _add_parser(actions, Action.list, [json_parser, period_filter_parser])
-
-        analyze_parser = _add_parser(actions, Action.analyze)
-
-        analyses = analyze_parser.add_subparsers(title="analysis", dest="analysis")    
-        _add_parser(analyses, Analysis.current_progress, [json_parser, habit_parser])
-        _add_parser(analyses, Analysis.current_streak, [json_parser, habit_parser])
-        _add_parser(analyses, Analysis.past_progress, [json_parser, habit_parser, timeframe_parser])
-        _add_parser(analyses, Analysis.past_streaks, [json_parser, habit_parser])
-        _add_parser(analyses, Analysis.max_streak, [json_parser, habit_filter_parser, period_filter_parser])
-        _add_parser(analyses, Analysis.max_break, [json_parser, habit_filter_parser, period_filter_parser])
-        _add_parser(analyses, Analysis.completion_rate, [timeframe_parser])
+        progress_parser = add(Action.progress, [json_parser, habit_parser])
+        if progress_parser:
+            progress_parser.add_argument("-a", "--amount", help=Parameter.amount.value, type=_parse_amount, default=1)
+            progress_parser.add_argument("-d", "--date", help=Parameter.past_date.value, type=_parse_date)
+            progress_parser.add_argument("-s", "--start", help=Parameter.start_progress.value, action='store_true')
+            progress_parser.add_argument("-e", "--end", help=Parameter.end_progress.value, action='store_true')       
+
+        add(Action.reset, [json_parser, habit_parser])
+        add(Action.delete, [json_parser, habit_parser])
+        add(Action.list, [json_parser, period_filter_parser])
+
+        import_parser = add(Action.import_progress, [json_parser])
+        if import_parser:
+            import_parser.add_argument("file", help=Parameter.import_file.value)
+            import_parser.add_argument("-f", "--format", help=Parameter.file_format.value, choices=["csv", "jsonl"])
+            import_parser.add_argument("-c", "--chunk_size", help=Parameter.chunk_size.value, type=_parse_amount, default=5000)
+
+        export_parser = add(Action.export, [json_parser])
+        if export_parser:
+            export_parser.add_argument("file", help=Parameter.export_file.value)
+            export_parser.add_argument("-t", "--table", help=Parameter.export_table.value, choices=["habit", "progress", "period"], default="progress")
+            export_parser.add_argument("-f", "--format", help=Parameter.file_format.value, choices=["csv", "jsonl", "sqlite"])
+
+        batch_parser = add(Action.batch)
+        if batch_parser:
+            batch_parser.add_argument("file", help=Parameter.batch_file.value, nargs="?", type=argparse.FileType("r", encoding="utf-8"), default="-")
+            batch_parser.add_argument("-T", "--transaction", help=Parameter.transaction.value, action='store_true')
+
+        serve_parser = add(Action.serve)
+        if serve_parser:
+            serve_parser.add_argument("-P", "--port", help=Parameter.port.value, type=_parse_amount, default=8080)
+            serve_parser.add_argument("-n", "--workers", help=Parameter.workers.value, type=_parse_amount, default=4)
+
+        rebuild_parser = add(Action.rebuild, [json_parser])
+        if rebuild_parser:
+            rebuild_parser.add_argument("-v", "--verify", help=Parameter.verify.value, action='store_true')
+
+        archive_parser = add(Action.archive, [json_parser])
+        if archive_parser:
+            archive_parser.add_argument("-b", "--before", help=Parameter.archive_before.value, type=_parse_date, required=True)
+            archive_parser.add_argument("-a", "--archive", help=Parameter.archive_file.value)
+
+        snapshot_action_parser = add(Action.snapshot, [json_parser])
+        if snapshot_action_parser:
+            snapshot_action_parser.add_argument("file", help=Parameter.snapshot_file.value)
+
+        analyze_parser = add(Action.analyze)
+        if analyze_parser:
+            analyses = analyze_parser.add_subparsers(title="analysis", dest="analysis")    
+            _add_parser(analyses, Analysis.current_progress, [json_parser, habit_parser])
+            _add_parser(analyses, Analysis.current_streak, [json_parser, habit_parser])
+            past_progress_parser = _add_parser(analyses, Analysis.past_progress, [json_parser, habit_parser, timeframe_parser])
+            past_progress_parser.add_argument("-a", "--archive", help=Parameter.archive_file.value)
+            _add_parser(analyses, Analysis.past_streaks, [json_parser, habit_parser, snapshot_parser])
+            _add_parser(analyses, Analysis.max_streak, [json_parser, habit_filter_parser, period_filter_parser, snapshot_parser])
+            _add_parser(analyses, Analysis.max_break, [json_parser, habit_filter_parser, period_filter_parser, snapshot_parser])
+            _add_parser(analyses, Analysis.completion_rate, [timeframe_parser, snapshot_parser])
+            top_completion_rate_parser = _add_parser(analyses, Analysis.top_completion_rate, [json_parser, limit_parser, timeframe_parser, snapshot_parser])
+            top_completion_rate_parser.add_argument("--lowest", help=Parameter.lowest.value, action='store_true')
+            _add_parser(analyses, Analysis.top_current_streak, [json_parser, limit_parser, period_filter_parser, snapshot_parser])
+            _add_parser(analyses, Analysis.top_max_break, [json_parser, limit_parser, period_filter_parser, snapshot_parser])
+
+    if action is not None and action not in actions.choices:
+        # unavailable action, report it with all available ones
+        return _create_parser(db_is_empty, parser_class)
 
     return main_parser
 
 
+def _request_parser(db : DB):
+    """ returns a function parsing requests for the current state of the database without exiting on errors """
+
+    parsers = {}
+
+    def parse_request(argv : list) -> argparse.Namespace:
+        db_is_empty = db.is_empty()
+        if db_is_empty not in parsers:
+            parsers[db_is_empty] = _create_parser(db_is_empty, _RequestParser)
+
+        return parsers[db_is_empty].parse_args(argv)
+
+    return parse_request
+
 def _parse_name(input):
     """ parses user input for valid string """
     
@@ -239,14 +341,22 @@ def interactive_session(db : DB):
 
         elif action == Action.analyze:            
             analysis = get_choice_from("Which analysis do you want to conduct?", [Analysis.current_progress, Analysis.current_streak
-                                     , Analysis.past_progress, Analysis.past_streaks, Analysis.max_streak, Analysis.max_break, Analysis.completion_rate])
+                                     , Analysis.past_progress, Analysis.past_streaks, Analysis.max_streak, Analysis.max_break, Analysis.completion_rate
+                                     , Analysis.top_completion_rate, Analysis.top_current_streak, Analysis.top_max_break])
 
             args = argparse.Namespace(action=Action.analyze.name, analysis=analysis.name)
 
             if analysis == Analysis.current_progress or analysis == Analysis.current_streak or analysis == Analysis.past_streaks or analysis == Analysis.past_progress:
                 args.habit = get_habit_selection(db, "Which habit do you want to analyze?")
 
-            if analysis == Analysis.past_progress or analysis == Analysis.completion_rate:                
+            if analysis == Analysis.top_completion_rate or analysis == Analysis.top_current_streak or analysis == Analysis.top_max_break:
+                args.limit = get_input_for(Parameter.limit, _parse_amount, "10")
+                args.period = None
+
+            if analysis == Analysis.top_completion_rate:
+                args.lowest = get_choice_from("Which completion rates do you want to see first?", [Parameter.highest, Parameter.lowest]) == Parameter.lowest
+
+            if analysis == Analysis.past_progress or analysis == Analysis.completion_rate or analysis == Analysis.top_completion_rate:                
                 timeframe = get_choice_from("Which timeframe do you want to analyze?"
                                           , [Parameter.no_filter, Parameter.current_week, Parameter.last_week, Parameter.current_month, Parameter.last_month])
 
@@ -346,13 +456,32 @@ def get_confirmation() -> bool:
 
 if __name__ == "__main__":
 
-    db = DB("habits.db")
-    db.assure_database()
-
-    args = _create_parser(db.is_empty()).parse_args()
-
-    if args.action is None:        
-        interactive_session(db)
-    else:
-        # single request
-        request.handle(db, args)
+    with DB("habits.db") as db:
+        db.assure_database()
+
+        args = _create_parser(db.is_empty(), action=_find_action(sys.argv[1:])).parse_args()
+
+        if args.profile:
+            import atexit
+            import logging
+            logging.basicConfig(format="%(message)s")
+            db.set_profiler(QueryProfiler(args.slow_ms))
+            atexit.register(db.profiler.print_summary)
+
+        if args.parallel > 0:
+            analytics.enable_parallel(args.parallel)
+
+        if args.action is None:        
+            interactive_session(db)
+        elif args.action == Action.batch.name:
+            analytics.enable_cache()
+            with args.file:
+                if not request.handle_batch(db, args.file, _request_parser(db), args.transaction):
+                    sys.exit(1)
+        elif args.action == Action.serve.name:
+            import tracker.server as server # only load asyncio when serving
+            analytics.enable_cache()
+            server.serve(db, _request_parser(db), int(args.port), int(args.workers))
+        else:
+            # single request
+            request.handle(db, args)
@@ -1,22 +1,192 @@
 from tracker.db import DB
 from tracker.enums import TaskStatus
+from tracker.period import PeriodBatch, to_date
 
-from datetime import date, datetime
-from itertools import accumulate, groupby, filterfalse, islice
+import heapq
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from itertools import accumulate, chain, groupby, islice
 
 #region database access
 
 def _habits(db : DB, period_days : int = 0):
     return db.get_habits(period_days = period_days)
 
-def _progress(db : DB, habit, start_date : date = None, end_date : date = None):
-    return db.get_progress(habit, start_date, end_date)
+def _progress(db : DB, habit, start_date : date = None, end_date : date = None, archive : str = None):
+    return db.get_progress(habit, start_date, end_date, archive)
 
-def _periods(db : DB, period_days : int = None, habit = None):
-    return db.get_periods(period_days = period_days, habit = habit)
+def _periods(db : DB, period_days : int = None, habit = None, habit_range : tuple = None):
+    return db.get_periods(period_days = period_days, habit = habit, habit_range = habit_range)
 
-def _periods_between(db : DB, start_date : date, end_date : date):
-    return db.get_periods_between(start_date = start_date, end_date = end_date)
+def _periods_between(db : DB, start_date : date, end_date : date, habit_range : tuple = None):
+    return db.get_periods_between(start_date = start_date, end_date = end_date, habit_range = habit_range)
+
+def _period_batches(db : DB, period_days : int = None, habit = None, habit_range : tuple = None):
+    return db.get_period_batches(period_days = period_days, habit = habit, habit_range = habit_range)
+
+#endregion
+
+#region result cache
+
+class ResultCache:
+    """ size bounded cache of analysis results, evicting the least recently used """
+
+    def __init__(self, max_entries : int = 256):
+        """ instanciate a cache
+        Args:
+            max_entries: maximum number of cached results
+        """
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """ returns the cached result for key, or computes and caches it
+        Args:
+            key: hashable key
+            compute: function without arguments returning the result
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+
+        # compute outside of the lock, so other analyses are not blocked
+        result = compute()
+
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache : ResultCache = None
+
+def enable_cache(max_entries : int = 256) -> ResultCache:
+    """ caches the results of all analyses until the data of the database or the current date changes,
+        which is worthwhile for long running processes, e.g., batch or server mode
+    Args:
+        max_entries: maximum number of cached results
+    """
+    global _cache
+    _cache = ResultCache(max_entries)
+    return _cache
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+def _cached(analysis):
+    """ serves the results of an analysis from the result cache, if enabled
+        (cached results are shared and must not be modified)
+    """
+
+    @wraps(analysis)
+    def cached_analysis(db : DB, *args, **kwargs):
+        if _cache is None:
+            return analysis(db, *args, **kwargs)
+
+        # periods depend on the current date as well, and the version has to be read before computing,
+        # so results of data changed in the meantime are never stored under the new version
+        key = (analysis.__name__, db._connection, args, tuple(sorted(kwargs.items())), db.get_data_version(), date.today())
+
+        return _cache.get(key, lambda: analysis(db, *args, **kwargs))
+
+    return cached_analysis
+
+#endregion
+
+#region parallel execution
+
+_pool = None
+_workers = 0
+
+def enable_parallel(workers : int = None) -> int:
+    """ computes longest streaks, breaks and completion rates of all habits in a pool of processes,
+        where every process reads a range of habits through its own read-only connection,
+        which is worthwhile for hundreds of habits on multi-core machines
+    Args:
+        workers: number of processes, defaults to the number of cpus
+    Returns:
+        number of processes
+    """
+    global _pool, _workers
+
+    # only load multiprocessing when requested
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    disable_parallel()
+
+    _workers = workers or os.cpu_count() or 1
+    _pool = ProcessPoolExecutor(max_workers=_workers)
+
+    return _workers
+
+def disable_parallel():
+    global _pool, _workers
+
+    if _pool is not None:
+        _pool.shutdown()
+
+    _pool = None
+    _workers = 0
+
+def _in_parallel(db : DB, habit = None) -> bool:
+    # other processes cannot see uncommitted changes, and single habits or snapshots are not worth it
+    return _pool is not None and habit is None and isinstance(db, DB) and not db._in_transaction()
+
+def _habit_ranges(db : DB, period_days : int = None) -> list:
+    """ splits the ids of all habits (with the given period length) into one range (first, last) per process """
+
+    ids = sorted(map(_habit_id, _habits(db, period_days)))
+    size = max(1, -(-len(ids) // _workers))
+
+    return [(ids[i], ids[min(i + size, len(ids)) - 1]) for i in range(0, len(ids), size)]
+
+def _partial_result(connection : str, period_summary : bool, analysis : str, habit_range : tuple, args : tuple) -> list:
+    """ computes the results per habit of an analysis for a range of habits, executed in a worker process """
+
+    with DB(connection, period_summary, read_only=True) as db:
+        return list(_PARTIAL_ANALYSES[analysis](db, habit_range, *args))
+
+def _parallel(db : DB, analysis : str, args : tuple = (), period_days : int = None):
+    """ results per habit of an analysis computed by the pool, in the same order as sequentially computed
+    Args:
+        analysis: key of '_PARTIAL_ANALYSES'
+        args: further arguments of the partial analysis
+        period_days: optionally only analyze habits with this length of period
+    """
+
+    # workers cannot roll the summary forward with their read-only connections
+    db.assure_period_summary()
+
+    futures = [_pool.submit(_partial_result, db._connection, db._period_summary, analysis, habit_range, args)
+               for habit_range in _habit_ranges(db, period_days)]
+
+    return chain.from_iterable(future.result() for future in futures)
 
 #endregion
 
@@ -48,13 +218,14 @@ def _prog_period(prog : []) -> int:
     return prog[0]
 
 def _prog_start(prog : []) -> date:
-    return date.fromisoformat(prog[1])
+    return to_date(prog[1])
 
 def _prog_end(prog : []) -> date:
-    return date.fromisoformat(prog[2])
+    return to_date(prog[2])
 
-def _prog_date(prog : []) -> datetime:
-    return datetime.fromisoformat(prog[3])
+def _prog_timestamp(prog : tuple) -> str:
+    # 'YYYY-MM-DD HH:MM:SS', as formatted by sqlite from the stored seconds
+    return prog[3]
 
 def _prog_amount(prog : []) -> int:
     return prog[4]
@@ -85,10 +256,10 @@ def _period_goal(period : []) -> int:
     return period[4]
 
 def _period_start(period : []) -> date:
-    return date.fromisoformat(period[5])
+    return to_date(period[5])
 
 def _period_end(period : []) -> date:
-    return date.fromisoformat(period[6])
+    return to_date(period[6])
 
 def _period_progress(period : []) -> int:
     return period[7]
@@ -115,6 +286,9 @@ def _comp_count(comp : []) -> int:
 def _comp_rate(comp : []) -> str:
     return "{:.2f} %".format(comp[2] * 100 / comp[3])
 
+def _comp_ratio(comp : []) -> float:
+    return comp[2] / comp[3]
+
 #endregion
 
 #region streaks and breaks mapping
@@ -142,17 +316,133 @@ def _sb_end(sb : []) -> date:
 
 #endregion
 
+#region streak engine mapping
+
+def _st_habit_id(st : []) -> int:
+    return st[0]
+
+def _st_progress(st : []) -> int:
+    return st[1]
+
+def _st_current_streak(st : []) -> int:
+    return st[2]
+
+def _st_past_streaks(st : []) -> list:
+    return st[3]
+
+def _st_max_streak(st : []):
+    return st[4]
+
+def _st_max_break(st : []):
+    return st[5]
+
+#endregion
+
+#region streak engine
+
+# below this number of periods numpy is slower than plain python
+_NUMPY_MIN_PERIODS = 512
+
+# numpy module, only imported for the first long run of periods (False, if not installed)
+_numpy = None
+
+def _load_numpy():
+    global _numpy
+
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy
+
+def _run_lengths(flags : array) -> list:
+    """ run-length encodes completion flags
+    Args:
+        flags: completion flags (0 or 1) of consecutive periods
+    Returns:
+        list of runs (completed, offset, length)
+    """
+
+    numpy = _load_numpy() if len(flags) >= _NUMPY_MIN_PERIODS else None
+
+    if numpy:
+        values = numpy.frombuffer(flags, dtype=numpy.uint8)
+        offsets = numpy.concatenate(([0], numpy.flatnonzero(values[1:] != values[:-1]) + 1))
+        lengths = numpy.diff(numpy.append(offsets, len(values)))
+        return list(zip(map(bool, values[offsets]), offsets.tolist(), lengths.tolist()))
+
+    runs = []
+    offset = 0
+    for completed, run in groupby(flags):
+        length = sum(1 for _ in run)
+        runs.append((bool(completed), offset, length))
+        offset += length
+
+    return runs
+
+def _streaks(batch : PeriodBatch) -> tuple:
+    """ computes all streak information for a single habit in one pass
+    Args:
+        batch: periods of a single habit, starting with the current one
+    Returns:
+        (habit id, current progress, current streak length, past streaks and breaks, max streak, max break),
+        where past streaks and breaks skip the current period and the time until the first completed task
+    """
+
+    runs = _run_lengths(batch.completed())
+
+    if not runs:
+        return (batch.habit_id, 0, 0, [], None, None)
+
+    if runs[0][0]:
+        current_streak = runs[0][2]
+    elif runs[0][2] == 1 and len(runs) > 1:
+        current_streak = runs[1][2]
+    else:
+        current_streak = 0
+
+    # current period is no part of past streaks and breaks
+    past = runs[1:] if runs[0][2] == 1 else [(runs[0][0], 1, runs[0][2] - 1)] + runs[1:]
+
+    # do not count time from habit creation until first completed task as 'break'
+    if past and not past[-1][0]:
+        past = past[:-1]
+
+    to_sb = lambda run: (run[0], batch.habit_id, batch.habit_name, run[2], batch.start_date(run[1] + run[2] - 1), batch.end_date(run[1]))
+
+    max_streak = max(filter(lambda run: run[0], runs), default=None, key=lambda run: run[2])
+    max_break = max(filter(lambda run: not run[0], past), default=None, key=lambda run: run[2])
+
+    return (batch.habit_id, batch.progress[0], current_streak, list(map(to_sb, past)),
+            None if max_streak is None else to_sb(max_streak), None if max_break is None else to_sb(max_break))
+
+def _streaks_per_habit(batches):
+    """ streak information generator
+    Args:
+        batches: periods per habit
+    """
+    return map(_streaks, batches)
+
+#endregion
+
 
+@_cached
 def habits(db : DB, period_days : int = 0) -> list:
     """ get habits incl. current progress & streak length
     Args:
         period_days: optionally filter by length of period
     """
+    current = dict(map(lambda st: (_st_habit_id(st), (_st_progress(st), _st_current_streak(st))), _streaks_per_habit(_period_batches(db, period_days))))
+
     return list(map(lambda h: (_habit_id(h), _habit_created(h), _habit_name(h), _habit_task(h),  _habit_period(h), _habit_goal(h),
-                           current_progress(db, _habit_id(h)), current_streak(db, _habit_id(h))),
+                           *current.get(_habit_id(h), (0, 0))),
                _habits(db, period_days)))
 
 
+@_cached
 def current_progress(db : DB, habit) -> int:
     """ returns current progress for a habit 
     Args:
@@ -161,21 +451,13 @@ def current_progress(db : DB, habit) -> int:
     return _period_progress(next(_periods(db, habit = habit), (0,) * 8))
 
 
-def _count_streak(periods, count):
-    # recursive implementation to comply functional programming paradigm without loading all periods
-    if _period_is_completed(next(periods, (0,) * 8)):
-        return _count_streak(periods, count + 1)
-
-    return count
-
+@_cached
 def current_streak(db : DB, habit) -> int:
     """ returns current streak length for a habit
     Args:
         habit: habit id (int) or name (str)
-    Raises:
-        RecursionError: streak length exceeds max recursion depth
     """
-    return _period_is_completed(next(_periods(db, habit=habit), (0,) * 8)) + _count_streak(islice(_periods(db, habit=habit), 1, None), 0)
+    return _st_current_streak(_streaks(next(_period_batches(db, habit=habit), PeriodBatch())))
 
 
 def _acc_progress(p1, p2):
@@ -188,77 +470,68 @@ def _acc_progress(p1, p2):
 
 def _format_progress_time(p):
     # progress with time only
-    return (_prog_start(p), _prog_date(p).strftime("%H:%M:%S"), _prog_amount(p), TaskStatus(_prog_status(p)).name)
+    return (_prog_start(p), _prog_timestamp(p)[11:], _prog_amount(p), TaskStatus(_prog_status(p)).name)
 
 def _format_progress_dates(p):
     # progress with dates
-    return ("{0} to {1}".format(_prog_start(p), _prog_end(p)), _prog_date(p).strftime("%Y-%m-%d %H:%M:%S"), _prog_amount(p), TaskStatus(_prog_status(p)).name)
+    return ("{0} to {1}".format(_prog_start(p), _prog_end(p)), _prog_timestamp(p), _prog_amount(p), TaskStatus(_prog_status(p)).name)
 
 def _accumulate_and_format(progress, trim_date : bool) -> list:
     # accumulate progress to compute status, and format    
     return list(map(_format_progress_time if trim_date else _format_progress_dates, islice(accumulate(progress, _acc_progress, initial=(0,) * 8), 1, None)))
     
-def past_progress(db : DB, habit, trim_date : bool, start_date : date = None, end_date : date = None) -> list:
+@_cached
+def past_progress(db : DB, habit, trim_date : bool, start_date : date = None, end_date : date = None, archive : str = None) -> list:
     """ get individual progress for a habit, incl. task completion status
     Args:
         habit: habit id (int) or name (str)
         trim_date: only return time of progress date (for daily tasks)
         start_date: start of timeframe to analyze (including)
         end_date: end of timeframe to analyze (including)
+        archive: optional archive database to read folded progress rows from
     """     
-    return list(reversed(_accumulate_and_format(_progress(db, habit, start_date, end_date), trim_date)))
+    return list(reversed(_accumulate_and_format(_progress(db, habit, start_date, end_date, archive), trim_date)))
 
 
-def _acc_periods_to_streaks_and_breaks(sb, period):
-    # consecutive streak or break
-    if _sb_habit_id(sb) == _period_habit_id(period) and _sb_is_streak(sb) == _period_is_completed(period):
-        return (_period_is_completed(period), _sb_habit_id(sb), _sb_habit_name(sb), _sb_length(sb) + 1, _period_start(period), _sb_end(sb))
-
-    # new streak or break
-    return (_period_is_completed(period), _period_habit_id(period), _period_habit_name(period), 1, _period_start(period), _period_end(period))
-
-def _streaks_and_breaks(periods) -> list:
-    """ returns a list of streaks and breaks
-    Args:
-        periods: periods to accumulate
-    """   
-    return list(map(lambda g: max(g[1], key=_sb_length),
-               groupby(accumulate(periods, _acc_periods_to_streaks_and_breaks, initial=(False, 0, "", 0, date.today(), date.today())), lambda p: (_sb_habit_id(p), _sb_end(p)))))
-
-def _remove_last_break(periods : list):
-    """ do not count time from habit creation until first completed task as 'break' """
-    if len(periods) == 0:
-        return periods
-
-    if _sb_is_streak(periods[-1]):
-        return periods[1:]
-
-    return periods[1:-1]
-
+@_cached
 def past_streaks(db : DB, habit) -> list:
     """ get streaks and breaks for a given habit, skipping the current period
     Args:
         habit: habit id (int) or name (str)
     """   
-    return list(map(lambda sb: (_sb_type(sb), _sb_length(sb), _sb_start(sb), _sb_end(sb)), _remove_last_break(_streaks_and_breaks(islice(_periods(db, habit=habit), 1, None)))))
+    return list(map(lambda sb: (_sb_type(sb), _sb_length(sb), _sb_start(sb), _sb_end(sb)), _st_past_streaks(_streaks(next(_period_batches(db, habit=habit), PeriodBatch())))))
+
 
+def _max_streaks(db : DB, period_days : int = None, habit = None, habit_range : tuple = None):
+    # longest streak per habit
+    return filter(None, map(_st_max_streak, _streaks_per_habit(_period_batches(db, period_days, habit, habit_range))))
 
+def _max_breaks(db : DB, period_days : int = None, habit = None, habit_range : tuple = None):
+    # longest break per habit
+    return filter(None, map(_st_max_break, _streaks_per_habit(_period_batches(db, period_days, habit, habit_range))))
+
+@_cached
 def max_streak(db : DB, period_days : int = None, habit = None):
     """ get the longest streak
     Args:
         period_days: optionally filter by length of period
         habit: optionally filter by habit
     """
-    return [max(filter(_sb_is_streak, _streaks_and_breaks(_periods(db, period_days, habit))),default=(),key=_sb_length)[2:]]
+    streaks = _parallel(db, "max_streak", (period_days,), period_days) if _in_parallel(db, habit) else _max_streaks(db, period_days, habit)
+
+    return [max(streaks,default=(),key=_sb_length)[2:]]
 
 
+@_cached
 def max_break(db : DB, period_days : int = None, habit = None):
     """ get the longest break, skipping the current period
     Args:
         period_days: optionally filter by length of period
         habit: optionally filter by habit
     """
-    return [max(filterfalse(_sb_is_streak, _remove_last_break(_streaks_and_breaks(islice(_periods(db, period_days, habit), 1, None)))),default=(),key=_sb_length)[2:]]
+    breaks = _parallel(db, "max_break", (period_days,), period_days) if _in_parallel(db, habit) else _max_breaks(db, period_days, habit)
+
+    return [max(breaks,default=(),key=_sb_length)[2:]]
 
 
 def _acc_periods_to_completion_rate(comp, period):
@@ -269,12 +542,94 @@ def _acc_periods_to_completion_rate(comp, period):
     # next habit
     return (_period_habit_id(period), _period_habit_name(period), (1 if _period_is_completed(period) else 0), 1)
 
+def _completion_counts(db : DB, start_date : date = None, end_date : date = None, habit_range : tuple = None):
+    # completed and total number of periods per habit
+    return map(lambda g: max(g[1], key=_comp_count),
+             filter(lambda g: g[0] > 0, groupby(accumulate(_periods(db, habit_range=habit_range) if start_date is None else _periods_between(db, start_date, end_date, habit_range)
+                                                          ,_acc_periods_to_completion_rate, initial=(0, "", 0, 0)), _comp_habit_id)))
+
+@_cached
 def completion_rate(db : DB, start_date : date = None, end_date : date = None):
     """ returns completion rates for all periods in a given timeframe
     Args:
         start_date: start of timeframe to analyze (including)
         end_date: end of timeframe to analyze (including)
     """
-    return list(map(lambda c: (*c[1:], _comp_rate(c)), map(lambda g: max(g[1], key=_comp_count),
-             filter(lambda g: g[0] > 0, groupby(accumulate(_periods(db) if start_date is None else _periods_between(db, start_date, end_date)
-                                                          ,_acc_periods_to_completion_rate, initial=(0, "", 0, 0)), _comp_habit_id)))))
+    counts = _parallel(db, "completion_rate", (start_date, end_date)) if _in_parallel(db) else _completion_counts(db, start_date, end_date)
+
+    return list(map(lambda c: (*c[1:], _comp_rate(c)), counts))
+
+
+def _top(items, limit : int, key, lowest : bool = False) -> list:
+    # keeps a heap of at most 'limit' items instead of sorting all of them (ties keep the order of items, i.e., by habit id)
+    return (heapq.nsmallest if lowest else heapq.nlargest)(limit, items, key=key)
+
+def _top_completion_counts(db : DB, limit : int, lowest : bool, start_date : date = None, end_date : date = None, habit_range : tuple = None) -> list:
+    return _top(_completion_counts(db, start_date, end_date, habit_range), limit, _comp_ratio, lowest)
+
+def _current_streaks(db : DB, period_days : int = None, habit_range : tuple = None):
+    # habits with a current streak as (habit name, current streak length)
+    return filter(lambda cs: cs[1] > 0, map(lambda b: (b.habit_name, _st_current_streak(_streaks(b))), _period_batches(db, period_days, habit_range=habit_range)))
+
+def _top_current_streaks(db : DB, limit : int, period_days : int = None, habit_range : tuple = None) -> list:
+    return _top(_current_streaks(db, period_days, habit_range), limit, lambda cs: cs[1])
+
+def _top_max_breaks(db : DB, limit : int, period_days : int = None, habit_range : tuple = None) -> list:
+    return _top(_max_breaks(db, period_days, habit_range=habit_range), limit, _sb_length)
+
+@_cached
+def top_completion_rates(db : DB, limit : int, lowest : bool = False, start_date : date = None, end_date : date = None) -> list:
+    """ returns the habits with the highest completion rates in a given timeframe, holding no more than 'limit' habits in memory
+    Args:
+        limit: maximum number of habits to return
+        lowest: rank the lowest completion rates first instead
+        start_date: start of timeframe to analyze (including)
+        end_date: end of timeframe to analyze (including)
+    """
+    if _in_parallel(db):
+        counts = _top(_parallel(db, "top_completion_rate", (limit, lowest, start_date, end_date)), limit, _comp_ratio, lowest)
+    else:
+        counts = _top_completion_counts(db, limit, lowest, start_date, end_date)
+
+    return list(map(lambda c: (*c[1:], _comp_rate(c)), counts))
+
+
+@_cached
+def top_current_streaks(db : DB, limit : int, period_days : int = None) -> list:
+    """ returns the habits with the longest current streaks, holding no more than 'limit' habits in memory
+    Args:
+        limit: maximum number of habits to return
+        period_days: optionally filter by length of period
+    """
+    if _in_parallel(db):
+        return _top(_parallel(db, "top_current_streak", (limit, period_days), period_days), limit, lambda cs: cs[1])
+
+    return _top_current_streaks(db, limit, period_days)
+
+
+@_cached
+def top_max_breaks(db : DB, limit : int, period_days : int = None) -> list:
+    """ returns the longest break of the habits with the longest breaks, skipping the current period
+        and holding no more than 'limit' habits in memory
+    Args:
+        limit: maximum number of habits to return
+        period_days: optionally filter by length of period
+    """
+    if _in_parallel(db):
+        breaks = _top(_parallel(db, "top_max_break", (limit, period_days), period_days), limit, _sb_length)
+    else:
+        breaks = _top_max_breaks(db, limit, period_days)
+
+    return list(map(lambda sb: sb[2:], breaks))
+
+
+# analyses computed per range of habits in worker processes, called with (db, habit_range, *args)
+_PARTIAL_ANALYSES = {
+    "max_streak": lambda db, habit_range, period_days: _max_streaks(db, period_days, habit_range=habit_range),
+    "max_break": lambda db, habit_range, period_days: _max_breaks(db, period_days, habit_range=habit_range),
+    "completion_rate": lambda db, habit_range, start_date, end_date: _completion_counts(db, start_date, end_date, habit_range),
+    # rankings only return the top habits of each range, which are ranked again
+    "top_completion_rate": lambda db, habit_range, limit, lowest, start_date, end_date: _top_completion_counts(db, limit, lowest, start_date, end_date, habit_range),
+    "top_current_streak": lambda db, habit_range, limit, period_days: _top_current_streaks(db, limit, period_days, habit_range),
+    "top_max_break": lambda db, habit_range, limit, period_days: _top_max_breaks(db, limit, period_days, habit_range),
+}
@@ -0,0 +1,222 @@
+from tracker.db import DB
+
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from itertools import islice
+
+
+class _Lane:
+    """ single database thread, which keeps its own connection for all requests it executes """
+
+    def __init__(self, name : str):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.pending = 0
+
+        # token of the running request and connection of the thread, guarded by lock to interrupt the right request
+        self.running = None
+        self.connection = None
+        self.lock = threading.Lock()
+
+
+def _delegate(method):
+    """ creates an async method running a method of DB in a database thread """
+
+    @wraps(method)
+    async def call(self, *args, **kwargs):
+        return await self._run(self._least_busy(), partial(method, self._db, *args, **kwargs))
+
+    return call
+
+def _delegate_iterator(method):
+    """ creates a method returning an async iterator over a generator method of DB """
+
+    @wraps(method)
+    def iterate(self, *args, **kwargs):
+        return AsyncRows(self, partial(method, self._db, *args, **kwargs))
+
+    return iterate
+
+
+class AsyncDB:
+    """ asyncio facade of the database, running all requests in dedicated threads,
+        so the event loop never waits for sqlite
+    """
+
+    def __init__(self, db : DB, threads : int = 2, chunk_size : int = 500):
+        """ instanciate the facade, the threads are started on first use
+        Args:
+            db: database, whose connection per thread is kept for all requests of that thread
+            threads: number of database threads, i.e., maximum number of concurrent requests
+            chunk_size: number of rows fetched at once by async iterators
+        """
+
+        self._db = db
+        self._lanes = [_Lane("tracker-async-{0}".format(i)) for i in range(max(1, threads))]
+        self.chunk_size = chunk_size
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """ waits for all started requests and stops the database threads (the database remains open) """
+
+        for lane in self._lanes:
+            lane.executor.shutdown(cancel_futures=True)
+
+    def _least_busy(self) -> _Lane:
+        return min(self._lanes, key=lambda lane: lane.pending)
+
+    async def _run(self, lane : _Lane, func):
+        """ runs a function in a database thread
+            (on cancellation, a queued function is dropped and a running query is interrupted)
+        """
+
+        token = object()
+
+        def execute():
+            connection = self._db._create_connection()
+
+            with lane.lock:
+                lane.running, lane.connection = token, connection
+
+            try:
+                return func()
+            finally:
+                with lane.lock:
+                    lane.running = None
+
+        lane.pending += 1
+
+        try:
+            return await asyncio.wrap_future(lane.executor.submit(execute))
+        except asyncio.CancelledError:
+            with lane.lock:
+                if lane.running is token:
+                    lane.connection.interrupt()
+            raise
+        finally:
+            lane.pending -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """ runs any function taking the database as first argument in a database thread,
+            e.g., await adb.run(analytics.max_streak, period_days=7)
+        """
+        return await self._run(self._least_busy(), partial(func, self._db, *args, **kwargs))
+
+    is_empty = _delegate(DB.is_empty)
+    get_data_version = _delegate(DB.get_data_version)
+    get_habit = _delegate(DB.get_habit)
+    save_habit = _delegate(DB.save_habit)
+    delete_habit = _delegate(DB.delete_habit)
+    add_progress = _delegate(DB.add_progress)
+    import_progress = _delegate(DB.import_progress)
+    start_progress = _delegate(DB.start_progress)
+    end_progress = _delegate(DB.end_progress)
+    reset_progress = _delegate(DB.reset_progress)
+    archive_progress = _delegate(DB.archive_progress)
+    export_database = _delegate(DB.export_database)
+    rebuild_period_summary = _delegate(DB.rebuild_period_summary)
+    verify_period_summary = _delegate(DB.verify_period_summary)
+
+    get_habits = _delegate_iterator(DB.get_habits)
+    get_progress = _delegate_iterator(DB.get_progress)
+    get_periods = _delegate_iterator(DB.get_periods)
+    get_periods_between = _delegate_iterator(DB.get_periods_between)
+    get_period_batches = _delegate_iterator(DB.get_period_batches)
+
+
+class AsyncRows:
+    """ async iterator over a database generator, which is advanced in chunks by a single database thread,
+        so its cursor stays on the connection of that thread, and requests of other tasks are executed in between
+        (use 'async with' or 'aclose', when not iterating until the end)
+    """
+
+    def __init__(self, adb : AsyncDB, generator):
+        """ instanciate the iterator, the query is started with the first chunk
+        Args:
+            adb: facade providing the database threads
+            generator: function returning the generator to iterate
+        """
+
+        self._adb = adb
+        self._lane = adb._least_busy()
+        self._generator = generator
+        self._rows = deque()
+        self._done = False
+
+        # keeps the lane chosen for the first chunk, even while other lanes are less busy
+        self._lane.pending += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _fetch(self) -> list:
+        """ returns the next chunk of rows, executed in the database thread """
+
+        if callable(self._generator):
+            self._generator = self._generator()
+
+        return list(islice(self._generator, self._adb.chunk_size))
+
+    async def __anext__(self):
+
+        if not self._rows:
+            if self._done:
+                raise StopAsyncIteration
+
+            try:
+                # only fetched when consumed, so a slow consumer holds a single chunk
+                self._rows.extend(await self._adb._run(self._lane, self._fetch))
+            except BaseException:
+                # incl. cancellation, where the generator is closed after the interrupted chunk
+                self._finish(wait=False)
+                raise
+
+            if len(self._rows) < self._adb.chunk_size:
+                self._finish(wait=False)
+
+            if not self._rows:
+                raise StopAsyncIteration
+
+        return self._rows.popleft()
+
+    def _finish(self, wait : bool):
+        """ releases the lane and closes the generator in its thread, after any running chunk """
+
+        if self._done:
+            return None
+
+        self._done = True
+        self._lane.pending -= 1
+
+        if callable(self._generator):
+            return None
+
+        try:
+            future = self._lane.executor.submit(self._generator.close)
+        except RuntimeError:
+            # threads already stopped
+            return None
+
+        return asyncio.wrap_future(future) if wait else None
+
+    async def aclose(self):
+        """ stops iterating and releases the cursor """
+
+        self._rows.clear()
+
+        future = self._finish(wait=True)
+        if future is not None:
+            await future
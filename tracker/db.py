@@ -1,111 +1,462 @@
-from tracker.habit import Habit
-from tracker.period import Period
+from tracker.habit import Habit, HabitState
+from tracker.period import PeriodBatch
 from tracker.progress import Progress
+from tracker.profiler import QueryProfiler, ProfilingConnection
 
-import random
+import os
 import sqlite3
+import threading
 import datetime # do not change or pytest monkeypatch will break
-from contextlib import closing
+from contextlib import closing, contextmanager, nullcontext
+from itertools import islice
+
+# version of the schema, stored as 'user_version' in the database file
+_SCHEMA_VERSION = 8
+
+# dates are stored as seconds since 1970-01-01 00:00:00 local time, and read as iso formatted text
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+_HABIT_TABLE = '''CREATE TABLE IF NOT EXISTS {0}(
+                   id INTEGER PRIMARY KEY
+                  ,creation_date INTEGER NOT NULL DEFAULT(CAST(strftime('%s', 'now', 'localtime') AS INTEGER))
+                  ,name TEXT UNIQUE NOT NULL
+                  ,task TEXT NOT NULL -- task description
+                  ,period INTEGER NOT NULL DEFAULT(1)
+                  ,goal INTEGER NOT NULL DEFAULT(1)
+                  ,unit TEXT NOT NULL DEFAULT('')
+                  )'''
+
+_PROGRESS_TABLE = '''CREATE TABLE IF NOT EXISTS {0}(
+                      id INTEGER PRIMARY KEY
+                     ,habit_id INTEGER NOT NULL
+                     ,progress_date INTEGER NOT NULL DEFAULT(CAST(strftime('%s', 'now', 'localtime') AS INTEGER))
+                     ,amount INTEGER NOT NULL DEFAULT(1)
+                     ,FOREIGN KEY(habit_id) REFERENCES {1}(id) ON DELETE CASCADE
+                     )'''
+
+_HABIT_COLUMNS = '''id, datetime(creation_date, 'unixepoch') AS creation_date, name, task, period, goal, unit'''
+
+_PROGRESS_COLUMNS = '''id, habit_id, datetime(progress_date, 'unixepoch') AS progress_date, amount'''
+
+# progress summed per habit and bucket, i.e., per day (1), iso week (7) and calendar month (30),
+# leaving out running timers, which have no amount yet
+_ROLLUPS = '''SELECT P.[habit_id], B.[bucket]
+                   , CASE B.[bucket] WHEN 7 THEN date(P.[day], '-6 days', 'weekday 1') --monday
+                                     WHEN 30 THEN date(P.[day], 'start of month')
+                                     ELSE P.[day] END AS start_date
+                   , SUM(P.[amount]) AS amount
+              FROM (SELECT [habit_id], date([progress_date], 'unixepoch') AS day, [amount] FROM [progress] WHERE [amount] <> 0 AND ({0})) P
+              CROSS JOIN (SELECT 1 AS bucket UNION ALL SELECT 7 UNION ALL SELECT 30) B
+              WHERE true
+              GROUP BY P.[habit_id], B.[bucket], 3'''
+
+# adds the progress rows matching the condition {0} to the rollups
+_ADD_ROLLUPS = '''INSERT INTO progress_rollup (habit_id, bucket, start_date, amount) ''' + _ROLLUPS + '''
+                  ON CONFLICT (habit_id, bucket, start_date) DO UPDATE SET amount = amount + excluded.amount'''
+
+# progress rows of a habit incl. the rows moved to an attached archive database in place of their folded rows,
+# which are the rows before 'folded_until' that existed when archiving (running timers are never folded)
+_ARCHIVED_PROGRESS = '''SELECT P.[id], P.[habit_id], P.[progress_date], P.[amount]
+                         FROM main.[progress] P
+                         WHERE P.[habit_id] = :habit_id
+                           AND NOT EXISTS (SELECT 1 FROM [archive_state] S
+                                           WHERE S.[habit_id] = P.[habit_id] AND P.[amount] <> 0
+                                             AND P.[progress_date] < S.[folded_until] AND P.[id] <= S.[last_id])
+                         UNION ALL
+                         SELECT A.[id], A.[habit_id], A.[progress_date], A.[amount]
+                         FROM archive.[progress] A
+                         INNER JOIN [archive_state] S
+                          ON S.[habit_id] = A.[habit_id]
+                         AND A.[progress_date] < S.[folded_until]
+                         WHERE A.[habit_id] = :habit_id'''
+
+# converts text dates of earlier versions (and keeps integers, if already converted)
+_TO_EPOCH = '''CASE WHEN typeof({0}) = 'integer' THEN {0} ELSE CAST(strftime('%s', {0}) AS INTEGER) END'''
+
+# (version, statements, rebuild period summary) applied in order to databases of an older version,
+# before all missing schema objects of the current version are created
+_MIGRATIONS = [
+    # periods were aligned per period length instead of per habit
+    (1, ["DROP VIEW IF EXISTS period", "DROP TABLE IF EXISTS period_summary", "DROP TABLE IF EXISTS period_summary_state"], True),
+    # period computation supports timeframes
+    (2, ["DROP VIEW IF EXISTS period"], False),
+    # superseded by the covering index incl. amount
+    (3, ["DROP INDEX IF EXISTS INDEX_progress_habit_date"], False),
+    # data version for caching analysis results
+    (4, [], False),
+    # integer dates, where the tables are copied, as sqlite cannot change column types
+    # (the new habit table is referenced until renamed, so dropping the old one does not cascade,
+    #  and progress of habits deleted without enforced foreign keys is left behind)
+    (5, ["DROP VIEW IF EXISTS period",
+         _HABIT_TABLE.format("habit_v5"),
+         '''INSERT INTO habit_v5 (id, creation_date, name, task, period, goal, unit)
+            SELECT id, {0}, name, task, period, goal, unit FROM habit'''.format(_TO_EPOCH.format("creation_date")),
+         _PROGRESS_TABLE.format("progress_v5", "habit_v5"),
+         '''INSERT INTO progress_v5 (id, habit_id, progress_date, amount)
+            SELECT id, habit_id, {0}, amount FROM progress WHERE habit_id IN (SELECT id FROM habit)'''.format(_TO_EPOCH.format("progress_date")),
+         "DROP TABLE progress",
+         "DROP TABLE habit",
+         "ALTER TABLE habit_v5 RENAME TO habit",
+         "ALTER TABLE progress_v5 RENAME TO progress"], True),
+    # periods sum rollups instead of progress rows, which are filled by the rebuild
+    (6, ["DROP VIEW IF EXISTS period"], True),
+    # archiving of folded progress
+    (7, [], False),
+    # running state of habits, computed on first read
+    (8, [], False),
+]
+
+# periods of every habit, anchored at its first progress (or creation date, if there is none)
+_PERIODS = '''WITH RECURSIVE StartDates AS
+                (
+                   -- compute start dates per habit, incl. special 'weekly' and 'monthly' periods
+                   SELECT [habit_id], [period]
+                        , CASE WHEN [period] = 7 THEN date([first_date], 'unixepoch', '-6 days', 'weekday 1') --monday
+                               WHEN [period] = 30 THEN date([first_date], 'unixepoch', 'start of month')
+                               ELSE date([first_date], 'unixepoch') END AS start_date
+                   FROM (SELECT H.[id] AS habit_id, H.[period]
+                              , ifnull((SELECT MIN(P.[progress_date]) FROM [progress] P WHERE P.[habit_id] = H.[id]), H.[creation_date]) AS first_date
+                         FROM [habit] H
+                         {habit_filter})
+                )
+                , SkippedPeriods AS
+                (
+                   -- number of periods before the analyzed timeframe
+                   SELECT [habit_id], [period], [start_date], {skipped} AS skipped
+                   FROM StartDates
+                )
+                , AlignedPeriods AS 
+                (
+                   -- generate list of all necessary periods
+                   SELECT [habit_id]
+                        , [period]
+                        , [skipped] + 1 AS nr
+                        , CASE WHEN [period] = 30 THEN date([start_date], ([skipped] || ' month'))
+                               ELSE date([start_date], (([skipped] * [period]) || ' day')) END AS start_date
+                        , CASE WHEN [period] = 30 THEN date([start_date], (([skipped] + 1) || ' month'))
+                               ELSE date([start_date], ((([skipped] + 1) * [period]) || ' day')) END AS end_date
+                   FROM SkippedPeriods
+                   UNION ALL
+                   SELECT [habit_id]
+                        , [period]
+                        , [nr] + 1
+                        , [end_date]
+                        , CASE WHEN [period] = 30 THEN date([end_date], '+1 month')
+                               ELSE date([end_date], ([period] || ' day')) END
+                   FROM AlignedPeriods
+                   WHERE [end_date] <= date('now', 'localtime'){until}
+                )
+                SELECT A.[period], A.[nr], H.[id] AS habit_id, H.[name] AS habit_name, H.[goal],
+                       A.[start_date], date(A.[end_date], '-1 day') AS end_date, ifnull(SUM(R.amount), 0) AS progress
+                FROM AlignedPeriods A
+                INNER JOIN habit H
+                 ON H.[id] = A.[habit_id]
+                LEFT OUTER JOIN [progress_rollup] R
+                 ON R.[habit_id] = A.[habit_id]
+                AND R.[bucket] = CASE WHEN A.[period] IN (7, 30) THEN A.[period] ELSE 1 END -- weeks and months match a single bucket
+                AND R.[start_date] >= A.[start_date] AND R.[start_date] < A.[end_date]
+                {timeframe}
+                GROUP BY A.[period], A.[nr], H.[id], H.[name], H.[goal], A.[start_date], date(A.[end_date], '-1 day')'''
+
+# number of whole periods between the start of a habit and the start of the timeframe
+_SKIPPED_PERIODS = '''CASE WHEN [start_date] >= :start_date THEN 0
+                            WHEN [period] = 30 THEN (strftime('%Y', :start_date) - strftime('%Y', [start_date])) * 12
+                                                   + strftime('%m', :start_date) - strftime('%m', [start_date])
+                                                   + (strftime('%d', :start_date) > '01')
+                            ELSE (CAST(julianday(:start_date) - julianday([start_date]) AS INTEGER) + [period] - 1) / [period] END'''
+
+def _periods_query(habit_filter : bool = False, timeframe : bool = False) -> str:
+    """ returns the query computing periods
+    Args:
+        habit_filter: only compute periods for the habit given as parameter :habit_id
+        timeframe: only compute periods between the parameters :start_date and :end_date (including)
+    """
+
+    if not timeframe:
+        return _PERIODS.format(habit_filter="WHERE H.[id] = :habit_id" if habit_filter else "", skipped="0", until="", timeframe="")
+
+    return _PERIODS.format(habit_filter="WHERE H.[id] = :habit_id" if habit_filter else "", skipped=_SKIPPED_PERIODS,
+                           until=" AND [end_date] <= :end_date",
+                           timeframe="WHERE A.[start_date] >= :start_date AND A.[end_date] <= date(:end_date, '+1 day') AND A.[start_date] <= date('now', 'localtime')")
+
+def _to_epoch(value) -> int:
+    """ encodes a datetime, date or iso formatted text as seconds since 1970-01-01 00:00:00 (local time) """
+
+    if isinstance(value, int):
+        return value
+
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif not hasattr(value, "hour"):
+        value = datetime.datetime(value.year, value.month, value.day)
+
+    return int((value.replace(tzinfo=None) - _EPOCH).total_seconds())
 
 class DB:
     """ encapsulates all database requests """
 
-    def __init__(self, connection : str):
+    def __init__(self, connection : str, period_summary : bool = True, profiler : QueryProfiler = None, read_only : bool = False):
         """ instanciate database encapsulation
         Args:
             connection: path to sqlite3 database file
+            period_summary: read periods from the materialized 'period_summary' table instead of the 'period' view
+            profiler: optionally collect statistics for every sql statement
+            read_only: open connections in read-only mode, e.g., for workers of parallel analyses
         """
 
         self._connection = connection
+        self._period_summary = period_summary
+        self._read_only = read_only
+        self.profiler = profiler
+
+        # one long-lived connection per thread
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     
     def _create_connection(self):
-        """ returns a database connection """       
-        return sqlite3.connect(self._connection)
+        """ returns the database connection of the current thread, opening it on first use """
+
+        conn = getattr(self._local, "connection", None)
+
+        if conn is None:
+            database, uri = self._connection, False
+
+            if self._read_only:
+                from urllib.parse import quote
+                database, uri = "file:{0}?mode=ro".format(quote(os.path.abspath(database))), True
+
+            if self.profiler is None:
+                conn = sqlite3.connect(database, cached_statements=256, check_same_thread=False, uri=uri)
+            else:
+                conn = sqlite3.connect(database, cached_statements=256, check_same_thread=False, uri=uri, factory=ProfilingConnection)
+                conn.profiler = self.profiler
+
+            if not self._read_only:
+                # persisted in the file, so read-only connections use it as well
+                conn.execute('''PRAGMA journal_mode = WAL''')
+
+            conn.execute('''PRAGMA synchronous = NORMAL''')
+            conn.execute('''PRAGMA foreign_keys = ON''')
+
+            self._local.connection = conn
+
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    @contextmanager
+    def _connect(self):
+        """ provides the connection of the current thread and rolls back uncommitted changes on errors """
+
+        conn = self._create_connection()
+
+        try:
+            yield conn
+        except GeneratorExit:
+            # generator closed before being exhausted
+            raise
+        except BaseException:
+            if not self._in_transaction():
+                conn.rollback()
+            raise
+
+    def _in_transaction(self) -> bool:
+        """ checks if the current thread runs inside 'transaction()' """
+        return getattr(self._local, "transaction", False)
+
+    def _commit(self, conn):
+        """ commits, unless the current thread runs inside 'transaction()' """
+        if not self._in_transaction():
+            conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        """ defers all commits of the current thread to the end of the context and rolls back all changes on errors """
+
+        conn = self._create_connection()
+        self._local.transaction = True
+
+        try:
+            yield self
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.transaction = False
+
+    def set_profiler(self, profiler : QueryProfiler):
+        """ starts or stops (None) collecting statistics for every sql statement """
+
+        self.close()
+        self.profiler = profiler
+
+    def close(self):
+        """ closes the connections of all threads """
+
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+
+            self._connections.clear()
+
+        self._local = threading.local()
         
     
     def assure_database(self):
-        """ creates schema objects if neccessary 
+        """ creates the schema of a new database or migrates an existing one to the current version
+            (no schema statements are executed, if the database is up to date)
+        """
+
+        with self._connect() as conn:
+            with closing(conn.cursor()) as cmd:
+
+                version = cmd.execute('''PRAGMA user_version''').fetchone()[0]
+
+                if version == _SCHEMA_VERSION:
+                    return
+
+                if version > _SCHEMA_VERSION:
+                    raise Exception("database schema version {0} is newer than the supported version {1}".format(version, _SCHEMA_VERSION))
+
+                # schema changes and rebuilds are applied all at once or not at all,
+                # while other processes are locked out from writing
+                if not conn.in_transaction:
+                    cmd.execute('''BEGIN IMMEDIATE''')
+
+                # re-read, as another process might have migrated in the meantime
+                version = cmd.execute('''PRAGMA user_version''').fetchone()[0]
+
+                if version < _SCHEMA_VERSION:
+                    existing = cmd.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'habit' ''').fetchone()
+
+                    # new databases do not need migrations
+                    migrations = [m for m in _MIGRATIONS if m[0] > version] if existing else []
+
+                    for _, statements, _ in migrations:
+                        for statement in statements:
+                            cmd.execute(statement)
+
+                    self._create_schema(cmd)
+
+                    if any(rebuild for _, _, rebuild in migrations):
+                        self._rebuild_period_summary(cmd)
+
+                    cmd.execute('''PRAGMA user_version = {0}'''.format(_SCHEMA_VERSION))
+
+                self._commit(conn)
+
+    def _create_schema(self, cmd):
+        """ creates all schema objects of the current version, which do not exist yet
         Tables:
             habit(id, name, task, creation_date, period, goal, unit)
             progress(id, habit_id, progress_date, amount)
+            progress_rollup(habit_id, bucket, start_date, amount)
+            period_summary(period, nr, habit_id, habit_name, goal, start_date, end_date, progress)
+            period_summary_state(habit_id, valid_until)
+            data_version(id, version)
+            archive_state(habit_id, folded_until, last_id)
+            habit_state(habit_id, period_start, period_end, progress, streak, streak_start, best_streak)
         Index: 
-            progress(habit_id, progress_date)
+            habit(period, name)
+            progress(habit_id, progress_date, amount)
+            progress(habit_id) WHERE amount = 0
+            period_summary(period, habit_id, start_date)
+            period_summary(start_date, end_date)
         View:
             period(period, nr, habit_id, goal, start_date, end_date, progress)
         """
 
-        with closing(self._create_connection()) as conn:
-            with closing(conn.cursor()) as cmd:
+        cmd.execute(_HABIT_TABLE.format("habit"))
 
-                cmd.execute('''CREATE TABLE IF NOT EXISTS habit(
-                               id INTEGER PRIMARY KEY
-                              ,creation_date TEXT NOT NULL DEFAULT(datetime('now', 'localtime'))
-                              ,name TEXT UNIQUE NOT NULL
-                              ,task TEXT NOT NULL -- task description                              
-                              ,period INTEGER NOT NULL DEFAULT(1)
-                              ,goal INTEGER NOT NULL DEFAULT(1)
-                              ,unit TEXT NOT NULL DEFAULT('')
-                              )''')
-            
-                cmd.execute('''CREATE TABLE IF NOT EXISTS progress(
-                               id INTEGER PRIMARY KEY
-                              ,habit_id INTEGER NOT NULL
-                              ,progress_date TEXT NOT NULL DEFAULT(datetime('now', 'localtime'))
-                              ,amount INTEGER NOT NULL DEFAULT(1)
-                              ,FOREIGN KEY(habit_id) REFERENCES habit(id) ON DELETE CASCADE
-                              )''')
-
-                cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_progress_habit_date ON progress(habit_id, progress_date)''')
-
-
-                cmd.execute('''CREATE VIEW IF NOT EXISTS period AS                        
-                                WITH RECURSIVE StartDates AS
-                                (
-                                   -- compute start dates for special 'weekly' and 'monthly' periods
-	                               SELECT [period]
-	                                    , MIN(CASE WHEN [period] = 7 THEN date(ifnull([progress_date],[creation_date]), '-6 days', 'weekday 1') --monday
-			                                       WHEN [period] = 30 THEN date(ifnull([progress_date],[creation_date]), 'start of month')
-			                                       ELSE date(ifnull([progress_date],[creation_date])) END) AS start_date
-                                   FROM [habit]	H        
-                                   LEFT OUTER JOIN [progress]  P
-                                    ON P.[habit_id] = H.[id]
-                                   GROUP BY [period]
-                                )
-                                , AlignedPeriods AS 
-                                (
-                                    -- generate list of all necessary periods
-	                                SELECT    [period]
-			                        , 1 AS nr
-			                        , [start_date]
-			                        , CASE WHEN [period] = 30 THEN date([start_date], '+1 month')
-						       ELSE date([start_date], ([period] || ' day')) END AS end_date					                  
-	                                FROM StartDates
-	                                UNION ALL
-	                                SELECT    [period]		
-			                        , [nr] + 1
-                                            	, [end_date]
-			                        , CASE WHEN [period] = 30 THEN date([end_date], '+1 month')
-					               ELSE date([end_date], ([period] || ' day')) END			                         
-	                                FROM     AlignedPeriods
-	                                WHERE    [end_date] <= date('now', 'localtime')
-                                )
-                                SELECT A.[period], A.[nr], H.[id] AS habit_id, H.[name] AS habit_name, H.[goal],
-                                       A.[start_date], date(A.[end_date], '-1 day') AS end_date, ifnull(SUM(P.amount), 0) AS progress
-                                FROM habit H
-                                INNER JOIN AlignedPeriods A
-                                 ON A.[period] = H.[period]
-                                LEFT OUTER JOIN [progress] P
-                                 ON P.[habit_id] = H.[id]
-                                AND P.[progress_date] >= A.[start_date] AND P.[progress_date] < A.[end_date]
-                                GROUP BY A.[period], A.[nr], H.[id], H.[name], H.[goal], A.[start_date], date(A.[end_date], '-1 day')''')
+        cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_habit_period_name ON habit(period, name)''')
+    
+        cmd.execute(_PROGRESS_TABLE.format("progress", "habit"))
+
+        # covering index, so period sums never read the table itself
+        cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_progress_habit_date_amount ON progress(habit_id, progress_date, amount)''')
+
+        # running timers of habits with unit 'minutes'
+        cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_progress_running ON progress(habit_id) WHERE amount = 0''')
+
+
+        # progress per day, week and month, maintained by all write methods
+        cmd.execute('''CREATE TABLE IF NOT EXISTS progress_rollup(
+                       habit_id INTEGER NOT NULL
+                      ,bucket INTEGER NOT NULL -- 1 (day), 7 (iso week) or 30 (calendar month)
+                      ,start_date TEXT NOT NULL
+                      ,amount INTEGER NOT NULL DEFAULT(0)
+                      ,PRIMARY KEY(habit_id, bucket, start_date)
+                      ,FOREIGN KEY(habit_id) REFERENCES habit(id) ON DELETE CASCADE
+                      ) WITHOUT ROWID''')
+
+        cmd.execute('''CREATE VIEW IF NOT EXISTS period AS ''' + _periods_query())
+
+        # materialized version of the period view, maintained by all write methods
+        cmd.execute('''CREATE TABLE IF NOT EXISTS period_summary(
+                       period INTEGER NOT NULL
+                      ,nr INTEGER NOT NULL
+                      ,habit_id INTEGER NOT NULL
+                      ,habit_name TEXT NOT NULL
+                      ,goal INTEGER NOT NULL
+                      ,start_date TEXT NOT NULL
+                      ,end_date TEXT NOT NULL
+                      ,progress INTEGER NOT NULL DEFAULT(0)
+                      ,PRIMARY KEY(habit_id, start_date)
+                      ) WITHOUT ROWID''')
+
+        cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_period_summary_period ON period_summary(period, habit_id, start_date)''')
+        cmd.execute('''CREATE INDEX IF NOT EXISTS INDEX_period_summary_start ON period_summary(start_date, end_date)''')
+
+        # last date covered by the summary per habit
+        cmd.execute('''CREATE TABLE IF NOT EXISTS period_summary_state(
+                       habit_id INTEGER PRIMARY KEY
+                      ,valid_until TEXT NOT NULL
+                      )''')
+
+        # single row counting all changes of habits and progress
+        cmd.execute('''CREATE TABLE IF NOT EXISTS data_version(
+                       id INTEGER PRIMARY KEY CHECK(id = 1)
+                      ,version INTEGER NOT NULL
+                      )''')
+
+        cmd.execute('''INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)''')
+
+        # progress before 'folded_until' with ids up to 'last_id' was folded, while its rows were moved to an archive database
+        cmd.execute('''CREATE TABLE IF NOT EXISTS archive_state(
+                       habit_id INTEGER PRIMARY KEY
+                      ,folded_until INTEGER NOT NULL
+                      ,last_id INTEGER NOT NULL
+                      ,FOREIGN KEY(habit_id) REFERENCES habit(id) ON DELETE CASCADE
+                      )''')
+
+        # current period and streaks per habit, maintained by adding progress and rolled forward on read
+        cmd.execute('''CREATE TABLE IF NOT EXISTS habit_state(
+                       habit_id INTEGER PRIMARY KEY
+                      ,period_start TEXT NOT NULL
+                      ,period_end TEXT NOT NULL
+                      ,progress INTEGER NOT NULL DEFAULT(0)
+                      ,streak INTEGER NOT NULL DEFAULT(0) -- completed periods directly before the current one
+                      ,streak_start TEXT
+                      ,best_streak INTEGER NOT NULL DEFAULT(0) -- longest streak before the current period
+                      ,FOREIGN KEY(habit_id) REFERENCES habit(id) ON DELETE CASCADE
+                      )''')
 
 
 #region mangement
 
     def is_empty(self) -> bool:
         """ check if database is empty """
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
                 res = cmd.execute('''SELECT id FROM habit LIMIT 1''').fetchone()
                 if res is None:
@@ -113,6 +464,16 @@ class DB:
 
         return False
 
+    def get_data_version(self) -> int:
+        """ returns a counter, which is increased by every change of habits or progress """
+        with self._connect() as conn:
+            with closing(conn.cursor()) as cmd:
+                return cmd.execute('''SELECT version FROM data_version''').fetchone()[0]
+
+    def _bump_data_version(self, cmd):
+        """ marks all results computed from previous data as outdated """
+        cmd.execute('''UPDATE data_version SET version = version + 1''')
+
     def _get_habit_id(self, habit) -> int:
         """ returns id of habit
         Args:
@@ -120,7 +481,7 @@ class DB:
         """
         
         if isinstance(habit, int) or (isinstance(habit, str) and habit.isdigit()):
-            with closing(self._create_connection()) as conn:
+            with self._connect() as conn:
                 with closing(conn.cursor()) as cmd:
                     res = cmd.execute('''SELECT id FROM habit WHERE id = ?''', [habit]).fetchone()
                     if res is None:
@@ -128,7 +489,7 @@ class DB:
                     return res[0]
 
         if isinstance(habit, str):
-            with closing(self._create_connection()) as conn:
+            with self._connect() as conn:
                 with closing(conn.cursor()) as cmd:
                     res = cmd.execute('''SELECT id FROM habit WHERE name = ?''', [habit]).fetchone()
                     if res is None:
@@ -142,44 +503,22 @@ class DB:
         """ returns habit from database
         Args:
             identifier: id (int) or name (str)
-            include_current_periods: optionally include current periods
+            include_current_periods: optionally include the current period and streak
         """
 
         id = self._get_habit_id(identifier)
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                res = cmd.execute('''SELECT * FROM habit WHERE id = ?''', [id]).fetchone()
+                res = cmd.execute('''SELECT ''' + _HABIT_COLUMNS + ''' FROM habit WHERE id = ?''', [id]).fetchone()
 
                 habit = Habit.from_db(*res)
 
-                if include_current_periods:
-
-                    first_period = True
-
-                    cur = cmd.execute('''SELECT start_date, end_date, progress FROM period WHERE habit_id = ? ORDER BY start_date DESC''', [id])
-
-                    while True:
-                        res = cur.fetchmany(100)
-                        if not res:
-                            break
-
-                        for row in res:
-                            period = Period(*row)
-                            habit.add_period(period)
-
-                            # stop after first break of the current streak
-                            if period.progress < habit.goal and not first_period:
-                                break
-
-                            first_period = False
-                        else:
-                            continue
-
-                        break
+            if include_current_periods:
+                habit.set_state(self._get_state(conn, habit))
 
-                return habit
+            return habit
 
 
     def delete_habit(self, habit):
@@ -190,37 +529,61 @@ class DB:
 
         id = self._get_habit_id(habit)
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
                 cmd.execute('''DELETE FROM habit WHERE id = ?''', [id])
+
+                self._rebuild_periods(cmd, id)
+
+                self._bump_data_version(cmd)
                 
-                conn.commit()
+                self._commit(conn)
 
 
     def save_habit(self, habit : Habit) -> int:
         """ saves a habit to the db """
 
         try:
-            with closing(self._create_connection()) as conn:
+            with self._connect() as conn:
                 with closing(conn.cursor()) as cmd:
 
                     if habit._id == 0:
 
                          cmd.execute('''INSERT INTO habit (name, task, creation_date, period, goal, unit) VALUES (?, ?, ?, ?, ?, ?)''', 
-                                     (habit.name, habit.task, habit._creation_date, habit.days, habit.goal, habit.unit))
+                                     (habit.name, habit.task, _to_epoch(habit._creation_date), habit.days, habit.goal, habit.unit))
+
+                         id = cmd.lastrowid
+
+                         self._rebuild_periods(cmd, id)
+
+                         self._bump_data_version(cmd)
 
-                         conn.commit()
+                         self._commit(conn)
 
-                         return cmd.lastrowid
+                         return id
                     else:
 
+                         period_days = self._get_period_days(cmd, habit._id)
+
                          cmd.execute('''UPDATE habit SET name = ?, task = ?, period = ?, goal = ?, unit = ? WHERE id = ?''', 
                                      (habit.name, habit.task, habit.days, habit.goal, habit.unit, habit._id))
 
-                         conn.commit()
+                         id = cmd.lastrowid
+
+                         if period_days == int(habit.days):
+                             cmd.execute('''UPDATE period_summary SET habit_name = ?, goal = ? WHERE habit_id = ?''', (habit.name, habit.goal, habit._id))
+                         else:
+                             self._rebuild_periods(cmd, habit._id)
+
+                         # streaks depend on period and goal
+                         self._drop_state(cmd, habit._id)
+
+                         self._bump_data_version(cmd)
 
-                         return cmd.lastrowid
+                         self._commit(conn)
+
+                         return id
 
         except Exception as ex:
             if str(ex).startswith("UNIQUE constraint failed"):
@@ -233,12 +596,105 @@ class DB:
 
         id = self._get_habit_id(progress.habit)
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                cmd.execute('''INSERT INTO progress (habit_id, progress_date, amount) VALUES (?, ?, ?)''', (id, progress.progress_date, progress.amount))
+                first_progress = self._get_first_progress(cmd, id)
+
+                progress_date = _to_epoch(progress.progress_date)
+
+                self._add_state_progress(cmd, id, progress_date, progress.amount)
+
+                cmd.execute('''INSERT INTO progress (habit_id, progress_date, amount) VALUES (?, ?, ?)''', (id, progress_date, progress.amount))
+
+                self._add_rollups(cmd, 'id = ?', [cmd.lastrowid])
 
-                conn.commit()
+                self._add_period_progress(cmd, id, first_progress, progress_date, progress.amount)
+
+                self._bump_data_version(cmd)
+
+                self._commit(conn)
+
+
+    def import_progress(self, progress, chunk_size : int = 5000, report = None) -> int:
+        """ bulk inserts progress in chunked transactions
+        Args:
+            progress: iterable of (habit, progress_date, amount), where habit is an id (int) or name (str)
+            chunk_size: number of rows per transaction
+            report: optional callback receiving the number of rows imported so far after each chunk
+        Returns:
+            number of imported rows
+        Raises:
+            Exception: unknown habit or amount below 1, all previous chunks remain imported
+        """
+
+        with self._connect() as conn:
+            with closing(conn.cursor()) as cmd:
+
+                names = dict(cmd.execute('''SELECT name, id FROM habit''').fetchall())
+                ids = set(names.values())
+
+                def habit_id(habit) -> int:
+                    if isinstance(habit, int) or (isinstance(habit, str) and habit.isdigit()):
+                        if int(habit) not in ids:
+                            raise Exception("no habit found with id {0}".format(habit))
+                        return int(habit)
+
+                    if habit not in names:
+                        raise Exception("no habit found with name '{0}'".format(habit))
+                    return names[habit]
+
+                def insert(chunk):
+                    last_id = cmd.execute('''SELECT ifnull(MAX(id), 0) FROM progress''').fetchone()[0]
+
+                    cmd.executemany('''INSERT INTO progress (habit_id, progress_date, amount) VALUES (?, ?, ?)''', chunk)
+                    self._add_rollups(cmd, 'id > ?', [last_id])
+                    self._bump_data_version(cmd)
+                    self._commit(conn)
+
+                count = 0
+                affected = set()
+                chunk = []
+
+                try:
+                    for habit, progress_date, amount in progress:
+                        id = habit_id(habit)
+
+                        # amount 0 denotes a running timer
+                        if int(amount) < 1:
+                            raise Exception("amount has to be positive in row {0}".format(count + len(chunk) + 1))
+
+                        affected.add(id)
+                        chunk.append((id, _to_epoch(progress_date), amount))
+
+                        if len(chunk) == chunk_size:
+                            insert(chunk)
+
+                            count += len(chunk)
+                            chunk.clear()
+                            if report: report(count)
+
+                    if chunk:
+                        insert(chunk)
+
+                        count += len(chunk)
+                        if report: report(count)
+
+                except BaseException:
+                    # discard the rows of a partially inserted chunk, before the periods are summarized and committed
+                    if not self._in_transaction():
+                        conn.rollback()
+                    raise
+
+                finally:
+                    # summarize periods once for all imported rows
+                    for id in affected:
+                        self._rebuild_periods(cmd, id)
+                        self._drop_state(cmd, id)
+
+                    self._commit(conn)
+
+                return count
 
 
     def start_progress(self, habit):
@@ -249,18 +705,25 @@ class DB:
 
         id = self._get_habit_id(habit)
 
-        start_date = datetime.datetime.now()
+        start_date = _to_epoch(datetime.datetime.now())
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                res = cmd.execute('''SELECT * FROM progress WHERE habit_id = ? AND amount = 0''', [id]).fetchone()
+                res = cmd.execute('''SELECT id FROM progress INDEXED BY INDEX_progress_running WHERE habit_id = ? AND amount = 0''', [id]).fetchone()
 
                 if res != None:
                     raise Exception("progress for this habit already started")
 
+                first_progress = self._get_first_progress(cmd, id)
+
                 cmd.execute('''INSERT INTO progress (habit_id, progress_date, amount) VALUES (?, ?, ?)''', (id, start_date, 0))
-                conn.commit()
+
+                self._add_period_progress(cmd, id, first_progress, start_date, 0)
+
+                self._bump_data_version(cmd)
+
+                self._commit(conn)
                     
 
     def end_progress(self, habit) -> int:
@@ -273,25 +736,35 @@ class DB:
 
         id = self._get_habit_id(habit)
         
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                res = cmd.execute('''SELECT progress_date FROM progress WHERE habit_id = ? AND amount = 0''', [id]).fetchone()
+                res = cmd.execute('''SELECT id, progress_date FROM progress INDEXED BY INDEX_progress_running WHERE habit_id = ? AND amount = 0''', [id]).fetchone()
 
                 if res == None:
                     raise Exception("progress for this habit not started")
 
-                start_date = datetime.datetime.fromisoformat(res[0])
+                progress_id, start_date = res
 
-                end_date = datetime.datetime.now()
+                end_date = _to_epoch(datetime.datetime.now())
                 
-                minutes = int((end_date - start_date).total_seconds()/60)
+                minutes = int((end_date - start_date)/60)
 
-                cmd.execute('''UPDATE progress
+                first_progress = self._get_first_progress(cmd, id)
+
+                self._add_state_progress(cmd, id, end_date, minutes)
+
+                cmd.execute('''UPDATE progress INDEXED BY INDEX_progress_running
                                SET progress_date = ?, amount = ?
                                WHERE habit_id = ? AND amount = 0''', (end_date, minutes, id))
 
-                conn.commit()
+                self._add_rollups(cmd, 'id = ?', [progress_id])
+
+                self._add_period_progress(cmd, id, first_progress, end_date, minutes)
+
+                self._bump_data_version(cmd)
+
+                self._commit(conn)
 
                 return minutes
 
@@ -304,12 +777,19 @@ class DB:
         
         id = self._get_habit_id(habit)
         
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
                 cmd.execute('''DELETE FROM progress WHERE habit_id = ?''', [id])
+                cmd.execute('''DELETE FROM progress_rollup WHERE habit_id = ?''', [id])
+                cmd.execute('''DELETE FROM archive_state WHERE habit_id = ?''', [id])
+
+                self._rebuild_periods(cmd, id)
+                self._drop_state(cmd, id)
+
+                self._bump_data_version(cmd)
                 
-                conn.commit()
+                self._commit(conn)
 
 #endregion
 
@@ -321,14 +801,14 @@ class DB:
             period_days: only return habits with this period length
         """
 
-        select = 'SELECT * FROM habit'
+        select = 'SELECT ' + _HABIT_COLUMNS + ' FROM habit'
 
         if period_days:
             select = select + ' WHERE period = {0}'.format(period_days)
        
         select = select + ' ORDER BY name'
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
                 cur = cmd.execute(select)
@@ -342,33 +822,47 @@ class DB:
                        yield row
 
 
-    def get_progress(self, habit, start_date : datetime.date = None, end_date : datetime.date = None):
+    def get_progress(self, habit, start_date : datetime.date = None, end_date : datetime.date = None, archive : str = None):
         """ progress generator
         Args:
             habit: habit id (int) or name (str)
             start_date: start of timeframe (including)
             end_date: end of timeframe (including)
+            archive: optional archive database, whose progress rows replace the rows folded by 'archive_progress'
         """
 
         id = self._get_habit_id(habit)
 
-        select = '''SELECT P.nr, P.start_date, P.end_date, A.progress_date, A.amount, P.goal
-                                     FROM progress A
-                                     INNER JOIN period P
+        if archive is not None and not os.path.exists(archive):
+            raise Exception("archive file not found")
+
+        select = '''SELECT P.nr, P.start_date, P.end_date, datetime(A.progress_date, 'unixepoch') AS progress_date, A.amount, P.goal
+                                     FROM {1} A
+                                     INNER JOIN {0} P
                                         ON A.habit_id = P.habit_id
-                                       AND A.progress_date >= P.start_date
-                                       AND A.progress_date < date(P.end_date, '+1 day')
-                                     WHERE A.habit_id = ?'''
+                                       AND P.start_date <= date(A.progress_date, 'unixepoch')
+                                       AND P.end_date >= date(A.progress_date, 'unixepoch')
+                                     WHERE A.habit_id = :habit_id'''
 
-        if not start_date is None:            
-            select = select + ' AND P.start_date >= ? AND P.end_date <= ?'
+        if not start_date is None:
+            # restrict progress to the timeframe before joining the periods
+            select = select + ''' AND A.progress_date >= :start_epoch AND A.progress_date < :end_epoch
+                                     AND P.start_date >= :start_date AND P.end_date <= :end_date'''
 
-        select = select + ' ORDER BY A.progress_date ASC'
+        select = select + ' ORDER BY A.progress_date ASC, A.id ASC'
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn, (self._attach_archive(conn, archive) if archive else nullcontext()):
             with closing(conn.cursor()) as cmd:
 
-                cur = cmd.execute(select, [id] if start_date is None else (id, start_date, end_date))
+                source = self._get_period_source(conn)
+                if source == 'period':
+                    source = '(' + _periods_query(habit_filter=True, timeframe=not start_date is None) + ')'
+
+                params = {"habit_id": id, "start_date": start_date, "end_date": end_date}
+                if not start_date is None:
+                    params.update(start_epoch=_to_epoch(start_date), end_epoch=_to_epoch(end_date + datetime.timedelta(days=1)))
+
+                cur = cmd.execute(select.format(source, '(' + _ARCHIVED_PROGRESS + ')' if archive else 'progress'), params)
              
                 while True:
                     res = cur.fetchmany(10)
@@ -379,27 +873,20 @@ class DB:
                        yield row
 
 
-    def get_periods(self, period_days : int = None, habit = None):
+    def get_periods(self, period_days : int = None, habit = None, habit_range : tuple = None):
         """ periods generator
         Args:
             period_days: only return periods with this length
             habit: only return periods for this habit
+            habit_range: only return periods for habits with ids between (first, last), including both
         """      
 
-        select = 'SELECT * FROM period'
-
-        if habit:
-            id = self._get_habit_id(habit)
-            select = select + ' WHERE habit_id = {0}'.format(id)
-        elif period_days:
-            select = select + ' WHERE period = {0}'.format(period_days)
-       
-        select = select + ' ORDER BY habit_id, start_date DESC'
+        select = 'SELECT * FROM {0}' + self._get_period_filter(period_days, habit, habit_range)
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                cur = cmd.execute(select)
+                cur = cmd.execute(select.format(self._get_period_source(conn)))
 
                 while True:
                     res = cur.fetchmany(10)
@@ -410,19 +897,26 @@ class DB:
                        yield row
 
 
-    def get_periods_between(self, start_date : datetime.date, end_date : datetime.date):
+    def get_periods_between(self, start_date : datetime.date, end_date : datetime.date, habit_range : tuple = None):
         """ periods generator for given timeframe
         Args:
             start_date: start of timeframe (including)
             end_date: end of timeframe (including)
+            habit_range: only return periods for habits with ids between (first, last), including both
         """
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
-                cur = cmd.execute('''SELECT * FROM period 
-                                     WHERE start_date >= ? AND end_date <= ?
-                                     ORDER BY habit_id, start_date DESC''', (start_date, end_date))
+                source = self._get_period_source(conn)
+                if source == 'period':
+                    # only compute periods within the timeframe
+                    source = '(' + _periods_query(timeframe=True) + ')'
+
+                cur = cmd.execute('''SELECT * FROM {0} 
+                                     WHERE start_date >= :start_date AND end_date <= :end_date{1}
+                                     ORDER BY habit_id, start_date DESC'''.format(source, '' if habit_range is None else ' AND habit_id BETWEEN {0} AND {1}'.format(*habit_range)),
+                                  {"start_date": start_date, "end_date": end_date})
 
                 while True:
                     res = cur.fetchmany(10)
@@ -432,6 +926,496 @@ class DB:
                     for row in res:
                        yield row
 
+
+    def get_period_batches(self, period_days : int = None, habit = None, habit_range : tuple = None):
+        """ generator of columnar periods per habit, starting with the current period
+        Args:
+            period_days: only return periods with this length
+            habit: only return periods for this habit
+            habit_range: only return periods for habits with ids between (first, last), including both
+        """
+
+        # only select changing columns, to not create the same values for every period
+        select = 'SELECT habit_id, goal, start_date, end_date, progress FROM {0}' + self._get_period_filter(period_days, habit, habit_range)
+
+        with self._connect() as conn:
+            with closing(conn.cursor()) as cmd:
+
+                if habit:
+                    names = dict(cmd.execute('''SELECT id, name FROM habit WHERE id = ?''', [self._get_habit_id(habit)]).fetchall())
+                elif habit_range:
+                    names = dict(cmd.execute('''SELECT id, name FROM habit WHERE id BETWEEN ? AND ?''', habit_range).fetchall())
+                else:
+                    names = dict(cmd.execute('''SELECT id, name FROM habit''').fetchall())
+
+                cur = cmd.execute(select.format(self._get_period_source(conn)))
+                cur.arraysize = 100
+
+                batch = PeriodBatch()
+
+                while True:
+                    res = cur.fetchmany()
+                    if not res:
+                        break
+
+                    for habit_id, goal, start_date, end_date, progress in res:
+                        if habit_id != batch.habit_id:
+                            if batch:
+                                yield batch
+
+                            batch = PeriodBatch(habit_id, names[habit_id], goal)
+
+                        batch.append(start_date, end_date, progress)
+
+                if batch:
+                    yield batch
+
+    def _get_period_filter(self, period_days : int = None, habit = None, habit_range : tuple = None) -> str:
+        """ returns where and order by clause for periods of a habit, or of a range of habits and period length """
+
+        conditions = []
+
+        if habit:
+            conditions.append('habit_id = {0}'.format(self._get_habit_id(habit)))
+        else:
+            if habit_range:
+                conditions.append('habit_id BETWEEN {0} AND {1}'.format(*map(int, habit_range)))
+            if period_days:
+                conditions.append('period = {0}'.format(period_days))
+
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY habit_id, start_date DESC'
+
+#endregion
+
+#region export
+
+    def export_rows(self, table : str, encoded_dates : bool = False):
+        """ returns column names and a row generator for a whole table
+        Args:
+            table: 'habit', 'progress' or 'period'
+            encoded_dates: return dates of habits and progress as stored, instead of iso formatted text
+        """
+
+        if table not in ("habit", "progress", "period"):
+            raise Exception("unknown table '{0}'".format(table))
+
+        conn = self._create_connection()
+        source = self._get_period_source(conn) if table == "period" else table
+
+        cmd = conn.cursor()
+        columns = "*" if encoded_dates or table == "period" else (_HABIT_COLUMNS if table == "habit" else _PROGRESS_COLUMNS)
+
+        cur = cmd.execute('''SELECT {0} FROM {1} ORDER BY {2}'''.format(columns, source, "habit_id, start_date" if table == "period" else "id"))
+
+        columns = tuple(map(lambda d: d[0], cur.description))
+
+        def rows():
+            with closing(cmd):
+                while True:
+                    res = cur.fetchmany(1000)
+                    if not res:
+                        break
+
+                    for row in res:
+                       yield row
+
+        return columns, rows()
+
+    def export_database(self, target : str) -> int:
+        """ copies all habits and progress to a new database file
+        Args:
+            target: path of the new sqlite3 database file
+        Returns:
+            number of copied rows
+        """
+
+        if os.path.exists(target):
+            raise Exception("file already exists")
+
+        count = 0
+
+        with DB(target, self._period_summary) as copy:
+            copy.assure_database()
+
+            with copy._connect() as conn:
+                with closing(conn.cursor()) as cmd:
+
+                    for table in ("habit", "progress"):
+                        columns, rows = self.export_rows(table, encoded_dates=True)
+
+                        insert = '''INSERT INTO {0} ({1}) VALUES ({2})'''.format(table, ", ".join(columns), ", ".join("?" * len(columns)))
+
+                        while True:
+                            chunk = list(islice(rows, 5000))
+                            if not chunk:
+                                break
+
+                            cmd.executemany(insert, chunk)
+                            count += len(chunk)
+
+                    copy._commit(conn)
+
+            copy.rebuild_period_summary()
+
+        return count
+
+#endregion
+
+#region archive
+
+    @contextmanager
+    def _attach_archive(self, conn, archive : str):
+        """ attaches an archive database as schema 'archive' for the duration of the context """
+
+        conn.execute('''ATTACH DATABASE ? AS archive''', [str(archive)])
+
+        try:
+            yield conn
+        finally:
+            conn.execute('''DETACH DATABASE archive''')
+
+    def archive_progress(self, before : datetime.date, archive : str = None) -> tuple:
+        """ folds the progress of all periods ending before a date into one row per period,
+            which keeps period sums and completion status, and compacts the database file
+        Args:
+            before: fold periods ending before this date
+            archive: optional path of an sqlite3 file, which receives the progress rows before they are folded
+                     (created, if it does not exist)
+        Returns:
+            (number of folded progress rows, number of rows they were folded into)
+        """
+
+        with self._connect() as conn:
+
+            source = self._get_period_source(conn)
+
+            with (self._attach_archive(conn, archive) if archive else nullcontext()):
+                with closing(conn.cursor()) as cmd:
+
+                    if archive:
+                        cmd.execute('''CREATE TABLE IF NOT EXISTS archive.progress(
+                                       id INTEGER PRIMARY KEY
+                                      ,habit_id INTEGER NOT NULL
+                                      ,progress_date INTEGER NOT NULL
+                                      ,amount INTEGER NOT NULL
+                                      )''')
+
+                        cmd.execute('''CREATE INDEX IF NOT EXISTS archive.INDEX_progress_habit_date ON progress(habit_id, progress_date)''')
+
+                    # start of the first period per habit, which is not folded
+                    cmd.execute('''CREATE TEMP TABLE archive_cutoff AS
+                                   SELECT habit_id, CAST(strftime('%s', MIN(start_date)) AS INTEGER) AS cutoff
+                                   FROM {0} WHERE end_date >= ? GROUP BY habit_id'''.format(source), [before.isoformat()])
+
+                    # rows before the cutoff, which were not folded and archived before
+                    cmd.execute('''CREATE TEMP TABLE archive_rows AS
+                                   SELECT P.id
+                                   FROM main.progress P
+                                   INNER JOIN archive_cutoff C
+                                    ON C.habit_id = P.habit_id
+                                   AND P.progress_date < C.cutoff
+                                   WHERE P.amount <> 0
+                                     AND NOT EXISTS (SELECT 1 FROM archive_state S
+                                                     WHERE S.habit_id = P.habit_id AND P.progress_date < S.folded_until AND P.id <= S.last_id)''')
+
+                    if archive:
+                        cmd.execute('''INSERT INTO archive.progress (habit_id, progress_date, amount)
+                                       SELECT habit_id, progress_date, amount FROM main.progress
+                                       WHERE id IN (SELECT id FROM archive_rows) ORDER BY id''')
+
+                    cmd.execute('''CREATE TEMP TABLE archive_folded AS
+                                   SELECT P.habit_id, S.start_date, SUM(P.amount) AS amount, COUNT(*) AS rows, MIN(P.id) AS id
+                                   FROM main.progress P
+                                   INNER JOIN {0} S
+                                    ON S.habit_id = P.habit_id
+                                   AND S.start_date <= date(P.progress_date, 'unixepoch')
+                                   AND S.end_date >= date(P.progress_date, 'unixepoch')
+                                   WHERE P.id IN (SELECT id FROM archive_rows)
+                                   GROUP BY P.habit_id, S.start_date'''.format(source))
+
+                    if not archive:
+                        # single rows are already folded, unless they have to be replaced by archived ones
+                        cmd.execute('''DELETE FROM archive_rows WHERE id IN (SELECT id FROM archive_folded WHERE rows = 1)''')
+                        cmd.execute('''DELETE FROM archive_folded WHERE rows = 1''')
+
+                    count = cmd.execute('''DELETE FROM main.progress WHERE id IN (SELECT id FROM archive_rows)''').rowcount
+
+                    folded = cmd.execute('''INSERT INTO main.progress (habit_id, progress_date, amount)
+                                            SELECT habit_id, CAST(strftime('%s', start_date) AS INTEGER), amount FROM archive_folded
+                                            ORDER BY habit_id, start_date''').rowcount
+
+                    if archive:
+                        cmd.execute('''INSERT INTO archive_state (habit_id, folded_until, last_id)
+                                       SELECT habit_id, cutoff, (SELECT ifnull(MAX(id), 0) FROM main.progress) FROM archive_cutoff WHERE true
+                                       ON CONFLICT (habit_id) DO UPDATE SET folded_until = max(folded_until, excluded.folded_until), last_id = excluded.last_id''')
+
+                    for table in ("archive_cutoff", "archive_rows", "archive_folded"):
+                        cmd.execute('''DROP TABLE temp.{0}'''.format(table))
+
+                    # folding moves progress to the start of its period, which changes the daily rollups
+                    self._rebuild_period_summary(cmd)
+
+                    self._bump_data_version(cmd)
+
+                    self._commit(conn)
+
+            if not self._in_transaction():
+                self._compact(conn)
+
+        return count, folded
+
+    def _compact(self, conn):
+        """ returns free pages to the file system and refreshes the statistics of the query planner """
+
+        if conn.execute('''PRAGMA auto_vacuum''').fetchone()[0] != 2:
+            # switching to incremental mode takes a single full vacuum, afterwards only free pages are released
+            conn.execute('''PRAGMA auto_vacuum = INCREMENTAL''')
+            conn.execute('''VACUUM''')
+        else:
+            conn.execute('''PRAGMA incremental_vacuum''')
+
+        # approximate statistics, so analyzing large tables stays fast
+        conn.execute('''PRAGMA analysis_limit = 1000''')
+        conn.execute('''ANALYZE''')
+
+#endregion
+
+#region period summary
+
+    def _get_period_days(self, cmd, habit_id : int) -> int:
+        """ returns the period length of a habit """
+        res = cmd.execute('''SELECT period FROM habit WHERE id = ?''', [habit_id]).fetchone()
+        return None if res is None else res[0]
+
+    def _get_first_progress(self, cmd, habit_id : int) -> int:
+        """ returns the earliest progress date of a habit, which determines the start of its periods """
+        return cmd.execute('''SELECT MIN(progress_date) FROM progress WHERE habit_id = ?''', [habit_id]).fetchone()[0]
+
+    def _add_rollups(self, cmd, condition : str, parameters = ()):
+        """ adds progress rows to the daily, weekly and monthly rollups
+        Args:
+            condition: sql condition selecting the added progress rows
+            parameters: parameters of the condition
+        """
+        cmd.execute(_ADD_ROLLUPS.format(condition), parameters)
+
+    def _add_period_progress(self, cmd, habit_id : int, first_progress : int, progress_date : int, amount : int):
+        """ adds progress to the summarized period it belongs to
+        Args:
+            habit_id: id of habit
+            first_progress: earliest progress date of the habit before the change
+            progress_date: date of the added progress (seconds since 1970)
+            amount: amount of the added progress
+        """
+
+        # an unchanged first progress date leaves all period boundaries untouched
+        unchanged = first_progress == self._get_first_progress(cmd, habit_id)
+
+        if not unchanged:
+            self._drop_state(cmd, habit_id)
+
+        if self._period_summary and unchanged:
+
+            cmd.execute('''UPDATE period_summary SET progress = progress + ?
+                           WHERE habit_id = ? AND start_date <= date(?, 'unixepoch') AND end_date >= date(?, 'unixepoch')''', (amount, habit_id, progress_date, progress_date))
+
+            if cmd.rowcount == 1:
+                return
+
+        self._rebuild_periods(cmd, habit_id)
+
+    def _rebuild_periods(self, cmd, habit_id : int):
+        """ recomputes the summarized periods of a habit
+            (or only invalidates them, if the summary is not in use)
+        """
+
+        cmd.execute('''DELETE FROM period_summary WHERE habit_id = ?''', [habit_id])
+        cmd.execute('''DELETE FROM period_summary_state WHERE habit_id = ?''', [habit_id])
+
+        if not self._period_summary:
+            return
+
+        cmd.execute('''INSERT INTO period_summary ''' + _periods_query(habit_filter=True), {"habit_id": habit_id})
+        cmd.execute('''INSERT INTO period_summary_state (habit_id, valid_until)
+                       SELECT habit_id, MAX(end_date) FROM period_summary WHERE habit_id = ? GROUP BY habit_id''', [habit_id])
+
+    def _get_period_source(self, conn) -> str:
+        """ returns the name of the table or view to read periods from,
+            after rolling the summary forward if a period boundary has passed since the last write
+        """
+
+        if not self._period_summary:
+            return 'period'
+
+        with closing(conn.cursor()) as cmd:
+
+            stale = cmd.execute('''SELECT H.id FROM habit H
+                                   LEFT OUTER JOIN period_summary_state S
+                                    ON S.habit_id = H.id
+                                   WHERE S.valid_until IS NULL OR S.valid_until < date('now', 'localtime')''').fetchall()
+
+            if stale and self._read_only:
+                # cannot roll forward, so compute the periods instead
+                return 'period'
+
+            if stale:
+                for row in stale:
+                    self._rebuild_periods(cmd, row[0])
+
+                self._commit(conn)
+
+        return 'period_summary'
+
+    def assure_period_summary(self):
+        """ rolls the summarized periods forward to the current date,
+            so read-only connections, e.g., of other processes, can use them
+        """
+
+        with self._connect() as conn:
+            self._get_period_source(conn)
+
+    def rebuild_period_summary(self):
+        """ recomputes all rollups and summarized periods from scratch """
+
+        with self._connect() as conn:
+            with closing(conn.cursor()) as cmd:
+
+                self._rebuild_period_summary(cmd)
+
+                self._commit(conn)
+
+    def _rebuild_period_summary(self, cmd):
+        """ recomputes all rollups and summarized periods (or only invalidates the periods, if the summary is not in use) """
+
+        cmd.execute('''DELETE FROM progress_rollup''')
+        self._add_rollups(cmd, 'true')
+
+        cmd.execute('''DELETE FROM period_summary''')
+        cmd.execute('''DELETE FROM period_summary_state''')
+        cmd.execute('''DELETE FROM habit_state''')
+
+        if not self._period_summary:
+            return
+
+        cmd.execute('''INSERT INTO period_summary SELECT * FROM period''')
+        cmd.execute('''INSERT INTO period_summary_state (habit_id, valid_until)
+                       SELECT habit_id, MAX(end_date) FROM period_summary GROUP BY habit_id''')
+
+    def verify_period_summary(self) -> int:
+        """ compares the summarized periods with the period view, and the rollups with the progress rows
+        Returns:
+            number of deviating rows
+        """
+
+        with self._connect() as conn:
+
+            source = self._get_period_source(conn)
+
+            with closing(conn.cursor()) as cmd:
+
+                res = cmd.execute('''SELECT (SELECT COUNT(*) FROM (SELECT * FROM period EXCEPT SELECT * FROM {0}))
+                                          + (SELECT COUNT(*) FROM (SELECT * FROM {0} EXCEPT SELECT * FROM period))
+                                          + (SELECT COUNT(*) FROM (SELECT * FROM progress_rollup EXCEPT {1}))
+                                          + (SELECT COUNT(*) FROM ({1} EXCEPT SELECT * FROM progress_rollup))'''.format(source, _ROLLUPS.format('true'))).fetchone()
+
+                return res[0]
+
+#endregion
+
+#region habit state
+
+    def _load_state(self, cmd, habit_id : int) -> HabitState:
+        """ returns the stored running state of a habit (or None, if it has to be computed) """
+
+        res = cmd.execute('''SELECT period_start, period_end, progress, streak, streak_start, best_streak FROM habit_state WHERE habit_id = ?''', [habit_id]).fetchone()
+
+        if res is None:
+            return None
+
+        period_start, period_end, progress, streak, streak_start, best_streak = res
+
+        return HabitState(datetime.date.fromisoformat(period_start), datetime.date.fromisoformat(period_end), progress,
+                          streak, None if streak_start is None else datetime.date.fromisoformat(streak_start), best_streak)
+
+    def _save_state(self, cmd, habit_id : int, state : HabitState):
+        cmd.execute('''INSERT OR REPLACE INTO habit_state (habit_id, period_start, period_end, progress, streak, streak_start, best_streak) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    (habit_id, state.period_start.isoformat(), state.period_end.isoformat(), state.progress,
+                     state.streak, None if state.streak_start is None else state.streak_start.isoformat(), state.best_streak))
+
+    def _drop_state(self, cmd, habit_id : int):
+        """ marks the running state of a habit for recomputation, e.g., after changing past periods """
+        cmd.execute('''DELETE FROM habit_state WHERE habit_id = ?''', [habit_id])
+
+    def _roll_state_forward(self, cmd, habit_id : int, state : HabitState) -> HabitState:
+        """ moves the running state of a habit to the period containing today, if a period boundary has passed
+        Returns:
+            rolled state, or None if it has to be computed from the periods
+        """
+
+        period_end = state.period_end
+
+        if period_end >= datetime.date.today():
+            return state
+
+        days, goal = cmd.execute('''SELECT period, goal FROM habit WHERE id = ?''', [habit_id]).fetchone()
+
+        state.roll_forward(days, goal, datetime.date.today())
+
+        # progress added for dates after the former period, e.g., imported in advance, is not part of the state
+        res = cmd.execute('''SELECT 1 FROM progress WHERE habit_id = ? AND progress_date >= ? AND amount <> 0 LIMIT 1''',
+                          (habit_id, _to_epoch(period_end + datetime.timedelta(days=1)))).fetchone()
+
+        return None if res else state
+
+    def _add_state_progress(self, cmd, habit_id : int, progress_date : int, amount : int):
+        """ adds progress to the running state of a habit before inserting it,
+            or drops the state, if the progress does not belong to the current period
+        Args:
+            habit_id: id of habit
+            progress_date: date of the added progress (seconds since 1970)
+            amount: amount of the added progress
+        """
+
+        state = self._load_state(cmd, habit_id)
+
+        if state is None:
+            return
+
+        state = self._roll_state_forward(cmd, habit_id, state)
+        day = (_EPOCH + datetime.timedelta(seconds=progress_date)).date()
+
+        if state is None or not state.period_start <= day <= state.period_end:
+            self._drop_state(cmd, habit_id)
+            return
+
+        state.progress += amount
+
+        self._save_state(cmd, habit_id, state)
+
+    def _get_state(self, conn, habit : Habit) -> HabitState:
+        """ returns the running state of a habit for the current date,
+            where only a missing state, e.g., after changing past periods, is computed from the periods
+        """
+
+        with closing(conn.cursor()) as cmd:
+
+            state = self._load_state(cmd, habit._id)
+            period_end = None if state is None else state.period_end
+
+            if state is not None:
+                state = self._roll_state_forward(cmd, habit._id, state)
+
+            if state is None:
+                periods = cmd.execute('''SELECT start_date, end_date, progress FROM {0} WHERE habit_id = ? ORDER BY start_date'''.format(self._get_period_source(conn)), [habit._id])
+                state = HabitState.from_periods(periods, habit.goal)
+
+            # read-only connections compute the state on every read instead
+            if state is not None and state.period_end != period_end and not self._read_only:
+                self._save_state(cmd, habit._id, state)
+                self._commit(conn)
+
+        return state
+
 #endregion
 
 #region sample data
@@ -445,21 +1429,31 @@ class DB:
             start_date: first date to potentially insert progress
             days: number of days after start_date to potentially insert progress
         """
+        import random # only needed for sample data
 
         id = self._get_habit_id(habit)
 
-        with closing(self._create_connection()) as conn:
+        with self._connect() as conn:
             with closing(conn.cursor()) as cmd:
 
                 progress = []
 
                 for i in range(days):
                     if random.randrange(100) < success_rate:                        
-                        progress.append((id, (start_date + datetime.timedelta(days=i, hours=random.randrange(1, 22), minutes=random.randrange(1, 58))), random.randrange(min_progress, max_progress + 1)))
+                        progress.append((id, _to_epoch(start_date + datetime.timedelta(days=i, hours=random.randrange(1, 22), minutes=random.randrange(1, 58))), random.randrange(min_progress, max_progress + 1)))
+
+                last_id = cmd.execute('''SELECT ifnull(MAX(id), 0) FROM progress''').fetchone()[0]
 
                 cmd.executemany('''INSERT INTO progress (habit_id, progress_date, amount) VALUES (?, ?, ?)''', progress)
 
-                conn.commit()
+                self._add_rollups(cmd, 'id > ?', [last_id])
+
+                self._rebuild_periods(cmd, id)
+                self._drop_state(cmd, id)
+
+                self._bump_data_version(cmd)
+
+                self._commit(conn)
     
     def _insert_sample_habit(self, habit : Habit, days : int, min_progress : int, max_progress : int, success_rate : int):
         """ helper method to create habit with random progress in the past """
@@ -16,6 +16,13 @@ class Action(Enum):
     delete = "delete a habit"
     list = "list existing habits"
     analyze = "analyze habits"
+    import_progress = "import progress from a csv or json lines file"
+    export = "export habits, progress or periods to a csv, json lines or new sqlite file"
+    batch = "execute newline-delimited requests from a file or stdin, with one json result per line"
+    serve = "serve habits, progress and analyses as json endpoints on localhost, e.g., /analyze/max_streak?period=week"
+    rebuild = "rebuild the progress rollups and summarized periods used for analyses"
+    archive = "fold progress of past periods into one row per period, optionally keeping the rows in an archive database"
+    snapshot = "write all periods incl. progress and completion to a binary file for repeated analyses"
     exit = "exit the application"
 
 class Analysis(Enum):
@@ -27,6 +34,9 @@ class Analysis(Enum):
     max_streak = "get the longest streak"
     max_break = "get the longest break"
     completion_rate = "get completion rates for a given timeframe"
+    top_completion_rate = "get the habits with the highest (or lowest) completion rates for a given timeframe"
+    top_current_streak = "get the habits with the longest current streaks"
+    top_max_break = "get the habits with the longest breaks"
 
 class Parameter(Enum):
     """ description of available parameters """
@@ -52,4 +62,24 @@ class Parameter(Enum):
     last_month = "analyze the last month"
     start_date = "start date of custom timeframe to analyze (including)"
     end_date = "end date of custom timeframe to analyze (including)"
+    import_file = "csv file with columns 'habit', 'date' and optionally 'amount' (or json lines file with the same keys)"
+    export_file = "path of the file to export to"
+    archive_before = "fold progress of periods ending before this date"
+    archive_file = "archive database keeping the folded progress rows"
+    snapshot_file = "path of the snapshot file (replaced, if it exists)"
+    snapshot = "analyze a snapshot file instead of the database"
+    limit = "maximum number of habits to rank"
+    highest = "rank the highest completion rates first"
+    lowest = "rank the lowest completion rates first"
+    export_table = "data to export (ignored for sqlite files, which receive all habits and progress)"
+    file_format = "format of the file, defaults to its extension"
+    chunk_size = "number of rows per transaction"
+    batch_file = "file with one request per line (omit to read from stdin)"
+    transaction = "execute all requests in a single transaction, rolled back at the first error"
+    port = "tcp port to listen on"
+    workers = "maximum number of concurrent database requests"
+    verify = "compare the summarized periods with the full period computation"
+    profile = "print statistics for every sql statement on exit"
+    slow_ms = "log statements exceeding this number of milliseconds incl. their query plan"
+    parallel = "compute longest streaks, breaks and completion rates of all habits in this number of processes"
     no_filter = "all"
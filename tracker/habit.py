@@ -1,11 +1,120 @@
-from tracker.period import Period
 from tracker.enums import TaskStatus
 
-from datetime import datetime, date
+from calendar import monthrange
+from datetime import datetime, date, timedelta
+
+class HabitState:
+    """ struct to hold the running state of a habit, i.e., its current period and streaks,
+        which is persisted per habit and rolled forward without reading past periods
+    """
+
+    __slots__ = ("period_start", "period_end", "progress", "streak", "streak_start", "best_streak")
+
+    def __init__(self, period_start : date, period_end : date, progress : int = 0, streak : int = 0, streak_start : date = None, best_streak : int = 0):
+        """ instanciate a state
+        Args:
+            period_start: start of current period
+            period_end: end of current period (including)
+            progress: amount of progress made in the current period
+            streak: number of completed periods directly before the current one
+            streak_start: start of the first of these periods
+            best_streak: longest streak before the current period
+        """
+
+        self.period_start = period_start
+        self.period_end = period_end
+        self.progress = progress
+        self.streak = streak
+        self.streak_start = streak_start
+        self.best_streak = best_streak
+
+    @classmethod
+    def from_periods(cls, periods, goal : int):
+        """ computes the state from all periods of a habit
+        Args:
+            periods: iterable of (start_date, end_date, progress) in ascending order, with iso formatted dates
+            goal: required amount of progress per period
+        """
+
+        state = None
+
+        for start_date, end_date, progress in periods:
+            if state is None:
+                state = cls(date.fromisoformat(start_date), date.fromisoformat(end_date), progress)
+            else:
+                state._close_period(goal)
+                state.period_start, state.period_end, state.progress = date.fromisoformat(start_date), date.fromisoformat(end_date), progress
+
+        return state
+
+    def _close_period(self, goal : int):
+        """ moves the current period into the streaks """
+
+        if self.progress >= goal:
+            if self.streak == 0:
+                self.streak_start = self.period_start
+            self.streak += 1
+            self.best_streak = max(self.best_streak, self.streak)
+        else:
+            self.streak = 0
+            self.streak_start = None
+
+    def roll_forward(self, days : int, goal : int, today : date) -> bool:
+        """ moves to the period containing today, where all skipped periods had no progress
+        Args:
+            days: number of days in a period; 7 = weekly starting on monday, 30 = monthly starting on the first
+            goal: required amount of progress per period
+            today: current date
+        Returns:
+            False, if the current period still contains today
+        """
+
+        if self.period_end >= today:
+            return False
+
+        self._close_period(goal)
+
+        next_start = self.period_end + timedelta(days=1)
+
+        if days == 30:
+            start = today.replace(day=1)
+            end = today.replace(day=monthrange(today.year, today.month)[1])
+        else:
+            start = next_start + timedelta(days=(today - next_start).days // days * days)
+            end = start + timedelta(days=days - 1)
+
+        if start != next_start:
+            # skipped periods break the streak
+            self.streak = 0
+            self.streak_start = None
+
+        self.period_start, self.period_end, self.progress = start, end, 0
+
+        return True
+
+    def current_streak(self, goal : int) -> tuple:
+        """ returns (length, start, end) of the consecutive completed periods up to the current
+            (or up to the last period, if the current one is not completed yet)
+        """
+
+        if self.progress >= goal:
+            return (self.streak + 1, self.streak_start or self.period_start, self.period_end)
+
+        if self.streak > 0:
+            return (self.streak, self.streak_start, self.period_start - timedelta(days=1))
+
+        return (0, None, None)
+
+    def longest_streak(self, goal : int) -> int:
+        """ returns the length of the longest streak incl. the current one """
+        return max(self.best_streak, self.current_streak(goal)[0])
+
 
 class Habit:
     """ defines a periodic habit """
 
+    __slots__ = ("_id", "_creation_date", "name", "task", "days", "goal", "unit", "_state")
+
     def __init__(self, name : str, task : str, days : int = 1, goal : int = 1, unit : str = ""):
         """ instanciate a habit
         Args:
@@ -25,9 +134,9 @@ class Habit:
         self.goal = goal or 1
         self.unit = unit or ""      
 
-        # only holds periods until first break to compute current_progress and current_streak
+        # only holds the current period and streaks to compute current_progress and current_streak
         # use analytics module for everything else
-        self._current_periods: list[Period] = []
+        self._state: HabitState = None
 
 
     @classmethod
@@ -45,28 +154,28 @@ class Habit:
         return "{0} - {1}".format(self.name, self.task)
 
 
-    def add_period(self, period : Period):
-        """ assigns a progress to a new period 
+    def set_state(self, state : HabitState):
+        """ assigns the current period and streaks
              (should be called from DB only)
         """
-        self._current_periods.append(period)
+        self._state = state
 
 
     def current_period(self):
         """ returns the formatted current period for this habit """
 
-        if len(self._current_periods) == 0:
+        if self._state is None:
             return "no periods defined"
 
-        return "{0} to {1}".format(self._current_periods[0].start_date, self._current_periods[0].end_date)
+        return "{0} to {1}".format(self._state.period_start, self._state.period_end)
 
 
     def current_progress(self) -> str:
         """ returns the formatted progress of the current period """
 
         progress = 0
-        if len(self._current_periods) > 0:
-            progress = self._current_periods[0].progress
+        if self._state is not None:
+            progress = self._state.progress
 
         if self.goal == 1:
             #check-off task
@@ -77,20 +186,15 @@ class Habit:
 
     def current_streak(self) -> str:
         """ returns formatted information about consecutive completed tasks up to the last period """
-        
-        start = -1
-        end = 1
-
-        for s,p in enumerate(self._current_periods):            
-            if s == 0:
-                if p.progress >= self.goal: end = 0
-                else: continue
-            elif p.progress < self.goal:
-                break
 
-            start = s
+        length, start, end = (0, None, None) if self._state is None else self._state.current_streak(self.goal)
 
-        if start == -1:
+        if length == 0:
             return "not on a streak"
 
-        return "streak of {0} from {1} to {2}".format(1 + start - end, self._current_periods[start].start_date, self._current_periods[end].end_date)
\ No newline at end of file
+        return "streak of {0} from {1} to {2}".format(length, start, end)
+
+
+    def longest_streak(self) -> int:
+        """ returns the length of the longest streak incl. the current one """
+        return 0 if self._state is None else self._state.longest_streak(self.goal)
\ No newline at end of file
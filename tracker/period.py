@@ -1,16 +1,62 @@
+from array import array
 from datetime import date
+from functools import lru_cache
 
-class Period:
-    """ struct to hold progress in a given period """
 
-    def __init__(self, start_date : date, end_date : date, progress : int = 0):
-        """ instanciate a period
+@lru_cache(maxsize=4096)
+def to_date(iso_date : str) -> date:
+    """ parses an iso formatted date (cached, as the same period boundaries are shared by many habits and progress) """
+    return date.fromisoformat(iso_date)
+
+
+class PeriodBatch:
+    """ columnar struct to hold consecutive periods of a single habit """
+
+    __slots__ = ("habit_id", "habit_name", "goal", "progress", "start_dates", "end_dates")
+
+    def __init__(self, habit_id : int = 0, habit_name : str = "", goal : int = 0):
+        """ instanciate an empty batch
         Args:
-            start_date: start of period
-            end_date: end of period
-            progress: amount of progress made in this period            
+            habit_id: id of the habit
+            habit_name: name of the habit
+            goal: required amount of progress per period
         """
 
-        self.start_date = start_date
-        self.end_date = end_date
-        self.progress = progress
\ No newline at end of file
+        self.habit_id = habit_id
+        self.habit_name = habit_name
+        self.goal = goal
+
+        # one entry per period, dates as ordinals
+        self.progress = array('q')
+        self.start_dates = array('l')
+        self.end_dates = array('l')
+
+    def __len__(self):
+        return len(self.progress)
+
+    def append(self, start_date : str, end_date : str, progress : int):
+        """ adds the next period
+        Args:
+            start_date: iso formatted start of period
+            end_date: iso formatted end of period
+            progress: amount of progress made in this period
+        """
+
+        self.start_dates.append(to_date(start_date).toordinal())
+        self.end_dates.append(to_date(end_date).toordinal())
+        self.progress.append(progress)
+
+    def completed(self) -> array:
+        """ returns completion flags (0 or 1) of all periods """
+
+        goal = self.goal
+        if goal <= 0:
+            return array('B', bytes(len(self.progress)))
+
+        return array('B', map(goal.__le__, self.progress))
+
+    def start_date(self, index : int) -> date:
+        return date.fromordinal(self.start_dates[index])
+
+    def end_date(self, index : int) -> date:
+        return date.fromordinal(self.end_dates[index])
@@ -0,0 +1,165 @@
+import sqlite3
+import sys
+import threading
+import time
+
+
+class QueryProfiler:
+    """ collects call count, latency and fetched rows per sql statement """
+
+    def __init__(self, threshold_ms : float = 100.0):
+        """ instanciate a profiler
+        Args:
+            threshold_ms: log statements exceeding this latency incl. their query plan
+        """
+
+        self.threshold_ms = threshold_ms
+
+        # sql -> [calls, total seconds, max seconds, rows]
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, sql : str, calls : int, seconds : float, elapsed : float, rows : int):
+        """ adds a measurement
+        Args:
+            sql: statement
+            calls: number of new executions (0 for fetches)
+            seconds: duration of this call
+            elapsed: total duration of the current execution so far
+            rows: number of fetched rows
+        """
+
+        with self._lock:
+            stats = self._stats.setdefault(sql, [0, 0.0, 0.0, 0])
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += rows
+
+    def summary(self) -> list:
+        """ returns (statement, calls, total ms, max ms, rows) ordered by total latency """
+
+        with self._lock:
+            return sorted(((" ".join(sql.split()), s[0], round(s[1] * 1000, 3), round(s[2] * 1000, 3), s[3]) for sql, s in self._stats.items()),
+                          key=lambda s: s[2], reverse=True)
+
+    def print_summary(self, file = None):
+        """ outputs the summary as a table (to stderr by default) """
+
+        file = file or sys.stderr
+
+        print("{0:>8} {1:>12} {2:>10} {3:>10}  statement".format("calls", "total ms", "max ms", "rows"), file=file)
+
+        for sql, calls, total, maximum, rows in self.summary():
+            print("{0:>8} {1:>12.3f} {2:>10.3f} {3:>10}  {4}".format(calls, total, maximum, rows, sql), file=file)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """ cursor reporting every execute and fetch to the profiler of its connection """
+
+    _sql = None
+    _params = ()
+    _elapsed = 0.0
+    _logged = False
+
+    def _measure(self, sql : str, calls : int, seconds : float, rows : int):
+        self._elapsed += seconds
+
+        profiler = self.connection.profiler
+        profiler._record(sql, calls, seconds, self._elapsed, rows)
+
+        if not self._logged and self._elapsed * 1000 >= profiler.threshold_ms:
+            self._logged = True
+            self._log_slow(profiler)
+
+    def _log_slow(self, profiler : QueryProfiler):
+        """ logs a slow statement incl. its query plan """
+        import logging # only needed when profiling
+
+        try:
+            plan = sqlite3.Cursor(self.connection).execute("EXPLAIN QUERY PLAN " + self._sql, self._params).fetchall()
+            plan = "\n".join("  " + row[-1] for row in plan) if plan else "  (no plan)"
+        except sqlite3.Error as ex:
+            plan = "  (no plan: {0})".format(ex)
+
+        logging.getLogger(__name__).warning("slow query (%.1f ms): %s\n%s", self._elapsed * 1000, " ".join(self._sql.split()), plan)
+
+    def execute(self, sql, parameters = ()):
+        self._sql, self._params, self._elapsed, self._logged = sql, parameters, 0.0, False
+
+        start = time.perf_counter()
+        res = super().execute(sql, parameters)
+        self._measure(sql, 1, time.perf_counter() - start, 0)
+
+        return res
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql, self._params, self._elapsed, self._logged = sql, (), 0.0, True
+
+        start = time.perf_counter()
+        res = super().executemany(sql, seq_of_parameters)
+        self._measure(sql, 1, time.perf_counter() - start, 0)
+
+        return res
+
+    def executescript(self, sql_script):
+        self._sql, self._params, self._elapsed, self._logged = sql_script, (), 0.0, True
+
+        start = time.perf_counter()
+        res = super().executescript(sql_script)
+        self._measure(sql_script, 1, time.perf_counter() - start, 0)
+
+        return res
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._measure(self._sql, 0, time.perf_counter() - start, 0 if row is None else 1)
+
+        return row
+
+    def fetchmany(self, size = None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._measure(self._sql, 0, time.perf_counter() - start, len(rows))
+
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._measure(self._sql, 0, time.perf_counter() - start, len(rows))
+
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._measure(self._sql, 0, time.perf_counter() - start, 0)
+            raise
+
+        self._measure(self._sql, 0, time.perf_counter() - start, 1)
+
+        return row
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """ connection creating profiling cursors, also for statements executed on the connection itself """
+
+    profiler : QueryProfiler = None
+
+    def cursor(self, factory = None):
+        return super().cursor(factory or ProfilingCursor)
+
+    # the shortcuts of sqlite3.Connection create plain cursors, bypassing cursor()
+
+    def execute(self, sql, parameters = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
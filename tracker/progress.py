@@ -3,6 +3,8 @@ from datetime import datetime
 class Progress:
     """ struct to hold datetime and amount of progress """
 
+    __slots__ = ("habit", "amount", "progress_date")
+
     def __init__(self, habit, amount : int = 1, progress_date : datetime = None):
         """ instanciate a progress
         Args:  
@@ -4,9 +4,11 @@ from tracker.habit import Habit
 from tracker.progress import Progress
 
 import argparse
-import json
+import time
+from contextlib import nullcontext
 from datetime import timedelta, date, datetime
-from calendar import monthrange
+
+# csv, json, shlex and calendar are imported where needed, to keep the startup of single requests fast
 
 
 def handle(db : DB, request : argparse.Namespace):
@@ -16,6 +18,29 @@ def handle(db : DB, request : argparse.Namespace):
         request: namespace with action plus dynamic attributes        
     """
 
+    columns, response = process(db, request)
+
+    if hasattr(request, "json") and request.json:
+        #json response
+        _output_json(columns, response)
+    else:
+        #human readable
+        if isinstance(response, str):
+            print(response)
+        else:
+            _output_table(_create_header(columns) + response)
+
+
+def process(db : DB, request : argparse.Namespace, raise_errors : bool = False) -> tuple:
+    """ executes a user request without any output
+    Args:
+        db: database
+        request: namespace with action plus dynamic attributes
+        raise_errors: raise exceptions instead of returning their message as response
+    Returns:
+        (columns, response), where response is either a message (str) or a list of rows
+    """
+
     columns = None
     response = None
 
@@ -66,61 +91,176 @@ def handle(db : DB, request : argparse.Namespace):
             db.delete_habit(request.habit)
             response = "habit deleted"
 
+        elif request.action == "import_progress":
+            report = None
+            if not (hasattr(request, "json") and request.json):
+                report = lambda count: print("{0} rows imported...".format(count))
+
+            start = time.perf_counter()
+            count = db.import_progress(_read_progress(request.file, request.format), int(request.chunk_size), report)
+            seconds = time.perf_counter() - start
+
+            response = "{0} rows imported in {1:.2f} seconds ({2:.0f} rows/sec)".format(count, seconds, count / seconds if seconds else 0)
+
+        elif request.action == "export":
+            file_format = request.format or str(request.file).rsplit(".", 1)[-1].lower()
+            if file_format in ("sqlite", "db"):
+                count = db.export_database(request.file)
+                response = "{0} rows exported".format(count)
+            else:
+                count = _write_rows(*db.export_rows(request.table), request.file, file_format)
+                response = "{0} {1} rows exported".format(count, request.table)
+
+        elif request.action == "rebuild":
+            db.rebuild_period_summary()
+            response = "period summary rebuilt"
+            if hasattr(request, "verify") and request.verify:
+                response = "period summary rebuilt - {0} deviating periods".format(db.verify_period_summary())
+
         elif request.action == "list":
             columns = ("ID", "created", "name", "task", "period", "goal", "progress", "streak")
             response = analytics.habits(db, request.period)
 
-        elif request.action == "analyze":
-
-            if request.analysis == "current_progress":
-                columns = ("habit", "current period", "progress")
-                habit = db.get_habit(request.habit, True)
-                response = [(habit.name, habit.current_period(), habit.current_progress())]
-
-            elif request.analysis == "current_streak":
-                columns = ("habit", "current streak")
-                habit = db.get_habit(request.habit, True)
-                response = [(habit.name, habit.current_streak())]
-                
-            elif request.analysis == "past_progress":
-                columns = ("period", "progress date", "amount", "task status")
-                habit = db.get_habit(request.habit)
-                trim_date = (habit.days == 1)
-                start_date, end_date = _get_timeframe(request) 
-                response = analytics.past_progress(db, request.habit, trim_date, start_date, end_date)
+        elif request.action == "archive":
+            count, folded = db.archive_progress(request.before, request.archive)
+            response = "{0} progress rows folded into {1}".format(count, folded)
 
-            elif request.analysis == "past_streaks":
-                columns = ("", "length", "from", "to")                
-                response = analytics.past_streaks(db, request.habit)
+        elif request.action == "snapshot":
+            from tracker.snapshot import write_snapshot
+            count = write_snapshot(db, request.file)
+            response = "{0} periods written to snapshot".format(count)
 
-            elif request.analysis == "max_streak":
-                columns = ("habit", "max streak", "from", "to")
-                response = analytics.max_streak(db, request.period, request.habit)
+        elif request.action == "analyze":
 
-            elif request.analysis == "max_break":
-                columns = ("habit", "max break", "from", "to")
-                response = analytics.max_break(db, request.period, request.habit)
+            with _analysis_source(db, request) as source:
+                if request.analysis == "current_progress":
+                    columns = ("habit", "current period", "progress")
+                    habit = db.get_habit(request.habit, True)
+                    response = [(habit.name, habit.current_period(), habit.current_progress())]
 
-            elif request.analysis == "completion_rate":
-                columns = ("habit", "completed", "out of", "rate")
-                start_date, end_date = _get_timeframe(request)                
-                response = analytics.completion_rate(db, start_date, end_date)
+                elif request.analysis == "current_streak":
+                    columns = ("habit", "current streak", "longest streak")
+                    habit = db.get_habit(request.habit, True)
+                    response = [(habit.name, habit.current_streak(), habit.longest_streak())]
+                
+                elif request.analysis == "past_progress":
+                    columns = ("period", "progress date", "amount", "task status")
+                    habit = db.get_habit(request.habit)
+                    trim_date = (habit.days == 1)
+                    start_date, end_date = _get_timeframe(request) 
+                    response = analytics.past_progress(db, request.habit, trim_date, start_date, end_date, getattr(request, "archive", None))
+
+                elif request.analysis == "past_streaks":
+                    columns = ("", "length", "from", "to")                
+                    response = analytics.past_streaks(source, request.habit)
+
+                elif request.analysis == "max_streak":
+                    columns = ("habit", "max streak", "from", "to")
+                    response = analytics.max_streak(source, request.period, request.habit)
+
+                elif request.analysis == "max_break":
+                    columns = ("habit", "max break", "from", "to")
+                    response = analytics.max_break(source, request.period, request.habit)
+
+                elif request.analysis == "completion_rate":
+                    columns = ("habit", "completed", "out of", "rate")
+                    start_date, end_date = _get_timeframe(request)                
+                    response = analytics.completion_rate(source, start_date, end_date)
+
+                elif request.analysis == "top_completion_rate":
+                    columns = ("habit", "completed", "out of", "rate")
+                    start_date, end_date = _get_timeframe(request)
+                    response = analytics.top_completion_rates(source, int(request.limit), request.lowest, start_date, end_date)
+
+                elif request.analysis == "top_current_streak":
+                    columns = ("habit", "current streak")
+                    response = analytics.top_current_streaks(source, int(request.limit), request.period)
+
+                elif request.analysis == "top_max_break":
+                    columns = ("habit", "max break", "from", "to")
+                    response = analytics.top_max_breaks(source, int(request.limit), request.period)
 
     except Exception as ex:
+        if raise_errors:
+            raise
         response = str(ex)
 
     if not response or len(response) == 0 or len(response[0]) == 0:
         response = "no results"
 
-    if hasattr(request, "json") and request.json:
-        #json response
-        _output_json(columns, response)
-    else:
-        #human readable
-        if isinstance(response, str):
-            print(response)
-        else:
-            _output_table(_create_header(columns) + response)
+    return columns, response
+
+
+def asks_for_help(argv : list) -> bool:
+    """ checks for -h, --help or an abbreviation of it, which make argparse print the help and exit """
+    return any(arg == "-h" or (len(arg) > 2 and "--help".startswith(arg)) for arg in argv)
+
+
+def handle_batch(db : DB, lines, parse_request, transaction : bool = False):
+    """ handles newline-delimited requests in command line syntax and outputs one json line per request
+    Args:
+        db: database
+        lines: iterable of requests, empty lines and lines starting with '#' are skipped
+        parse_request: function parsing a list of command line arguments into a request namespace
+        transaction: execute all requests in a single transaction, which is rolled back at the first error
+    Returns:
+        False, if any request failed (and the transaction was rolled back)
+    """
+    import json
+    import shlex
+
+    count = 0
+    failed = False
+
+    try:
+        with db.transaction() if transaction else nullcontext():
+
+            for line in lines:
+                if line.strip() == "" or line.lstrip().startswith("#"):
+                    continue
+
+                count += 1
+
+                try:
+                    argv = shlex.split(line)
+
+                    # argparse would print the help into the json output and exit
+                    if asks_for_help(argv):
+                        raise ValueError("help is not available in batch requests")
+
+                    args = parse_request(argv)
+                    if args.action is None:
+                        raise ValueError("no action given")
+
+                    # suppress console output of long running actions
+                    args.json = True
+
+                    # errors are always reported as such, not as result message
+                    result = to_json(*process(db, args, True))
+                except (Exception, SystemExit) as ex:
+                    result = {"error": str(ex) or "invalid request"}
+                    failed = True
+                    if transaction:
+                        print(json.dumps(result))
+                        raise
+
+                print(json.dumps(result, default=str))
+
+    except (Exception, SystemExit):
+        print(json.dumps({"error": "transaction rolled back at request {0}".format(count)}))
+        return False
+
+    return not failed
+
+
+def _analysis_source(db : DB, request : argparse.Namespace):
+    """ returns the snapshot file of an analysis request to read periods from, or the database """
+
+    if getattr(request, "snapshot", None):
+        from tracker.snapshot import Snapshot
+        return Snapshot(request.snapshot)
+
+    return nullcontext(db)
 
 
 def _get_timeframe(request : argparse.Namespace):
@@ -134,6 +274,7 @@ def _get_timeframe(request : argparse.Namespace):
         start_date = date.today().replace(day=1)
         if request.last_month: 
             start_date = (start_date - timedelta(days=1)).replace(day=1)
+        from calendar import monthrange
         end_date = start_date.replace(day=monthrange(start_date.year, start_date.month)[1])
     elif hasattr(request, "start_date"):
         start_date = request.start_date
@@ -145,6 +286,79 @@ def _get_timeframe(request : argparse.Namespace):
     return start_date, end_date
 
 
+def _read_progress(file : str, file_format : str = None):
+    """ progress generator reading one row at a time from a csv file with header or a json lines file
+    Args:
+        file: path of the file
+        file_format: 'csv' or 'jsonl', defaults to the file extension
+    Yields:
+        (habit, progress_date, amount)
+    """
+    import csv
+    import json
+
+    file_format = file_format or str(file).rsplit(".", 1)[-1].lower()
+
+    with open(file, newline="", encoding="utf-8") as f:
+
+        if file_format == "csv":
+            rows = csv.DictReader(f)
+        elif file_format in ("jsonl", "json"):
+            rows = map(json.loads, filter(lambda line: line.strip(), f))
+        else:
+            raise Exception("unsupported file format '{0}'".format(file_format))
+
+        for line, row in enumerate(rows, start=1):
+            try:
+                # also accept column names of exported progress
+                habit = row["habit"] if "habit" in row else row["habit_id"]
+                progress_date = str(row["date"] if "date" in row else row["progress_date"])
+                amount = int(row["amount"]) if row.get("amount") not in (None, "") else 1
+            except (KeyError, ValueError):
+                raise Exception("invalid progress in line {0}".format(line))
+
+            # amount 0 denotes a running timer
+            if amount < 1:
+                raise Exception("amount has to be positive in line {0}".format(line))
+
+            # keep the format of progress added without time
+            yield habit, date.fromisoformat(progress_date) if len(progress_date) == 10 else datetime.fromisoformat(progress_date), amount
+
+
+def _write_rows(columns, rows, file : str, file_format : str) -> int:
+    """ writes rows one at a time to a csv file with header or a json lines file
+    Args:
+        columns: column names
+        rows: iterable of rows
+        file: path of the file
+        file_format: 'csv' or 'jsonl'
+    Returns:
+        number of written rows
+    """
+    import csv
+    import json
+
+    if file_format not in ("csv", "jsonl", "json"):
+        raise Exception("unsupported file format '{0}'".format(file_format))
+
+    count = 0
+
+    with open(file, "w", newline="", encoding="utf-8") as f:
+
+        if file_format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+                count += 1
+
+    return count
+
+
 def _create_header(columns):
     """ creates header in the form
         col1 column2 ...
@@ -162,16 +376,23 @@ def _output_table(response):
         print("  ".join((str(val).ljust(width) for val, width in zip(row, widths))))
 
 
+def to_json(columns, response) -> dict:
+    """ returns response as json serializable object """
+
+    if isinstance(response, str):
+        return {"result":response}
+
+    return {"result":list(map(lambda row: dict(zip(columns, row)), response))}
+
 def _output_json(columns, response):
     """ outputs response as json """
+    import json
 
     if isinstance(response, str):
         print(json.dumps({"result":response}))
     else:
-        result = []
-        for row in response:
-            key = iter(columns)
-            value = iter(row)
-            result.append(dict(zip(key, value)))
-
-        print(json.dumps({"result":result}))
\ No newline at end of file
+        # write row by row instead of serializing the whole result at once
+        print('{"result": [', end="")
+        for i,row in enumerate(response):
+            print((", " if i else "") + json.dumps(dict(zip(columns, row)), default=str), end="")
+        print("]}")
\ No newline at end of file
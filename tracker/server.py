@@ -0,0 +1,233 @@
+from tracker.db import DB
+import tracker.request as request
+
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+HOST = "127.0.0.1"
+
+_MAX_BODY = 1024 * 1024
+
+_STATUS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+# actions served over http, where changes require POST, so plain links or embedded resources of other pages cannot trigger them
+# (actions reading or writing files are only available on the command line)
+_READ_ACTIONS = ("list", "analyze")
+_WRITE_ACTIONS = ("create", "insert_samples", "update", "progress", "reset", "delete", "rebuild")
+
+# options naming files, which must not be read or attached on behalf of other processes
+_FILE_OPTIONS = ("snapshot", "archive")
+
+# host names of the server, any other 'Host' or 'Origin' points to a request from another site, e.g., via dns rebinding
+_LOCAL_HOSTS = (HOST, "localhost")
+
+
+def _to_argv(path : str, params) -> list:
+    """ translates a request path and parameters into command line arguments
+        e.g. /analyze/max_streak?period=week&json -> ['analyze', 'max_streak', '--period', 'week', '--json']
+    Args:
+        path: url path, where each segment is a positional argument
+        params: iterable of (name, value), where empty values or 'true' denote flags
+    Raises:
+        ValueError: options in the path, invalid names, file options or help
+    """
+
+    argv = [unquote(segment) for segment in path.split("/") if segment]
+
+    for arg in argv:
+        if arg.startswith("-"):
+            raise ValueError("options have to be given as query parameters")
+
+    for name, value in params:
+        name = str(name)
+
+        if name == "" or name.startswith("-") or "=" in name:
+            raise ValueError("invalid parameter '{0}'".format(name))
+
+        # incl. abbreviations, which argparse accepts as well
+        if any(option.startswith(name) for option in _FILE_OPTIONS):
+            raise ValueError("option '{0}' is only available on the command line".format(name))
+
+        if value is True or value == "" or value == "true":
+            argv.append("--" + name)
+        elif value is False or value is None or value == "false":
+            continue
+        else:
+            argv += ["--" + name, str(value)]
+
+    # argparse would print the help to the console of the server and exit
+    if request.asks_for_help(argv):
+        raise ValueError("help is not available over http")
+
+    return argv
+
+
+async def _read_request(reader : asyncio.StreamReader):
+    """ reads a single http request
+    Returns:
+        (method, target, headers, body) or None, if the connection was closed
+    """
+
+    line = await reader.readline()
+    if not line:
+        return None
+
+    method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+
+    headers = {"connection": "close" if version == "HTTP/1.0" else "keep-alive"}
+
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > _MAX_BODY:
+        raise ValueError("request body too large")
+
+    body = await reader.readexactly(length) if length else b""
+
+    return method, target, headers, body
+
+
+def _is_local(headers : dict) -> bool:
+    """ checks that the request addresses this server and does not originate from another site """
+
+    host = urlsplit("//" + headers.get("host", "")).hostname
+    if host not in _LOCAL_HOSTS:
+        return False
+
+    origin = headers.get("origin")
+    return origin is None or urlsplit(origin).hostname in _LOCAL_HOSTS
+
+
+def _error_status(ex : Exception) -> int:
+    # the app reports invalid requests, e.g., unknown habits, as plain exceptions,
+    # invalid arguments and violated constraints are caused by the client as well
+    if type(ex) is Exception or isinstance(ex, (ValueError, TypeError, LookupError, sqlite3.IntegrityError, sqlite3.ProgrammingError)):
+        return 400
+
+    return 500
+
+
+def _respond(writer : asyncio.StreamWriter, status : int, result : dict, keep_alive : bool):
+    """ writes a json response """
+
+    body = json.dumps(result, default=str).encode("utf-8")
+
+    writer.write("HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\nConnection: {3}\r\n\r\n"
+                 .format(status, _STATUS[status], len(body), "keep-alive" if keep_alive else "close").encode("latin-1") + body)
+
+
+async def _handle_client(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, db : DB, parse_request, executor : ThreadPoolExecutor):
+    """ handles all requests of a single (keep-alive) connection """
+
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+            try:
+                req = await _read_request(reader)
+            except ValueError as ex:
+                _respond(writer, 413 if "too large" in str(ex) else 400, {"error": str(ex)}, False)
+                break
+
+            if req is None:
+                break
+
+            method, target, headers, body = req
+            keep_alive = headers["connection"].lower() != "close"
+
+            url = urlsplit(target)
+            segments = [segment for segment in url.path.split("/") if segment]
+            action = unquote(segments[0]) if segments else None
+
+            if not _is_local(headers):
+                _respond(writer, 403, {"error": "requests from other sites are not allowed"}, False)
+                keep_alive = False
+            elif method not in ("GET", "POST"):
+                _respond(writer, 405, {"error": "only GET and POST are supported"}, keep_alive)
+            elif action is None:
+                _respond(writer, 400, {"error": "no action given"}, keep_alive)
+            elif action not in _READ_ACTIONS + _WRITE_ACTIONS:
+                _respond(writer, 404, {"error": "action '{0}' is not available over http".format(action)}, keep_alive)
+            elif action in _WRITE_ACTIONS and method != "POST":
+                _respond(writer, 405, {"error": "action '{0}' requires POST".format(action)}, keep_alive)
+            else:
+                params = parse_qsl(url.query, keep_blank_values=True)
+
+                try:
+                    if body:
+                        params += json.loads(body).items()
+
+                    # parsing depends on the state of the database, so it blocks as well
+                    args = await loop.run_in_executor(executor, parse_request, _to_argv(url.path, params))
+                except (ValueError, AttributeError, SystemExit) as ex:
+                    _respond(writer, 400, {"error": str(ex) or "invalid request"}, keep_alive)
+                else:
+                    # suppress console output of long running actions
+                    args.json = True
+
+                    try:
+                        # sqlite requests block, so run them in the thread pool
+                        columns, response = await loop.run_in_executor(executor, request.process, db, args, True)
+                    except Exception as ex:
+                        _respond(writer, _error_status(ex), {"error": str(ex)}, keep_alive)
+                    else:
+                        _respond(writer, 200, request.to_json(columns, response), keep_alive)
+
+            await writer.drain()
+
+            if not keep_alive:
+                break
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except asyncio.CancelledError:
+        # server shut down while waiting for the next request (nobody awaits this task, so there is nothing to propagate to)
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(db : DB, parse_request, port : int, executor : ThreadPoolExecutor) -> asyncio.AbstractServer:
+    """ starts listening on localhost
+    Args:
+        db: database shared by all requests
+        parse_request: function parsing a list of command line arguments into a request namespace,
+                       raising ValueError or SystemExit for invalid requests
+        port: tcp port, 0 for any free port
+        executor: thread pool to run database requests in
+    """
+    return await asyncio.start_server(lambda r, w: _handle_client(r, w, db, parse_request, executor), HOST, port)
+
+
+def serve(db : DB, parse_request, port : int = 8080, workers : int = 4):
+    """ serves habits, progress and analyses as json endpoints until interrupted
+    Args:
+        db: database shared by all requests
+        parse_request: function parsing a list of command line arguments into a request namespace
+        port: tcp port
+        workers: maximum number of concurrent database requests
+    """
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tracker-db") as executor:
+            server = await start_server(db, parse_request, port, executor)
+
+            print("serving on http://{0}:{1} - press Ctrl+C to stop".format(HOST, server.sockets[0].getsockname()[1]))
+
+            async with server:
+                await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
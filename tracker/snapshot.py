@@ -0,0 +1,301 @@
+from tracker.db import DB
+from tracker.period import PeriodBatch
+
+import mmap
+import os
+import struct
+from array import array
+from datetime import date
+
+# file layout, all numbers little-endian:
+#   header    magic, format version, data version, number of habits, number of periods
+#   habits    one int64 column each for id, period length, goal, first period, number of periods, name offset, name length
+#   periods   progress (int64), habit id, start and end as days since 1970-01-01 (int32), completion flag (uint8),
+#             ordered by habit and descending start date, i.e., the periods of a habit start with the current one
+#   names     utf-8 encoded habit names
+_MAGIC = b"TRACKSNP"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIqqq")
+
+_HABIT_COLUMNS = ("id", "period", "goal", "first", "count", "name_offset", "name_length")
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _padding(size : int) -> bytes:
+    """ returns the bytes needed to align the next column to 8 bytes """
+    return bytes(-size % 8)
+
+def _column(mapped : memoryview, offset : int, typecode : str, count : int) -> tuple:
+    """ returns a typed view of a column without copying, and the offset after it """
+    size = struct.calcsize(typecode) * count
+    return mapped[offset:offset + size].cast(typecode), offset + size
+
+
+def write_snapshot(db : DB, file : str) -> int:
+    """ writes the periods of all habits incl. progress and completion to a columnar snapshot file
+    Args:
+        db: database
+        file: path of the snapshot file, which is replaced atomically if it exists
+    Returns:
+        number of written periods
+    """
+
+    # read the version before the periods, so a snapshot never claims data newer than it contains
+    data_version = db.get_data_version()
+
+    # batches carry no period length, so look it up once per habit
+    periods = dict((h[0], h[4]) for h in db.get_habits())
+
+    habits = {column: array('q') for column in _HABIT_COLUMNS}
+    progress, habit_ids, start_days, end_days, completed = array('q'), array('i'), array('i'), array('i'), array('B')
+    names = bytearray()
+
+    for batch in db.get_period_batches():
+        name = batch.habit_name.encode("utf-8")
+
+        for column, value in zip(_HABIT_COLUMNS, (batch.habit_id, periods[batch.habit_id], batch.goal, len(progress), len(batch), len(names), len(name))):
+            habits[column].append(value)
+
+        progress.extend(batch.progress)
+        habit_ids.extend([batch.habit_id] * len(batch))
+        start_days.extend([day - _EPOCH_ORDINAL for day in batch.start_dates])
+        end_days.extend([day - _EPOCH_ORDINAL for day in batch.end_dates])
+        completed.extend(batch.completed())
+        names += name
+
+    tmp = str(file) + ".tmp"
+
+    with open(tmp, "wb") as f:
+        header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, data_version, len(habits["id"]), len(progress))
+        f.write(header + _padding(len(header)))
+
+        for column in _HABIT_COLUMNS:
+            f.write(habits[column])
+
+        for values in (progress, habit_ids, start_days, end_days, completed):
+            f.write(values)
+
+        f.write(_padding(f.tell()))
+        f.write(names)
+
+    os.replace(tmp, file)
+
+    return len(progress)
+
+
+class SnapshotBatch(PeriodBatch):
+    """ periods of a single habit, read without copying from a snapshot file """
+
+    __slots__ = ("flags",)
+
+    def __init__(self, habit_id : int, habit_name : str, goal : int, progress, start_days, end_days, flags):
+        """ instanciate a batch of views on the snapshot columns
+        Args:
+            habit_id: id of the habit
+            habit_name: name of the habit
+            goal: required amount of progress per period
+            progress: amount of progress per period
+            start_days: start of period as days since 1970-01-01
+            end_days: end of period as days since 1970-01-01
+            flags: completion flags (0 or 1)
+        """
+
+        self.habit_id = habit_id
+        self.habit_name = habit_name
+        self.goal = goal
+
+        self.progress = progress
+        self.start_dates = start_days
+        self.end_dates = end_days
+        self.flags = flags
+
+    def completed(self):
+        return self.flags
+
+    def start_date(self, index : int) -> date:
+        return date.fromordinal(self.start_dates[index] + _EPOCH_ORDINAL)
+
+    def end_date(self, index : int) -> date:
+        return date.fromordinal(self.end_dates[index] + _EPOCH_ORDINAL)
+
+
+class Snapshot:
+    """ read-only access to a snapshot file through a memory map,
+        offering the period readers of the database, so streak analyses and completion rates run without sqlite
+        (periods reflect the date the snapshot was written)
+    """
+
+    def __init__(self, file : str):
+        """ instanciate snapshot access, the file is mapped when entering the context
+        Args:
+            file: path of the snapshot file
+        """
+
+        # same name as in DB, which serves as cache key for analyses
+        self._connection = file
+
+        self._file = None
+        self._map = None
+        self._views = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """ maps the file and creates views on all columns """
+
+        if not os.path.exists(self._connection):
+            raise Exception("snapshot file not found")
+
+        if os.path.getsize(self._connection) < _HEADER.size:
+            raise Exception("invalid snapshot file")
+
+        self._file = open(self._connection, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        mapped = memoryview(self._map)
+        self._views.append(mapped)
+
+        magic, format_version, self._data_version, habit_count, period_count = _HEADER.unpack_from(mapped)
+
+        if magic != _MAGIC:
+            self.close()
+            raise Exception("invalid snapshot file")
+
+        if format_version != _FORMAT_VERSION:
+            self.close()
+            raise Exception("snapshot format version {0} is not supported".format(format_version))
+
+        offset = _HEADER.size + len(_padding(_HEADER.size))
+
+        self._habits = {}
+        for column in _HABIT_COLUMNS:
+            self._habits[column], offset = _column(mapped, offset, 'q', habit_count)
+
+        self._progress, offset = _column(mapped, offset, 'q', period_count)
+        self._habit_ids, offset = _column(mapped, offset, 'i', period_count)
+        self._start_days, offset = _column(mapped, offset, 'i', period_count)
+        self._end_days, offset = _column(mapped, offset, 'i', period_count)
+        self._completed, offset = _column(mapped, offset, 'B', period_count)
+
+        self._names = mapped[offset + len(_padding(offset)):]
+
+        self._views += list(self._habits.values()) + [self._progress, self._habit_ids, self._start_days, self._end_days, self._completed, self._names]
+
+    def close(self):
+        """ releases all views and unmaps the file """
+
+        for view in reversed(self._views):
+            view.release()
+
+        self._views.clear()
+
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # batches are still referenced, the map is closed once they are released
+                pass
+            self._map = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_data_version(self) -> int:
+        """ returns the data version of the database when the snapshot was written """
+        return self._data_version
+
+    def _get_habit_index(self, habit) -> int:
+        """ returns the position of a habit in the habit columns
+        Args:
+            habit: id (int) or name (str) of habit
+        """
+
+        if isinstance(habit, int) or (isinstance(habit, str) and habit.isdigit()):
+            for i, id in enumerate(self._habits["id"]):
+                if id == int(habit):
+                    return i
+            raise Exception("no habit found with id {0}".format(habit))
+
+        for i in range(len(self._habits["id"])):
+            if self._habit_name(i) == habit:
+                return i
+        raise Exception("no habit found with name '{0}'".format(habit))
+
+    def _habit_name(self, index : int) -> str:
+        offset = self._habits["name_offset"][index]
+        return str(self._names[offset:offset + self._habits["name_length"][index]], "utf-8")
+
+    def _habit_indexes(self, period_days : int = None, habit = None, habit_range : tuple = None):
+        """ returns the positions of habits matching the filters of the database period readers """
+
+        if habit:
+            return [self._get_habit_index(habit)]
+
+        ids, periods = self._habits["id"], self._habits["period"]
+
+        return [i for i in range(len(ids)) if (not period_days or periods[i] == int(period_days))
+                                            and (not habit_range or habit_range[0] <= ids[i] <= habit_range[1])]
+
+    def get_period_batches(self, period_days : int = None, habit = None, habit_range : tuple = None):
+        """ generator of columnar periods per habit, starting with the current period
+        Args:
+            period_days: only return periods with this length
+            habit: only return periods for this habit
+            habit_range: only return periods for habits with ids between (first, last), including both
+        """
+
+        for i in self._habit_indexes(period_days, habit, habit_range):
+            first = self._habits["first"][i]
+            last = first + self._habits["count"][i]
+
+            yield SnapshotBatch(self._habits["id"][i], self._habit_name(i), self._habits["goal"][i], self._progress[first:last],
+                                self._start_days[first:last], self._end_days[first:last], self._completed[first:last])
+
+    def get_periods(self, period_days : int = None, habit = None, habit_range : tuple = None):
+        """ periods generator with the columns of the database periods
+        Args:
+            period_days: only return periods with this length
+            habit: only return periods for this habit
+            habit_range: only return periods for habits with ids between (first, last), including both
+        """
+
+        for i in self._habit_indexes(period_days, habit, habit_range):
+            yield from self._period_rows(i)
+
+    def get_periods_between(self, start_date : date, end_date : date, habit_range : tuple = None):
+        """ periods generator for given timeframe
+        Args:
+            start_date: start of timeframe (including)
+            end_date: end of timeframe (including)
+            habit_range: only return periods for habits with ids between (first, last), including both
+        """
+
+        start_day = start_date.toordinal() - _EPOCH_ORDINAL
+        end_day = end_date.toordinal() - _EPOCH_ORDINAL
+
+        for i in self._habit_indexes(habit_range=habit_range):
+            yield from self._period_rows(i, start_day, end_day)
+
+    def _period_rows(self, index : int, start_day : int = None, end_day : int = None):
+        """ periods of a single habit as (period, nr, habit_id, habit_name, goal, start_date, end_date, progress),
+            optionally restricted to a timeframe in days since 1970-01-01
+        """
+
+        id, period, goal, first, count = (self._habits[column][index] for column in _HABIT_COLUMNS[:5])
+        name = self._habit_name(index)
+
+        for i in range(first, first + count):
+            start, end = self._start_days[i], self._end_days[i]
+
+            if start_day is not None and (start < start_day or end > end_day):
+                continue
+
+            yield (period, count - (i - first), id, name, goal, date.fromordinal(start + _EPOCH_ORDINAL).isoformat(),
+                   date.fromordinal(end + _EPOCH_ORDINAL).isoformat(), self._progress[i])